@@ -0,0 +1,9 @@
+"""
+benchmarks
+==========
+
+Benchmarks for msf_prompt's hot paths (tab-complete, auto-suggest, target and
+permission checks, command execution) run against a local mock msfrpcd.
+
+    python -m benchmarks.run -o results.json
+"""
@@ -0,0 +1,254 @@
+"""
+mock_msfrpcd
+============
+
+Provides MockMsfRpcd, a local stand-in for msfrpcd that speaks the same msgpack-RPC
+over HTTP so msf_prompt can be benchmarked without a Metasploit install.
+
+It answers the calls msf_prompt makes while prompting and running commands
+(auth.login, console.*, session.list, shell and meterpreter sessions, module lists,
+core.version, job.list and the db.* workspace calls) with generated data.  The latency
+of every call and the size of the answers (tab-complete candidates, console output,
+sessions, workspace hosts) are configurable.
+"""
+from __future__ import unicode_literals
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import msgpack
+
+# Seconds added to every call
+DEFAULT_LATENCY = 0.0
+# Candidates returned by console.tabs
+DEFAULT_TABS_SIZE = 1000
+# Bytes of output returned for each console command
+DEFAULT_OUTPUT_SIZE = 1024
+# Sessions returned by session.list
+DEFAULT_SESSIONS = 10
+# Hosts in the workspace (db.hosts)
+DEFAULT_HOSTS = 1000
+# Framework version reported by core.version
+MOCK_VERSION = "6.0.0-mock"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # answers are written as headers then body; don't wait on delayed ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = msgpack.unpackb(
+            self.rfile.read(int(self.headers["Content-Length"])), raw=False
+        )
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        mock.calls += 1
+        body = msgpack.packb(mock.answer(request[0], request[2:]))
+        self.send_response(200)
+        self.send_header("Content-Type", "binary/message-pack")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockMsfRpcd(object):
+    """msgpack-RPC server with msfrpcd's API and generated answers
+
+    Attributes
+    ----------
+    port : int
+        port the server listens on (chosen by the OS if 0 was given)
+    calls : int
+        calls answered so far
+
+    Methods
+    -------
+    start(self)
+        Serve on a background thread
+    stop(self)
+        Shut the server down
+    answer(self, method, args)
+        Answer for one call
+    """
+
+    def __init__(
+        self,
+        port=0,
+        latency=DEFAULT_LATENCY,
+        tabs_size=DEFAULT_TABS_SIZE,
+        output_size=DEFAULT_OUTPUT_SIZE,
+        sessions=DEFAULT_SESSIONS,
+        hosts=DEFAULT_HOSTS,
+    ):
+        """
+        Parameters
+        ----------
+        port : int, optional
+            port to listen on; 0 lets the OS choose
+        latency : float, optional
+            seconds added to every call
+        tabs_size : int, optional
+            candidates returned by console.tabs and the module lists
+        output_size : int, optional
+            bytes of output returned for each console or session command
+        sessions : int, optional
+            sessions returned by session.list
+        hosts : int, optional
+            hosts (each with two open services) in the workspace
+        """
+        self.latency = latency
+        self.tabs_size = tabs_size
+        self.output_size = output_size
+        self.sessions = sessions
+        self.hosts = hosts
+        self.calls = 0
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._consoles = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(
+            target=self._server.serve_forever, name="mock-msfrpcd", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _output(self, command):
+        line = f"[*] {command}\n"
+        return (line * (self.output_size // len(line) + 1))[: self.output_size]
+
+    def _modules(self):
+        return [
+            f"{platform}/{protocol}/module_{n}"
+            for n, (platform, protocol) in enumerate(
+                (
+                    ("windows", "smb"),
+                    ("linux", "http"),
+                    ("multi", "ssh"),
+                    ("unix", "ftp"),
+                )
+                * (self.tabs_size // 4 + 1)
+            )
+        ][: self.tabs_size]
+
+    def _host(self, n):
+        return f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+    def answer(self, method, args):
+        """
+        Parameters
+        ----------
+        method : str
+            RPC method (e.g. 'console.tabs')
+        args : list
+            arguments after the token
+
+        Returns
+        -------
+        _ : dict
+            what msfrpcd would return
+        """
+        if method == "auth.login":
+            return {"result": "success", "token": "mock-token"}
+        if method == "core.version":
+            return {"version": MOCK_VERSION, "ruby": "mock", "api": "1.0"}
+        if method == "console.create":
+            with self._lock:
+                self._consoles += 1
+                cid = str(self._consoles)
+            return {"id": cid, "prompt": "msf6 > ", "busy": False}
+        if method == "console.list":
+            return {
+                "consoles": [
+                    {"id": str(n), "prompt": "msf6 > ", "busy": False}
+                    for n in range(1, self._consoles + 1)
+                ]
+            }
+        if method == "console.tabs":
+            text = args[1]
+            # same shape as msfrpcd: full lines that continue the text
+            return {"tabs": [text + path for path in self._modules()]}
+        if method == "console.write":
+            with self._lock:
+                self._pending[("console", args[0])] = self._output(args[1].strip())
+            return {"wrote": len(args[1])}
+        if method == "console.read":
+            with self._lock:
+                data = self._pending.pop(("console", args[0]), "")
+            return {"data": data, "prompt": "msf6 > ", "busy": False}
+        if method in ("session.shell_write", "session.meterpreter_write"):
+            with self._lock:
+                self._pending[("session", str(args[0]))] = self._output(args[1].strip())
+            return {"write_count": str(len(args[1]))}
+        if method in ("session.shell_read", "session.meterpreter_read"):
+            with self._lock:
+                data = self._pending.pop(("session", str(args[0])), "")
+            return {"seq": "0", "data": data}
+        if method == "session.list":
+            return {
+                n: {
+                    "type": "meterpreter" if n % 2 else "shell",
+                    "session_host": self._host(n),
+                    "platform": "windows" if n % 2 else "linux",
+                    "via_exploit": "exploit/multi/handler",
+                    "uuid": f"mock{n}",
+                }
+                for n in range(1, self.sessions + 1)
+            }
+        if method == "job.list":
+            return {}
+        if method.startswith("module.") and method[7:] in (
+            "exploits",
+            "auxiliary",
+            "post",
+            "payloads",
+            "encoders",
+            "nops",
+            "evasion",
+        ):
+            return {"modules": self._modules()}
+        if method == "db.current_workspace":
+            return {"workspace": "default", "workspace_id": 1}
+        if method == "db.hosts":
+            options = args[0] if args else {}
+            offset, limit = options.get("offset", 0), options.get("limit", 100)
+            return {
+                "hosts": [
+                    {"address": self._host(n), "updated_at": 0, "state": "alive"}
+                    for n in range(offset, min(offset + limit, self.hosts))
+                ]
+            }
+        if method == "db.services":
+            options = args[0] if args else {}
+            offset, limit = options.get("offset", 0), options.get("limit", 100)
+            return {
+                "services": [
+                    {
+                        "host": self._host(n // 2),
+                        "port": (445, 22)[n % 2],
+                        "name": ("smb", "ssh")[n % 2],
+                        "proto": "tcp",
+                        "state": "open",
+                    }
+                    for n in range(offset, min(offset + limit, 2 * self.hosts))
+                ]
+            }
+        return {"result": "success"}
@@ -0,0 +1,157 @@
+"""
+replay
+======
+
+Runs a recorded msf_prompt session again from a tape (see msf_prompt.utils.tape) and
+reports how long each step took, so the same real-world session can be timed across
+versions without msfrpcd.
+
+    python -m benchmarks.replay TAPE [--speed N] [-t TARGET_FILE] [-u PERM_FILE]
+                                     [-o FILE]
+
+Record a tape by running msf_prompt with '--record-tape session.tape'.  The replay
+drives an OffPromptSession with what the operator did on the tape: every command sent
+to the console (console.write) goes through handle_input, every console.tabs becomes a
+tab-complete of the same text and every console.read reads the console.  msfrpcd's
+answers come from the tape, taking the recorded time divided by '--speed' ('--speed 0'
+answers immediately and doesn't wait between steps).
+
+Steps are reported as mean, p50, p95, p99 and max in milliseconds, with the peak memory
+allocated while replaying.  Overrides are taken without asking; the commands on the
+tape already ran, so give the same target and permission files they were checked
+against.
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+from optparse import OptionParser
+from time import monotonic, perf_counter, sleep
+
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+import msf_prompt
+from msf_prompt.offpromptsession import MsfCompleter, OffPromptSession, TabSource
+from msf_prompt.rpcconsole import RpcConsole
+from msf_prompt.utils.tape import TapeRpcClient
+
+from .run import print_report, summarize
+
+
+class ReplaySession(OffPromptSession):
+    """OffPromptSession that takes every override instead of asking"""
+
+    def confirm(self, title, text):
+        return True
+
+
+def run(options):
+    """
+    Parameters
+    ----------
+    options : optparse.Values
+        command line options (tape, speed, target_file, perm_file)
+
+    Returns
+    -------
+    report : dict
+        parameters, the stats of each kind of step and the peak allocation
+    """
+    client = TapeRpcClient(options.tape, speed=options.speed)
+    samples = {}
+
+    with tempfile.TemporaryDirectory() as directory, create_pipe_input() as pipe:
+        console = RpcConsole(client, cb=lambda data: None)
+        session = ReplaySession(
+            console,
+            hist_name=os.path.join(directory, "history"),
+            target_filename=options.target_file,
+            module_filename=options.perm_file,
+            allow_overrides=True,
+            input=pipe,
+            output=DummyOutput(),
+        )
+        completer = MsfCompleter(console, TabSource(console))
+        event = CompleteEvent(completion_requested=True)
+        steps = {
+            "console.write": lambda opts: session.handle_input(opts[1].rstrip("\n")),
+            "console.tabs": lambda opts: list(
+                completer.get_completions(Document(opts[1]), event)
+            ),
+            "console.read": lambda opts: console.read(),
+        }
+
+        tracemalloc.start()
+        start = monotonic()
+        for offset, elapsed, method, opts, response in client.records:
+            step = steps.get(method)
+            if step is None:
+                # answered from the tape when the session asks for it
+                continue
+            if options.speed:
+                # the operator's think time between steps, scaled like the calls
+                sleep(max(0.0, start + offset / options.speed - monotonic()))
+            begin = perf_counter()
+            try:
+                step(opts)
+            except EOFError:
+                # 'exit' on the tape
+                break
+            words = opts[1].split() if method != "console.read" else []
+            label = f"{method}[{words[0]}]" if words else method
+            samples.setdefault(label, []).append(perf_counter() - begin)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "msf_prompt": msf_prompt.__version__,
+        "python": platform.python_version(),
+        "params": {
+            "tape": options.tape,
+            "speed": options.speed,
+            "recorded_calls": len(client.records),
+            "misses": client.misses,
+            "peak_alloc_kb": peak // 1024,
+        },
+        "results": {label: summarize(s) for label, s in sorted(samples.items())},
+    }
+
+
+def parseargs(argv=None):
+    p = OptionParser(usage="%prog TAPE [options]")
+    p.add_option(
+        "--speed",
+        dest="speed",
+        type="float",
+        default=1.0,
+        help="How much faster than recorded to replay; 0 for no delays",
+    )
+    p.add_option("-t", dest="target_file", help="Target white-list to check against")
+    p.add_option("-u", dest="perm_file", help="Module permissions to check against")
+    p.add_option("-o", dest="output", help="Write the results as JSON to this file")
+    o, a = p.parse_args(argv)
+    if len(a) != 1:
+        p.error("give the tape to replay")
+    o.tape = a[0]
+    return o
+
+
+def main(argv=None):
+    options = parseargs(argv)
+    report = run(options)
+    print_report(report)
+    if options.output:
+        with open(options.output, "w") as outfi:
+            json.dump(report, outfi, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
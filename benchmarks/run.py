@@ -0,0 +1,336 @@
+"""
+run
+===
+
+Runs every benchmark against a MockMsfRpcd and prints a table of latencies; '-o' also
+writes them as JSON so runs can be compared across versions.
+
+    python -m benchmarks.run [--latency SECONDS] [--tabs N] [--output-size BYTES]
+                             [--networks N] [--modules N] [--coalesce]
+                             [-n ITERATIONS] [--input-iterations N] [-o FILE]
+
+Each benchmark is timed per call, after a few warm-up calls, and reported as mean,
+p50, p95, p99 and max in milliseconds.  Calls aren't coalesced unless '--coalesce' is
+given, so every tab-complete is a round trip to the mock.  handle_input includes the
+one second it sleeps after sending a command, so it runs fewer iterations.
+"""
+from __future__ import unicode_literals
+
+import ipaddress
+import json
+import os
+import pickle
+import platform
+import sys
+import tempfile
+from optparse import OptionParser
+from time import perf_counter
+
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+from prompt_toolkit.history import InMemoryHistory
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+import msf_prompt
+from msf_prompt.offpromptsession import (
+    MsfAutoSuggest,
+    MsfCompleter,
+    OffPromptSession,
+    TabSource,
+    load_wordlist,
+)
+from msf_prompt.rpcconsole import RpcConsole
+from msf_prompt.sessionindex import stream_command
+from msf_prompt.utils.transport import PooledMsfRpcClient
+
+from .mock_msfrpcd import MockMsfRpcd, DEFAULT_TABS_SIZE, DEFAULT_OUTPUT_SIZE
+
+# Timed calls per benchmark
+DEFAULT_ITERATIONS = 200
+# Timed calls of handle_input (each sleeps a second after sending the command)
+DEFAULT_INPUT_ITERATIONS = 5
+# Untimed calls before timing starts
+DEFAULT_WARMUP = 5
+# /24 networks on the target white-list
+DEFAULT_NETWORKS = 256
+# Modules each user is allowed to run
+DEFAULT_MODULES = 1000
+# Targets in each 'set RHOSTS' check
+TARGETS_PER_CHECK = 16
+# Word suggestions shipped with msf_prompt
+WORDLIST_FILE = os.path.join(
+    os.path.dirname(msf_prompt.__file__), "configs", "word_suggestions.txt"
+)
+
+
+def summarize(samples):
+    """
+    Parameters
+    ----------
+    samples : list[float]
+        seconds each call took
+
+    Returns
+    -------
+    stats : dict
+        calls and mean/p50/p95/p99/max in milliseconds
+    """
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "calls": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure(fn, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP):
+    """Time iterations calls of fn after warmup untimed calls"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    return summarize(samples)
+
+
+def write_policy(directory, networks, modules, user):
+    """Write a target white-list and module permissions of the given sizes
+
+    Returns
+    -------
+    target_filename, module_filename : tuple(str, str)
+    """
+    targets = [
+        ipaddress.ip_network(f"10.{n // 256}.{n % 256}.0/24") for n in range(networks)
+    ]
+    targets += [
+        ipaddress.ip_address(f"172.16.{n // 256}.{n % 256}") for n in range(networks)
+    ]
+    allowed = [f"exploit/windows/smb/module_{n}" for n in range(modules)]
+    allowed.append("auxiliary/scanner/*")
+    target_filename = os.path.join(directory, "allowed_targets.pickle")
+    module_filename = os.path.join(directory, "user_module_list.pickle")
+    with open(target_filename, "wb") as outfi:
+        pickle.dump(targets, outfi)
+    with open(module_filename, "wb") as outfi:
+        pickle.dump({user: allowed, "ALL": []}, outfi)
+    return target_filename, module_filename
+
+
+def run(options):
+    """
+    Parameters
+    ----------
+    options : optparse.Values
+        command line options
+
+    Returns
+    -------
+    report : dict
+        parameters and the stats of each benchmark
+    """
+    mock = MockMsfRpcd(
+        latency=options.latency,
+        tabs_size=options.tabs,
+        output_size=options.output_size,
+    ).start()
+    client = PooledMsfRpcClient(
+        "password",
+        username="msf",
+        server="127.0.0.1",
+        port=mock.port,
+        ssl=False,
+        coalesce=options.coalesce,
+    )
+    iterations = options.iterations
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory, create_pipe_input() as pipe:
+        # output is read (and dropped) by the console.read benchmark
+        console = RpcConsole(client, cb=lambda data: None)
+        session = OffPromptSession(
+            console,
+            hist_name=os.path.join(directory, "history"),
+            input=pipe,
+            output=DummyOutput(),
+        )
+        target_filename, module_filename = write_policy(
+            directory, options.networks, options.modules, session.current_user
+        )
+        session.policy.target_filename = target_filename
+        session.policy.module_filename = module_filename
+        session.policy.refresh(force=True)
+
+        # keystroke to completion: msfrpcd's tabs() answer grouped by next segment
+        completer = MsfCompleter(console, TabSource(console))
+        event = CompleteEvent(completion_requested=True)
+        for text in ("use ", "set payload windows/"):
+            document = Document(text)
+            results[f"completer[{text.strip()}]"] = measure(
+                lambda: list(completer.get_completions(document, event)), iterations
+            )
+
+        # keystroke to suggestion: history, wordlist, then msfrpcd's tabs()
+        auto_suggest = MsfAutoSuggest(
+            console, load_wordlist(WORDLIST_FILE), TabSource(console)
+        )
+        buffer = Buffer(history=InMemoryHistory())
+        for text in ("sho", "use windows/smb/mod"):
+            document = Document(text)
+            results[f"auto_suggest[{text}]"] = measure(
+                lambda: auto_suggest.get_suggestion(buffer, document), iterations
+            )
+
+        targets = [
+            f"10.{n % options.networks // 256}.{n % options.networks % 256}.{n + 1}"
+            for n in range(TARGETS_PER_CHECK)
+        ]
+        results["validate_targets"] = measure(
+            lambda: session.validate_targets(targets), iterations
+        )
+        results["validate_user_perms[exact]"] = measure(
+            lambda: session.validate_user_perms(
+                f"exploit/windows/smb/module_{options.modules - 1}"
+            ),
+            iterations,
+        )
+        results["validate_user_perms[wildcard]"] = measure(
+            lambda: session.validate_user_perms("auxiliary/scanner/smb/smb_version"),
+            iterations,
+        )
+
+        # submitted line: policy checks alone, then through to console.write
+        rhosts = " ".join(targets)
+        results["validate_input[set RHOSTS]"] = measure(
+            lambda: session.validate_input(f"set RHOSTS {rhosts}"), iterations
+        )
+        commands = {"version": "version", "set RHOSTS": f"set RHOSTS {rhosts}"}
+        for label, text in commands.items():
+            results[f"handle_input[{label}]"] = measure(
+                lambda: session.handle_input(text), options.input_iterations, warmup=1
+            )
+        results["console.read"] = measure(console.read, iterations)
+
+        # command on a shell session: write, then read until the output settles
+        shell = client.sessions.session("2")
+        results["shell_command"] = measure(
+            lambda: stream_command(shell, "id", read_interval=0.001, settle_reads=1),
+            iterations,
+        )
+
+    mock.stop()
+    return {
+        "msf_prompt": msf_prompt.__version__,
+        "python": platform.python_version(),
+        "params": {
+            "latency": options.latency,
+            "tabs": options.tabs,
+            "output_size": options.output_size,
+            "networks": options.networks,
+            "modules": options.modules,
+            "coalesce": options.coalesce,
+            "iterations": iterations,
+            "input_iterations": options.input_iterations,
+        },
+        "rpc_calls": mock.calls,
+        "results": results,
+    }
+
+
+def print_report(report):
+    print(f"msf_prompt {report['msf_prompt']} on Python {report['python']}")
+    print(", ".join(f"{k}={v}" for k, v in report["params"].items()))
+    print(f"{'benchmark':<34}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, stats in report["results"].items():
+        print(
+            f"{name:<34}{stats['mean_ms']:9.3f}{stats['p50_ms']:9.3f}"
+            f"{stats['p95_ms']:9.3f}{stats['p99_ms']:9.3f}{stats['max_ms']:9.3f}"
+        )
+
+
+def parseargs(argv=None):
+    p = OptionParser()
+    p.add_option(
+        "--latency",
+        dest="latency",
+        type="float",
+        default=0.0,
+        help="Seconds the mock msfrpcd adds to every call",
+    )
+    p.add_option(
+        "--tabs",
+        dest="tabs",
+        type="int",
+        default=DEFAULT_TABS_SIZE,
+        help="Candidates returned by console.tabs",
+    )
+    p.add_option(
+        "--output-size",
+        dest="output_size",
+        type="int",
+        default=DEFAULT_OUTPUT_SIZE,
+        help="Bytes of output for each console or session command",
+    )
+    p.add_option(
+        "--networks",
+        dest="networks",
+        type="int",
+        default=DEFAULT_NETWORKS,
+        help="/24 networks (and as many single addresses) on the target white-list",
+    )
+    p.add_option(
+        "--modules",
+        dest="modules",
+        type="int",
+        default=DEFAULT_MODULES,
+        help="Modules the user is allowed to run",
+    )
+    p.add_option(
+        "-n",
+        dest="iterations",
+        type="int",
+        default=DEFAULT_ITERATIONS,
+        help="Timed calls per benchmark",
+    )
+    p.add_option(
+        "--input-iterations",
+        dest="input_iterations",
+        type="int",
+        default=DEFAULT_INPUT_ITERATIONS,
+        help="Timed calls of handle_input",
+    )
+    p.add_option(
+        "--coalesce",
+        dest="coalesce",
+        action="store_true",
+        default=False,
+        help="Let the client coalesce identical read-only calls (as msf_prompt does)",
+    )
+    p.add_option("-o", dest="output", help="Write the results as JSON to this file")
+    o, a = p.parse_args(argv)
+    return o
+
+
+def main(argv=None):
+    options = parseargs(argv)
+    report = run(options)
+    print_report(report)
+    if options.output:
+        with open(options.output, "w") as outfi:
+            json.dump(report, outfi, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -21,6 +21,7 @@ __all__ = [
     # Offpromptsession.
     "MsfAutoSuggest",
     "MsfCompleter",
+    "TabSource",
     "OffPromptSession",
     "OffPromptShellSession",
     "InvalidTargetError",
@@ -0,0 +1,190 @@
+"""
+asyncloop
+=========
+
+Provides AsyncPromptLoop, an asyncio main loop for an OffPromptSession built on
+prompt_async.
+
+Everything runs as a task on one event loop so the prompt stays live while a command
+runs:
+    - the prompt itself (prompt_async); submitted lines are queued
+    - command execution; queued lines are handed to handle_input one at a time on a
+      worker thread, in the order they were typed
+    - console output; every RpcConsole is read on an interval
+    - session/job polling; the session registry is refreshed, which announces
+      opened and closed sessions/jobs
+    - policy reload; the target white-list and permissions are re-checked on disk
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .utils.patch_stdout_shim import patch_stdout
+    from .msf_prompt_styles import msf_style
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from utils.patch_stdout_shim import patch_stdout
+    from msf_prompt_styles import msf_style
+
+# Seconds between reads of console output
+DEFAULT_OUTPUT_INTERVAL = 0.5
+# Seconds between polls of msfrpcd for sessions and jobs
+DEFAULT_SESSION_POLL_INTERVAL = 2.0
+# Seconds between checks of the policy files
+DEFAULT_POLICY_RELOAD_INTERVAL = 5.0
+
+
+class AsyncPromptLoop(object):
+    """Run an OffPromptSession and its background work as tasks on one event loop
+
+    Attributes
+    ----------
+    session : OffPromptSession
+        the prompt
+    handler : object
+        has handle_input(text); the session itself or a ConsoleMultiplexer
+    commands : asyncio.Queue
+        lines typed by the user that haven't run yet
+
+    Methods
+    -------
+    run(self)
+        Coroutine that prompts the user until they exit
+    """
+
+    def __init__(
+        self,
+        session,
+        handler,
+        formatted_prompt,
+        consoles,
+        output_interval=DEFAULT_OUTPUT_INTERVAL,
+        session_poll_interval=DEFAULT_SESSION_POLL_INTERVAL,
+        policy_reload_interval=DEFAULT_POLICY_RELOAD_INTERVAL,
+        pre_run=None,
+    ):
+        """
+        Parameters
+        ----------
+        session : OffPromptSession
+            the prompt
+        handler : object
+            has handle_input(text); the session itself or a ConsoleMultiplexer
+        formatted_prompt : callable
+            returns the prompt fragments for the active console
+        consoles : callable
+            returns the RpcConsoles whose output should be read
+        output_interval : float, optional
+            seconds between reads of console output
+        session_poll_interval : float, optional
+            seconds between polls of msfrpcd for sessions and jobs
+        policy_reload_interval : float, optional
+            seconds between checks of the policy files
+        pre_run : callable, optional
+            called each time the prompt is about to be shown (e.g. StartupTrace.report)
+        """
+        self.session = session
+        self.handler = handler
+        self.formatted_prompt = formatted_prompt
+        self.consoles = consoles
+        self.output_interval = float(output_interval)
+        self.session_poll_interval = float(session_poll_interval)
+        self.policy_reload_interval = float(policy_reload_interval)
+        self.pre_run = pre_run
+
+        self.commands = None
+        # commands must run one at a time, in order
+        self._command_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="command"
+        )
+
+    async def run(self):
+        """Prompt the user until they exit while the background tasks run"""
+        self.commands = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(self._run_commands()),
+            asyncio.ensure_future(self._read_output()),
+            asyncio.ensure_future(self._poll_sessions()),
+            asyncio.ensure_future(self._reload_policy()),
+        ]
+        try:
+            with patch_stdout():
+                while True:
+                    try:
+                        user_input = await self.session.prompt_async(
+                            self.formatted_prompt, style=msf_style, pre_run=self.pre_run
+                        )
+                    except KeyboardInterrupt:
+                        continue
+                    except EOFError:
+                        break
+                    await self.commands.put(user_input)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._command_executor.shutdown(wait=False)
+
+    async def _run_commands(self):
+        """Hand queued lines to handle_input one at a time on the command thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            text = await self.commands.get()
+            try:
+                await loop.run_in_executor(
+                    self._command_executor, self.handler.handle_input, text
+                )
+            except EOFError:
+                # user typed exit; end the prompt
+                if self.session.app.is_running:
+                    self.session.app.exit(exception=EOFError())
+                return
+            except Exception as e:
+                print(f"something when very wrong, {e}")
+                logging.warning(f"something went very wrong {e}")
+            finally:
+                self.commands.task_done()
+            self._invalidate()
+
+    def _invalidate(self):
+        """Redraw the prompt (e.g. after msfrpcd changed it)"""
+        if self.session.app.is_running:
+            self.session.app.invalidate()
+
+    async def _read_output(self):
+        """Read every console's output on an interval"""
+        loop = asyncio.get_running_loop()
+        while True:
+            for console in list(self.consoles()):
+                prompt = console.prompt
+                try:
+                    await loop.run_in_executor(None, console.read)
+                except Exception as e:
+                    logging.warning(f"from console read\n<<< {str(e)}")
+                if console.prompt != prompt:
+                    self._invalidate()
+            await asyncio.sleep(self.output_interval)
+
+    async def _poll_sessions(self):
+        """Refresh the session registry, which announces opened/closed sessions and jobs"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.session.registry.refresh)
+            except Exception as e:
+                logging.warning(f"from session poll\n<<< {str(e)}")
+            await asyncio.sleep(self.session_poll_interval)
+
+    async def _reload_policy(self):
+        """Pick up changes to the target white-list and permissions"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.policy_reload_interval)
+            try:
+                if await loop.run_in_executor(None, self.session.policy.refresh, True):
+                    logging.info("[POLICY] reloaded target white-list and permissions")
+            except Exception as e:
+                logging.warning(f"from policy reload\n<<< {str(e)}")
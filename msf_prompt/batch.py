@@ -0,0 +1,254 @@
+"""
+batch
+=====
+
+Provides BatchRunner, a headless runner for msfconsole resource scripts.
+
+The whole script is checked before anything is sent to msfrpcd: every line goes
+through the same target white-list and permission checks as a typed command, with
+the yes/no questions answered without a terminal ('exploit' is confirmed, overrides
+are only taken if the runner was told to force them).  run/exploit lines are also
+checked against the RHOSTS the script will have set by then.  If any line fails the
+batch is rejected and nothing runs.
+
+Lines are then executed one after another; each is finished as soon as msfrpcd
+reports the console idle (no fixed sleep between commands).  A JSON results file
+records the validation and output of every line.
+"""
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import tempfile
+from time import monotonic, sleep
+
+try:
+    from .offpromptsession import UserOverride, UserOverrideDenied
+    from .cmdqueue import ProjectedDatastore
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from offpromptsession import UserOverride, UserOverrideDenied
+    from cmdqueue import ProjectedDatastore
+
+# Seconds between reads of the console while a command is running
+DEFAULT_READ_INTERVAL = 0.05
+# Seconds a single command may run before the batch gives up on it
+DEFAULT_COMMAND_TIMEOUT = 300
+# Commands that need a terminal and can't be part of a batch
+UNSUPPORTED_COMMANDS = ("sessions -i", "exit", "fanout")
+
+
+class BatchRunner(object):
+    """Validate and run a resource script through an OffPromptSession's policy
+
+    Attributes
+    ----------
+    session : OffPromptSession
+        session whose policy checks are used; its console must be an RpcConsole
+    force : bool
+        answer yes to override questions (only asked if the session allows overrides)
+    results : list[dict]
+        one entry per command: line number, command, validation, status, output, elapsed
+
+    Methods
+    -------
+    load(filename)
+        Read the commands from a resource script
+    validate(self, commands)
+        Check every command without running any; True if the batch may run
+    execute(self)
+        Run the validated commands in order
+    run(self, filename, results_filename=None)
+        load, validate, execute and write the results file
+    """
+
+    def __init__(
+        self,
+        session,
+        force=False,
+        read_interval=DEFAULT_READ_INTERVAL,
+        command_timeout=DEFAULT_COMMAND_TIMEOUT,
+    ):
+        """
+        Parameters
+        ----------
+        session : OffPromptSession
+            session whose policy checks are used; its console must be an RpcConsole
+        force : bool, optional
+            answer yes to override questions
+        read_interval : float, optional
+            seconds between reads of the console while a command is running
+        command_timeout : float, optional
+            seconds a single command may run
+        """
+        self.session = session
+        self.force = force
+        self.read_interval = float(read_interval)
+        self.command_timeout = float(command_timeout)
+        self.results = []
+
+    @staticmethod
+    def load(filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            resource script; blank lines and '#' comments are skipped
+
+        Returns
+        -------
+        commands : list[tuple(int, str)]
+            line number and command
+        """
+        commands = []
+        with open(filename) as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    commands.append((number, line))
+        return commands
+
+    def _answer(self, title, text):
+        """Non-interactive stand-in for OffPromptSession.confirm"""
+        if title == "Confirm Exploit":
+            # running the script is the confirmation
+            return True
+        return self.force
+
+    def validate(self, commands):
+        """Check every command against the policy without running any
+
+        Parameters
+        ----------
+        commands : list[tuple(int, str)]
+            line number and command
+
+        Returns
+        -------
+        _ : bool
+            True if no command was denied
+        """
+        datastore = ProjectedDatastore()
+        self.results = []
+        confirm = self.session.confirm
+        self.session.confirm = self._answer
+        try:
+            for number, text in commands:
+                validation = self._check(text, datastore)
+                datastore.apply(text)
+                self.results.append(
+                    {
+                        "line": number,
+                        "command": text,
+                        "validation": validation,
+                        "status": "pending",
+                        "output": "",
+                        "elapsed": None,
+                    }
+                )
+        finally:
+            self.session.confirm = confirm
+        return all(r["validation"] in ("ok", "override") for r in self.results)
+
+    def _check(self, text, datastore):
+        """Validation result for one command: ok, override, denied or unsupported"""
+        lower_text = text.lower()
+        if lower_text.startswith(UNSUPPORTED_COMMANDS):
+            return "unsupported"
+        checks = [text]
+        rhosts = datastore.get("RHOSTS")
+        if lower_text.startswith(("run", "exploit")) and rhosts:
+            # the target the module will actually be run against
+            checks.append(f"set RHOSTS {rhosts}")
+        validation = "ok"
+        for check in checks:
+            try:
+                self.session.check_policy(check)
+            except UserOverride as e:
+                logging.warning(f"[BATCH] USER WARNING OVERRIDE: {e}")
+                self.session.perf.incr("overrides")
+                validation = "override"
+            except UserOverrideDenied as e:
+                logging.warning(f"[BATCH] WARNING OVERRIDE DENIED: {e}")
+                self.session.perf.incr("denials")
+                return "denied"
+            except Exception as e:
+                logging.warning(f"[BATCH] from validate\n<<< {str(e)}")
+                return "denied"
+        return validation
+
+    def execute(self):
+        """Run the validated commands in order, each until msfrpcd reports it done"""
+        console = self.session.msf_console
+        for result in self.results:
+            text = result["command"]
+            logging.info(f"[COMMAND][USER: {self.session.current_user}][BATCH]\n+ {text}")
+            self.session.perf.incr("commands")
+            start = monotonic()
+            output = []
+            try:
+                console.execute(text)
+                idle_reads = 0
+                while True:
+                    data = console.read()
+                    if data.get("data"):
+                        output.append(data["data"])
+                    # msfrpcd may not have picked up the write yet; a command is only
+                    # done once it has produced output or the console stays idle
+                    idle_reads = 0 if data.get("busy") else idle_reads + 1
+                    if idle_reads and (output or idle_reads >= 2):
+                        result["status"] = "done"
+                        break
+                    if monotonic() - start > self.command_timeout:
+                        result["status"] = "timeout"
+                        break
+                    sleep(self.read_interval)
+            except Exception as e:
+                logging.warning(f"[BATCH] from execute\n<<< {str(e)}")
+                result["status"] = "error"
+                output.append(str(e))
+            result["output"] = "".join(output)
+            result["elapsed"] = round(monotonic() - start, 3)
+            if result["status"] != "done":
+                break
+
+    def run(self, filename, results_filename=None):
+        """Validate and run a resource script
+
+        Parameters
+        ----------
+        filename : str
+            resource script
+        results_filename : str, optional
+            where the JSON results are written; defaults to <filename>.results.json
+
+        Returns
+        -------
+        _ : bool
+            True if every command ran to completion
+        """
+        logging.info(f"[BATCH][USER: {self.session.current_user}] {filename}")
+        if self.validate(self.load(filename)):
+            self.execute()
+        else:
+            for result in self.results:
+                result["status"] = "rejected"
+            print(f"[-] {filename} was rejected; no commands were run")
+            logging.warning(f"[BATCH] {filename} rejected")
+
+        succeeded = all(r["status"] == "done" for r in self.results)
+        summary = {
+            "resource_file": filename,
+            "user": self.session.current_user,
+            "succeeded": succeeded,
+            "commands": self.results,
+        }
+        results_filename = results_filename or f"{filename}.results.json"
+        directory = os.path.dirname(os.path.abspath(results_filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp, results_filename)
+        print(f"[*] Results written to {results_filename}")
+        return succeeded
@@ -0,0 +1,296 @@
+"""
+cmdqueue
+========
+
+Provides CommandPipeline, a type-ahead queue that lets the user keep typing while
+earlier commands are still running on msfrpcd.
+
+Each command is validated the moment it is submitted (target white-list, module
+permissions, 'exploit' confirmation) against the policy and a ProjectedDatastore: the
+module and options the console will have once everything ahead of it has run.  Accepted
+commands are written to the msfrpcd console back-to-back by a worker thread, without
+the one second sleep OffPromptSession.handle_input uses.
+
+Commands that change what the prompt is attached to ('exit', 'sessions -i', anything
+typed inside a shell, multiplexer built-ins) wait for the queue to drain and then go
+through the normal handle_input.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import deque
+from time import sleep
+
+try:
+    from .offpromptsession import InvalidTargetError
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from offpromptsession import InvalidTargetError
+
+# Seconds between checks of whether msfrpcd has finished the commands sent to it
+DEFAULT_BUSY_POLL_INTERVAL = 0.25
+
+
+class ProjectedDatastore(object):
+    """The console's module and options as they will be after the queued commands
+
+    Attributes
+    ----------
+    module : str
+        module selected by the last 'use' (None after 'back')
+    options : dict[str, str]
+        options set with 'set' since the module was selected
+    global_options : dict[str, str]
+        options set with 'setg'
+
+    Methods
+    -------
+    apply(self, text)
+        Update the projection with a command
+    get(self, name)
+        Projected value of an option (module option, then global)
+    """
+
+    def __init__(self):
+        self.module = None
+        self.options = {}
+        self.global_options = {}
+
+    def apply(self, text):
+        """
+        Parameters
+        ----------
+        text : str
+            command that will be sent to msfrpcd
+        """
+        words = text.split()
+        if not words:
+            return
+        command = words[0].lower()
+        if command == "use" and len(words) > 1:
+            self.module = words[1]
+            self.options = {}
+        elif command == "back":
+            self.module = None
+            self.options = {}
+        elif command == "set" and len(words) > 2:
+            self.options[words[1].upper()] = " ".join(words[2:])
+        elif command == "setg" and len(words) > 2:
+            self.global_options[words[1].upper()] = " ".join(words[2:])
+        elif command == "unset" and len(words) > 1:
+            self.options.pop(words[1].upper(), None)
+        elif command == "unsetg" and len(words) > 1:
+            self.global_options.pop(words[1].upper(), None)
+
+    def get(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            option name (case insensitive)
+
+        Returns
+        -------
+        _ : str or None
+            projected value of the option
+        """
+        name = name.upper()
+        return self.options.get(name, self.global_options.get(name))
+
+
+class CommandPipeline(object):
+    """Type-ahead command queue with validation at submit time
+
+    Attributes
+    ----------
+    session : OffPromptSession
+        session whose policy checks are used and whose console commands are sent to
+    handler : object
+        has handle_input(text); the session itself or a ConsoleMultiplexer
+    datastore : ProjectedDatastore
+        console state once the queued commands have run
+    current : str
+        command msfrpcd is working on (the last one sent), None when idle
+    sent, rejected : int
+        commands sent to msfrpcd and commands that failed validation
+
+    Methods
+    -------
+    handle_input(self, text)
+        Validate and queue a command (or run it directly if it can't be queued)
+    wait_idle(self, timeout=None)
+        Block until every queued command has been sent and msfrpcd is idle
+    depth(self)
+        Number of commands queued or still running on msfrpcd
+    status_fragments(self)
+        Prompt fragments showing the queue depth
+    """
+
+    def __init__(self, session, handler=None, poll_interval=DEFAULT_BUSY_POLL_INTERVAL):
+        """
+        Parameters
+        ----------
+        session : OffPromptSession
+            session whose policy checks are used and whose console commands are sent to
+        handler : object, optional
+            has handle_input(text); defaults to the session
+        poll_interval : float, optional
+            seconds between checks of whether msfrpcd is still busy
+        """
+        self.session = session
+        self.handler = handler if handler is not None else session
+        self.poll_interval = poll_interval
+        self.datastore = ProjectedDatastore()
+        self.current = None
+        self.sent = 0
+        self.rejected = 0
+
+        self._queue = deque()
+        self._in_flight = 0
+        self._overridden = set()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._worker, name="pipeline", daemon=True).start()
+
+    def _pipelined(self, text):
+        """True if text is a plain console command that can be queued"""
+        lower_text = text.lower().strip()
+        if not lower_text or self.session.active_shell:
+            return False
+        if lower_text == "exit" or lower_text.startswith("sessions -i"):
+            return False
+        if self.session.result_cache is not None and self.session.result_cache.cacheable(
+            text
+        ):
+            # answered by handle_input from the result cache
+            return False
+        builtins = self.session.builtin_commands + getattr(
+            self.handler, "builtin_commands", ()
+        )
+        return lower_text.split()[0] not in builtins
+
+    def handle_input(self, text):
+        """Validate a command now and queue it to be sent to msfrpcd
+
+        Parameters
+        ----------
+        text : str
+            The user-submitted command
+        """
+        if not self._pipelined(text):
+            # changes what the prompt is attached to; let everything ahead finish first
+            self.wait_idle()
+            self.handler.handle_input(text)
+            return
+
+        logging.info(f"[COMMAND][USER: {self.session.current_user}]\n+ {text}")
+        self.session.perf.incr("commands")
+        try:
+            accepted = self.session.validate_input(text) and self._validate_projected(
+                text
+            )
+        except Exception as e:
+            print(str(e))
+            logging.warning(f"from pipeline\n<<< {str(e)}")
+            accepted = False
+        if not accepted:
+            self.rejected += 1
+            return
+
+        self.datastore.apply(text)
+        with self._cond:
+            self._queue.append(text)
+            self._cond.notify_all()
+
+    def _validate_projected(self, text):
+        """Check 'set rhosts' overrides and 'run'/'exploit' against the projection"""
+        lower_text = text.lower().strip()
+        if lower_text.startswith("set") and "rhost" in lower_text:
+            # validate_input passed; remember if that was only by override
+            try:
+                self.session.validate_targets(self.session.rhosts_targets(text))
+            except InvalidTargetError:
+                self._overridden.add(" ".join(text.split()[2:]))
+        elif lower_text.startswith(("run", "exploit")):
+            rhosts = self.datastore.get("RHOSTS")
+            if rhosts and rhosts not in self._overridden:
+                # the white-list may have changed since RHOSTS was queued
+                return self.session.validate_input(f"set RHOSTS {rhosts}")
+        return True
+
+    def _worker(self):
+        """Send queued commands back-to-back, then wait for msfrpcd to finish them"""
+        idle_polls = 0
+        while True:
+            with self._cond:
+                while not self._queue and not self._in_flight:
+                    self._cond.wait()
+                text = self._queue.popleft() if self._queue else None
+
+            if text is not None:
+                idle_polls = 0
+                try:
+                    self.session.msf_console.execute(text)
+                    with self._cond:
+                        self.current = text
+                        self._in_flight += 1
+                        self.sent += 1
+                except Exception as e:
+                    print(str(e))
+                    logging.warning(f"from pipeline execute\n<<< {str(e)}")
+                continue
+
+            try:
+                busy = self.session.msf_console.console.is_busy()
+            except Exception as e:
+                logging.warning(f"from pipeline busy check\n<<< {str(e)}")
+                busy = False
+            # msfrpcd may not have picked up the last write yet; wait for two idle checks
+            idle_polls = 0 if busy else idle_polls + 1
+            if idle_polls < 2:
+                sleep(self.poll_interval)
+                continue
+            with self._cond:
+                self._in_flight = 0
+                self.current = None
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued command has been sent and msfrpcd is idle
+
+        Parameters
+        ----------
+        timeout : float, optional
+            seconds to wait; forever if None
+
+        Returns
+        -------
+        _ : bool
+            True if the queue drained
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._in_flight, timeout
+            )
+
+    def depth(self):
+        """
+        Returns
+        -------
+        _ : int
+            commands queued or still running on msfrpcd
+        """
+        with self._cond:
+            return len(self._queue) + self._in_flight
+
+    def status_fragments(self):
+        """
+        Returns
+        -------
+        _ : list
+            prompt fragments showing the queue depth; empty when idle
+        """
+        depth = self.depth()
+        if not depth:
+            return []
+        return [("class:queue", f"[queued: {depth}] ")]
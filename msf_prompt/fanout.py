@@ -0,0 +1,295 @@
+"""
+fanout
+======
+
+Provides FanOut, which runs one shell/meterpreter command across many sessions at
+once through a bounded worker pool.
+
+    fanout [-t <seconds>] [-o <report>] <sessions> <command>
+
+<sessions> is 'all' or a comma separated list of ids and ranges (e.g. 1,4,10-20).
+Each session's output is printed as it arrives, prefixed with the session id, and an
+aggregated JSON report is written when every session has finished or timed out.
+A session whose command printed nothing within a couple of seconds is reported as
+'silent' rather than done, since a slow command may still be running there.
+
+Sessions whose host is not on the target white-list are skipped unless the user is
+allowed to, and chooses to, override the warning.  The command is logged once per
+session it is sent to.
+"""
+from __future__ import unicode_literals
+
+import ipaddress
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from time import monotonic
+
+import pymetasploit3.msfrpc as msfrpc
+
+try:
+    from .sessionindex import stream_command, DEFAULT_READ_INTERVAL
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from sessionindex import stream_command, DEFAULT_READ_INTERVAL
+
+# Number of sessions a fan-out command runs on at the same time
+DEFAULT_FANOUT_WORKERS = 16
+# Seconds a fan-out command may run on one session
+DEFAULT_FANOUT_TIMEOUT = 30
+# Directory the aggregated fan-out reports are written to
+DEFAULT_FANOUT_REPORT_DIR = "fanout_reports"
+
+USAGE = "Usage: fanout [-t <seconds>] [-o <report>] <all | 1,2,5-9> <command>"
+
+
+class FanOut(object):
+    """Run a command on many sessions concurrently
+
+    Attributes
+    ----------
+    session : OffPromptSession
+        session whose console, policy and user are used
+    max_workers : int
+        number of sessions the command runs on at the same time
+    timeout : float
+        seconds the command may run on one session
+    report_dir : str
+        directory the aggregated reports are written to
+
+    Methods
+    -------
+    run(self, text)
+        Parse a fanout command, run it and write the report
+    """
+
+    def __init__(
+        self,
+        session,
+        max_workers=DEFAULT_FANOUT_WORKERS,
+        timeout=DEFAULT_FANOUT_TIMEOUT,
+        report_dir=DEFAULT_FANOUT_REPORT_DIR,
+        read_interval=DEFAULT_READ_INTERVAL,
+    ):
+        """
+        Parameters
+        ----------
+        session : OffPromptSession
+            session whose console, policy and user are used
+        max_workers : int, optional
+            number of sessions the command runs on at the same time
+        timeout : float, optional
+            seconds the command may run on one session
+        report_dir : str, optional
+            directory the aggregated reports are written to
+        read_interval : float, optional
+            seconds between reads of a session's output
+        """
+        self.session = session
+        self.max_workers = int(max_workers)
+        self.timeout = float(timeout)
+        self.report_dir = report_dir
+        self.read_interval = read_interval
+        self._print_lock = threading.Lock()
+
+    @staticmethod
+    def parse(text):
+        """
+        Parameters
+        ----------
+        text : str
+            the fanout command as typed
+
+        Returns
+        -------
+        selector, command, timeout, report : tuple(str, str, float, str)
+            timeout and report are None if not given
+
+        Raises
+        ------
+        ValueError
+            If the command is malformed
+        """
+        words = text.split()[1:]
+        timeout = None
+        report = None
+        while words and words[0] in ("-t", "-o"):
+            if len(words) < 2:
+                raise ValueError(USAGE)
+            flag, value = words.pop(0), words.pop(0)
+            if flag == "-t":
+                timeout = float(value)
+            else:
+                report = value
+        if len(words) < 2:
+            raise ValueError(USAGE)
+        return words[0], " ".join(words[1:]), timeout, report
+
+    @staticmethod
+    def select(selector, sessions):
+        """
+        Parameters
+        ----------
+        selector : str
+            'all' or a comma separated list of ids and ranges
+        sessions : dict[str, dict]
+            sessions.list from msfrpcd
+
+        Returns
+        -------
+        ids : list[str]
+            selected ids that exist, in numeric order
+        """
+        if selector.lower() == "all":
+            wanted = set(sessions)
+        else:
+            wanted = set()
+            for part in selector.split(","):
+                if "-" in part:
+                    first, last = part.split("-", 1)
+                    wanted.update(str(i) for i in range(int(first), int(last) + 1))
+                elif part:
+                    wanted.add(str(int(part)))
+        return sorted(wanted & set(sessions), key=int)
+
+    def _host_allowed(self, info):
+        try:
+            host = ipaddress.ip_address(info.get("session_host", ""))
+        except ValueError:
+            return False
+        return self.session.policy.target_allowed(host)
+
+    def run(self, text):
+        """Run a fanout command and write the aggregated report
+
+        Parameters
+        ----------
+        text : str
+            the fanout command as typed
+
+        Returns
+        -------
+        report : dict
+            what was written to the report file; None if nothing ran
+        """
+        try:
+            selector, command, timeout, report_filename = self.parse(text)
+        except ValueError as e:
+            print(e)
+            return None
+        timeout = timeout or self.timeout
+        user = self.session.current_user
+
+        rpc = self.session.msf_console.console.rpc
+        sessions = self.session.registry.list_sessions()
+        ids = self.select(selector, sessions)
+        if not ids:
+            print(f"[-] No sessions match {selector}")
+            return None
+
+        denied = [sid for sid in ids if not self._host_allowed(sessions[sid])]
+        if denied:
+            message = (
+                f"sessions {','.join(denied)} are on hosts not on the allowed list"
+            )
+            print(f"Warning {message}")
+            if self.session.allow_overrides and self.session.confirm(
+                title="Target Override",
+                text=f"{len(denied)} sessions are on hosts that aren't allowed; "
+                "run on them anyway?",
+            ):
+                logging.warning(f"USER WARNING OVERRIDE: {user} overrode warning: {message}")
+                denied = []
+            else:
+                logging.warning(f"WARNING OVERRIDE DENIED: {user} fanout skipped {message}")
+
+        results = {
+            sid: {
+                "host": sessions[sid].get("session_host", ""),
+                "type": sessions[sid].get("type", ""),
+                "status": "denied",
+                "output": "",
+                "elapsed": None,
+            }
+            for sid in ids
+        }
+        allowed = [sid for sid in ids if sid not in denied]
+        started = datetime.now()
+        if allowed:
+            workers = min(self.max_workers, len(allowed))
+            with ThreadPoolExecutor(workers, thread_name_prefix="fanout") as pool:
+                futures = {
+                    pool.submit(self._run_one, rpc, sid, sessions, command, timeout): sid
+                    for sid in allowed
+                }
+                for future in as_completed(futures):
+                    results[futures[future]].update(future.result())
+
+        statuses = [r["status"] for r in results.values()]
+        print(
+            f"[*] fanout finished on {statuses.count('done')}/{len(ids)} sessions "
+            f"({statuses.count('silent')} printed nothing, "
+            f"{statuses.count('timeout')} timed out, {statuses.count('error')} failed, "
+            f"{statuses.count('denied')} denied)"
+        )
+        report = {
+            "user": user,
+            "command": command,
+            "started": started.isoformat(),
+            "timeout": timeout,
+            "sessions": results,
+        }
+        self._write_report(report, report_filename, started)
+        return report
+
+    def _run_one(self, rpc, sid, sessions, command, timeout):
+        """Send command to one session and gather its output until it goes quiet"""
+        logging.info(f"[COMMAND][USER: {self.session.current_user}][SESSION: {sid}]\n+ {command}")
+        info = sessions[sid]
+        if info.get("type") == "meterpreter":
+            shell = msfrpc.MeterpreterSession(sid, rpc, {sid: info})
+        else:
+            shell = msfrpc.ShellSession(sid, rpc, {sid: info})
+        start = monotonic()
+        try:
+            status, output = stream_command(
+                shell,
+                command,
+                on_chunk=lambda chunk: self._stream(sid, chunk),
+                timeout=timeout,
+                read_interval=self.read_interval,
+                max_time=timeout,
+            )
+        except Exception as e:
+            logging.warning(f"from fanout session {sid}\n<<< {str(e)}")
+            self._stream(sid, f"[-] {e}")
+            status, output = "error", str(e)
+        return {
+            "status": status,
+            "output": output,
+            "elapsed": round(monotonic() - start, 3),
+        }
+
+    def _stream(self, sid, chunk):
+        """Print output tagged with the session id it came from"""
+        with self._print_lock:
+            for line in chunk.splitlines():
+                print(f"[{sid}] {line}")
+
+    def _write_report(self, report, filename, started):
+        if filename is None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            filename = os.path.join(
+                self.report_dir, f"fanout-{started.strftime('%Y%m%d-%H%M%S')}.json"
+            )
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, filename)
+        print(f"[*] Report written to {filename}")
+        logging.info(f"[FANOUT] report {filename}")
@@ -0,0 +1,239 @@
+"""
+hostindex
+=========
+
+Provides HostIndex, a local copy of the current workspace's hosts and open services
+used to complete 'set RHOSTS' and 'set RPORT'.
+
+The hosts and services are pulled from msfrpcd's database in pages by a background
+thread.  Each pull is compared with the last one so only hosts that are new or were
+updated since are checked against the target white-list again; the white-list is only
+re-applied to every host when the policy file changes.  Completion reads sorted lists
+of the in-scope addresses and ports, so it never waits on msfrpcd.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import ipaddress
+import logging
+import threading
+from collections import Counter
+
+# Seconds between pulls of the workspace's hosts and services
+DEFAULT_REFRESH_INTERVAL = 30.0
+# Hosts or services requested from msfrpcd per call
+DEFAULT_PAGE_SIZE = 5000
+# Completions offered for one prefix
+DEFAULT_COMPLETION_LIMIT = 500
+
+
+class HostIndex(object):
+    """In-scope hosts and open ports of the current workspace
+
+    Attributes
+    ----------
+    workspace : str
+        workspace the index was pulled from
+    hosts : dict[str, int]
+        every host address in the workspace and when it was last updated
+    services : dict[str, dict[int, str]]
+        open ports (and service names) by host address
+    policy : policy.PolicyCache
+        target white-list the hosts are intersected with
+
+    Methods
+    -------
+    refresh(self)
+        Pull the hosts and services once
+    start(self)
+        Refresh on an interval from a background thread
+    complete_hosts(self, prefix)
+        In-scope host addresses starting with prefix
+    complete_ports(self, prefix)
+        Open ports of in-scope hosts starting with prefix, most common first
+    """
+
+    def __init__(
+        self,
+        rpc,
+        policy,
+        interval=DEFAULT_REFRESH_INTERVAL,
+        page_size=DEFAULT_PAGE_SIZE,
+    ):
+        """
+        Parameters
+        ----------
+        rpc : pymetasploit3.msfrpc.MsfRpcClient
+            client connected to msfrpcd
+        policy : policy.PolicyCache
+            target white-list the hosts are intersected with
+        interval : float, optional
+            seconds between pulls
+        page_size : int, optional
+            hosts or services requested from msfrpcd per call
+        """
+        self.rpc = rpc
+        self.policy = policy
+        self.interval = float(interval)
+        self.page_size = int(page_size)
+        self.workspace = None
+        self.hosts = {}
+        self.services = {}
+
+        # white-list verdict by address; cleared when the policy changes
+        self._allowed = {}
+        self._policy_version = None
+        self._scope_stale = True
+        self._in_scope = []
+        self._ports = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pages(self, method, key, workspace):
+        """Every row of a paged db.* call"""
+        offset = 0
+        while True:
+            rows = self.rpc.call(
+                method,
+                [{"workspace": workspace, "limit": self.page_size, "offset": offset}],
+            ).get(key, [])
+            yield from rows
+            if len(rows) < self.page_size:
+                return
+            offset += self.page_size
+
+    def refresh(self):
+        """Pull the workspace's hosts and services and note what changed
+
+        Returns
+        -------
+        changed : int
+            number of hosts that are new, updated or gone since the last pull
+        """
+        workspace = self.rpc.call("db.current_workspace").get("workspace")
+        hosts = {
+            row["address"]: row.get("updated_at", 0)
+            for row in self._pages("db.hosts", "hosts", workspace)
+        }
+        services = {}
+        for row in self._pages("db.services", "services", workspace):
+            if row.get("state", "open") == "open":
+                services.setdefault(row["host"], {})[int(row["port"])] = row.get(
+                    "name", ""
+                )
+
+        with self._lock:
+            if workspace != self.workspace:
+                self._allowed = {}
+                previous = {}
+            else:
+                previous = self.hosts
+            changed = [a for a, updated in hosts.items() if previous.get(a) != updated]
+            changed += [a for a in previous if a not in hosts]
+            for address in changed:
+                # re-checked against the white-list on next use
+                self._allowed.pop(address, None)
+            if changed or services != self.services:
+                self._scope_stale = True
+            self.workspace = workspace
+            self.hosts = hosts
+            self.services = services
+        if changed:
+            logging.info(f"[HOSTINDEX] {len(changed)} hosts changed in {workspace}")
+        return len(changed)
+
+    def start(self):
+        """Refresh every interval from a background thread until stop() is called"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._poll_loop, name="hostindex", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                # check new hosts against the white-list here rather than on a keystroke
+                self._scope()
+            except Exception as e:
+                logging.warning(f"from host index\n<<< {str(e)}")
+            self._stop.wait(self.interval)
+
+    def _allowed_address(self, address):
+        try:
+            return self.policy.target_allowed(ipaddress.ip_address(address))
+        except ValueError:
+            return False
+
+    def _scope(self):
+        """Rebuild the in-scope lists if the hosts or the white-list changed"""
+        self.policy.refresh()
+        with self._lock:
+            if self.policy.version != self._policy_version:
+                self._policy_version = self.policy.version
+                self._allowed = {}
+                self._scope_stale = True
+            if not self._scope_stale:
+                return
+            allowed = self._allowed
+            for address in self.hosts:
+                if address not in allowed:
+                    allowed[address] = self._allowed_address(address)
+            in_scope = sorted(a for a in self.hosts if allowed[a])
+            ports = Counter()
+            names = {}
+            for address in in_scope:
+                for port, name in self.services.get(address, {}).items():
+                    ports[port] += 1
+                    names.setdefault(port, name)
+            self._in_scope = in_scope
+            self._ports = [
+                (str(port), names[port], count) for port, count in ports.most_common()
+            ]
+            self._scope_stale = False
+
+    def complete_hosts(self, prefix, limit=DEFAULT_COMPLETION_LIMIT):
+        """
+        Parameters
+        ----------
+        prefix : str
+            start of an address
+        limit : int, optional
+            most addresses returned
+
+        Returns
+        -------
+        addresses : list[str]
+            in-scope host addresses starting with prefix, sorted
+        """
+        # first use starts the puller; completion never waits on msfrpcd
+        self.start()
+        self._scope()
+        in_scope = self._in_scope
+        start = bisect.bisect_left(in_scope, prefix)
+        end = bisect.bisect_left(in_scope, prefix + "\uffff")
+        return in_scope[start : min(end, start + limit)]
+
+    def complete_ports(self, prefix):
+        """
+        Parameters
+        ----------
+        prefix : str
+            start of a port number
+
+        Returns
+        -------
+        ports : list[tuple(str, str, int)]
+            open ports of in-scope hosts starting with prefix, their service name and
+            how many hosts have them open; most common first
+        """
+        self.start()
+        self._scope()
+        return [entry for entry in self._ports if entry[0].startswith(prefix)]
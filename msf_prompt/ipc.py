@@ -0,0 +1,94 @@
+"""
+ipc
+===
+
+Message framing shared by msf_promptd.py and msf_prompt_client.py.
+
+Messages are JSON objects, one per line, sent over a Unix domain socket.  This module
+only uses the standard library so the thin client can start without importing
+prompt_toolkit or pymetasploit3.
+
+Client -> daemon:
+    {"op": "prompt"}                        ask for the current prompt
+    {"op": "input", "text": str}            run a command (as OffPromptSession.handle_input)
+    {"op": "tabs", "text": str}             tab-complete text
+    {"op": "confirm_reply", "answer": bool} answer to a "confirm" message
+
+Daemon -> client:
+    {"type": "prompt", "text": str}         current prompt
+    {"type": "output", "data": str}         output to print (may arrive at any time)
+    {"type": "confirm", "title": str, "text": str}
+                                            yes/no question; answer with confirm_reply
+    {"type": "done", "prompt": str}         the command finished
+    {"type": "tabs", "tabs": list[str]}     tab-complete strings
+    {"type": "bye"}                         the console was exited
+"""
+import json
+import threading
+
+# Unix socket the daemon listens on (relative to the msf_prompt directory)
+DEFAULT_SOCKET_FILENAME = ".msf_promptd.sock"
+
+
+class MessageChannel(object):
+    """Newline delimited JSON messages over a connected socket
+
+    send is safe to call from several threads (e.g. console output from the poller
+    thread while a command is answered); receive is meant for a single reader.
+
+    Methods
+    -------
+    send(self, message)
+        Send a dict as one message
+    receive(self)
+        Next message as a dict or None once the other end has closed
+    close(self)
+        Close the socket
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._rfile = sock.makefile("r", encoding="utf-8", newline="\n")
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        """
+        Parameters
+        ----------
+        message : dict
+            JSON serializable message
+
+        Returns
+        -------
+        _ : bool
+            False if the other end has gone away
+        """
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                self.sock.sendall(data)
+            return True
+        except OSError:
+            return False
+
+    def receive(self):
+        """
+        Returns
+        -------
+        message : dict or None
+            next message or None once the other end has closed
+        """
+        try:
+            line = self._rfile.readline()
+        except OSError:
+            return None
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self._rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
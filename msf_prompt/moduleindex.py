@@ -0,0 +1,429 @@
+"""
+moduleindex
+===========
+
+Provides ModuleIndex, a local inverted index over the framework's module metadata
+that answers 'lsearch' and 'use <module>' tab-complete without msfrpcd.
+
+    lsearch [type:<t>] [platform:<p>] [rank:<min rank>] [cve:<id>] [ref:<id>] <terms>
+
+Every module's name, path, description, references (CVE, MSB, EDB, ...), platform and
+rank are read from msfrpcd once and saved to disk.  Each field is tokenised into its
+own postings so a term can be weighted by where it matched (a term in the module's
+path counts for more than one in its description) and filters only look at their
+field.  Results are ranked by that score, then by the module's rank.
+
+The saved index records the framework version it was built from.  refresh() compares
+that to msfrpcd's version and does nothing while it's unchanged, so only a framework
+update means re-reading the modules (in the background, while the saved index is
+used); modules that have gone are dropped.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .utils.trigram import TrigramIndex
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from utils.trigram import TrigramIndex
+
+# File the index is saved to
+DEFAULT_MODULE_INDEX_FILE = ".msf_module_index.json"
+# Format of the saved index; older files are rebuilt
+INDEX_FORMAT = 1
+# Number of module.info calls made at the same time while building the index
+DEFAULT_INDEX_WORKERS = 8
+# Number of lsearch results printed
+DEFAULT_RESULT_LIMIT = 25
+# msfrpcd's list call for each module type
+MODULE_TYPES = {
+    "exploit": "module.exploits",
+    "auxiliary": "module.auxiliary",
+    "post": "module.post",
+    "payload": "module.payloads",
+    "encoder": "module.encoders",
+    "nop": "module.nops",
+    "evasion": "module.evasion",
+}
+# Module ranks, lowest to highest
+RANKS = ["manual", "low", "average", "normal", "good", "great", "excellent"]
+# Field filters lsearch understands
+SEARCH_FILTERS = ("type", "platform", "rank", "cve", "ref", "name", "path")
+# How much a search term counts for in each field
+FIELD_WEIGHTS = {"name": 4, "path": 3, "references": 3, "platform": 1, "description": 1}
+
+
+def tokenize(text):
+    """Lower-case alphanumeric tokens of text"""
+    return re.findall("[a-z0-9]+", str(text).lower())
+
+
+def normalize_rank(rank):
+    """Rank as a name from RANKS (msfrpcd reports either the name or the number)"""
+    if isinstance(rank, int):
+        # Msf::ManualRanking is 0, ExcellentRanking is 600
+        return RANKS[min(max(rank // 100, 0), len(RANKS) - 1)]
+    rank = str(rank).lower()
+    return rank if rank in RANKS else "normal"
+
+
+class ModuleIndex(object):
+    """Inverted index over module metadata, saved to disk
+
+    Attributes
+    ----------
+    filename : str
+        file the index is saved to
+    version : str
+        framework version the index was built from
+    modules : dict[str, dict]
+        metadata by full module path (e.g. 'exploit/windows/smb/ms17_010_eternalblue')
+    paths : list[str]
+        every full module path, sorted (for prefix completion)
+    trigrams : utils.trigram.TrigramIndex
+        trigram index over the paths (for fuzzy completion)
+
+    Methods
+    -------
+    refresh(self, rpc)
+        Bring the index up to date with msfrpcd's framework version
+    start_refresh(self, rpc)
+        refresh() on a background thread
+    search(self, query, limit=DEFAULT_RESULT_LIMIT)
+        Ranked modules matching a query
+    complete(self, prefix)
+        Module paths that start with prefix
+    fuzzy(self, query)
+        Module paths that roughly contain every word of query, best first
+    """
+
+    def __init__(self, filename=DEFAULT_MODULE_INDEX_FILE, workers=DEFAULT_INDEX_WORKERS):
+        """
+        Parameters
+        ----------
+        filename : str, optional
+            file the index is saved to
+        workers : int, optional
+            number of module.info calls made at the same time while building
+        """
+        self.filename = filename
+        self.workers = workers
+        self.version = None
+        self.modules = {}
+        self.paths = []
+        self.trigrams = TrigramIndex([])
+
+        self._postings = {}
+        self._vocabulary = []
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        """Read the saved index the first time it's needed"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.filename) as f:
+                    saved = json.load(f)
+                if saved.get("format") == INDEX_FORMAT:
+                    self.version = saved.get("version")
+                    self.modules = saved.get("modules", {})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logging.warning(f"from module index load\n<<< {str(e)}")
+            self._reindex()
+
+    def _reindex(self):
+        """Rebuild the postings, vocabulary and sorted paths from self.modules"""
+        postings = {field: defaultdict(set) for field in FIELD_WEIGHTS}
+        for path, module in self.modules.items():
+            for token in tokenize(path):
+                postings["path"][token].add(path)
+            for token in tokenize(module.get("name", "")):
+                postings["name"][token].add(path)
+            for token in tokenize(module.get("description", "")):
+                postings["description"][token].add(path)
+            for token in tokenize(module.get("platform", "")):
+                postings["platform"][token].add(path)
+            for reference in module.get("references", []):
+                postings["references"][reference.lower()].add(path)
+                for token in tokenize(reference):
+                    postings["references"][token].add(path)
+        vocabulary = set()
+        for field in postings.values():
+            vocabulary.update(field)
+        self._postings = postings
+        self._vocabulary = sorted(vocabulary)
+        self.paths = sorted(self.modules)
+        self.trigrams = TrigramIndex(self.paths)
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {"format": INDEX_FORMAT, "version": self.version, "modules": self.modules},
+                f,
+            )
+        os.replace(tmp, self.filename)
+
+    @staticmethod
+    def _metadata(info):
+        """The fields kept for a module from its module.info answer"""
+        references = []
+        for reference in info.get("references", []) or []:
+            if isinstance(reference, (list, tuple)) and len(reference) == 2:
+                references.append(f"{reference[0]}-{reference[1]}")
+            else:
+                references.append(str(reference))
+        platform = info.get("platform", "")
+        if isinstance(platform, (list, tuple)):
+            platform = " ".join(str(p) for p in platform)
+        # e.g. 'Msf::Module::Platform::Windows'
+        platform = " ".join(p.split("::")[-1] for p in str(platform).split())
+        return {
+            "name": info.get("name", ""),
+            "description": " ".join(str(info.get("description", "")).split()),
+            "references": references,
+            "platform": platform.lower(),
+            "rank": normalize_rank(info.get("rank", "normal")),
+        }
+
+    def refresh(self, rpc):
+        """Bring the index up to date with msfrpcd
+
+        Nothing is fetched if the framework version is the one the index was built
+        from.  After a framework update every module is fetched again (any of them
+        may have changed); an index that was never built fetches what it's missing.
+        If a module list can't be read the index is left as it was, so the next
+        refresh tries again.
+
+        Parameters
+        ----------
+        rpc : pymetasploit3.msfrpc.MsfRpcClient
+            client connected to msfrpcd
+
+        Returns
+        -------
+        _ : bool
+            True if the index changed
+        """
+        self._ensure_loaded()
+        version = rpc.call("core.version").get("version")
+        if version == self.version and self.modules:
+            return False
+
+        current = set()
+        for mtype, method in MODULE_TYPES.items():
+            try:
+                names = rpc.call(method).get("modules", [])
+            except Exception as e:
+                # a partial list would drop modules and record the version as done
+                logging.warning(f"from module index {method}\n<<< {str(e)}")
+                return False
+            current.update(f"{mtype}/{name}" for name in names)
+
+        with self._lock:
+            for path in set(self.modules) - current:
+                del self.modules[path]
+            if self.version is not None and version != self.version:
+                new = sorted(current)
+            else:
+                new = sorted(current - set(self.modules))
+        logging.info(f"[MODULE INDEX] framework {version}: fetching {len(new)} modules")
+
+        def fetch(path):
+            mtype, name = path.split("/", 1)
+            try:
+                return path, rpc.call("module.info", [mtype, name])
+            except Exception as e:
+                logging.warning(f"from module index {path}\n<<< {str(e)}")
+                return path, None
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="module-index") as pool:
+            for path, info in pool.map(fetch, new):
+                if isinstance(info, dict) and not info.get("error"):
+                    with self._lock:
+                        self.modules[path] = self._metadata(info)
+
+        with self._lock:
+            self.version = version
+            self._reindex()
+        self._save()
+        return True
+
+    def start_refresh(self, rpc):
+        """refresh() on a background thread; the saved index is used meanwhile"""
+
+        def run():
+            try:
+                self.refresh(rpc)
+            except Exception as e:
+                logging.warning(f"from module index refresh\n<<< {str(e)}")
+
+        threading.Thread(target=run, name="module-index", daemon=True).start()
+
+    @staticmethod
+    def parse(query):
+        """
+        Parameters
+        ----------
+        query : str
+            e.g. 'type:exploit platform:windows rank:great smb ms17'
+
+        Returns
+        -------
+        terms, filters : tuple(list[str], dict[str, str])
+            free text terms and field filters
+        """
+        terms = []
+        filters = {}
+        for word in query.split():
+            field, sep, value = word.partition(":")
+            if sep and value and field.lower() in SEARCH_FILTERS:
+                filters[field.lower()] = value.lower()
+            else:
+                terms.extend(tokenize(word))
+        return terms, filters
+
+    def _expand(self, term):
+        """Vocabulary tokens that start with term"""
+        start = bisect.bisect_left(self._vocabulary, term)
+        tokens = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def _matches_filters(self, path, filters):
+        module = self.modules[path]
+        for field, value in filters.items():
+            if field == "type" and not path.startswith(value + "/"):
+                return False
+            if field == "platform" and value not in module.get("platform", ""):
+                return False
+            if field == "rank" and value in RANKS:
+                if RANKS.index(module.get("rank", "normal")) < RANKS.index(value):
+                    return False
+            if field in ("cve", "ref"):
+                wanted = value if field == "ref" else f"cve-{value}"
+                if not any(r.lower() == wanted for r in module.get("references", [])):
+                    return False
+            if field == "name" and value not in module.get("name", "").lower():
+                return False
+            if field == "path" and value not in path:
+                return False
+        return True
+
+    def search(self, query, limit=DEFAULT_RESULT_LIMIT):
+        """
+        Parameters
+        ----------
+        query : str
+            free text terms and field filters (see ModuleIndex.parse)
+        limit : int, optional
+            number of results returned
+
+        Returns
+        -------
+        results : list[tuple(str, dict)]
+            module path and metadata, best match first
+        """
+        self._ensure_loaded()
+        terms, filters = self.parse(query)
+        with self._lock:
+            if terms:
+                scores = None
+                for term in terms:
+                    term_scores = defaultdict(int)
+                    for token in self._expand(term):
+                        # an exact token counts for more than one it is a prefix of
+                        bonus = 2 if token == term else 1
+                        for field, weight in FIELD_WEIGHTS.items():
+                            for path in self._postings[field].get(token, ()):
+                                term_scores[path] = max(
+                                    term_scores[path], weight * bonus
+                                )
+                    # every term has to match somewhere
+                    if scores is None:
+                        scores = dict(term_scores)
+                    else:
+                        scores = {
+                            p: s + term_scores[p]
+                            for p, s in scores.items()
+                            if p in term_scores
+                        }
+            else:
+                scores = dict.fromkeys(self.modules, 0)
+
+            matches = [p for p in scores if self._matches_filters(p, filters)]
+            matches.sort(
+                key=lambda p: (
+                    -scores[p],
+                    -RANKS.index(self.modules[p].get("rank", "normal")),
+                    p,
+                )
+            )
+            return [(p, self.modules[p]) for p in matches[:limit]]
+
+    def complete(self, prefix):
+        """
+        Parameters
+        ----------
+        prefix : str
+            start of a module path (e.g. 'exploit/windows/sm')
+
+        Returns
+        -------
+        paths : list[str]
+            module paths that start with prefix, sorted
+        """
+        self._ensure_loaded()
+        with self._lock:
+            start = bisect.bisect_left(self.paths, prefix)
+            end = bisect.bisect_left(self.paths, prefix + "\uffff")
+            return self.paths[start:end]
+
+    def fuzzy(self, query, limit=DEFAULT_RESULT_LIMIT):
+        """
+        Parameters
+        ----------
+        query : str
+            words that appear (roughly) in the module path, e.g. 'smb ms17'
+        limit : int, optional
+            number of paths returned
+
+        Returns
+        -------
+        paths : list[str]
+            best match first
+        """
+        self._ensure_loaded()
+        return self.trigrams.search(query, limit)
+
+    def print_results(self, results):
+        """Print lsearch results as a table"""
+        if not results:
+            print("[-] No results from lsearch")
+            return
+        width = max(len(path) for path, _ in results)
+        print(f"   {'Name'.ljust(width)}  {'Rank'.ljust(9)}  Description")
+        print(f"   {'----'.ljust(width)}  {'----'.ljust(9)}  -----------")
+        for path, module in results:
+            print(
+                f"   {path.ljust(width)}  {module.get('rank', '').ljust(9)}  "
+                f"{module.get('name', '')}"
+            )
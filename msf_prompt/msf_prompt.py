@@ -6,17 +6,33 @@ the primary loop for prompting the user.
 """
 
 from __future__ import unicode_literals
-import logging
+import sys
+
+# imported first so '--trace-startup' can time every import after it
+from startup import StartupTrace
 
-from prompt_toolkit.history import FileHistory
+startup = StartupTrace("--trace-startup" in sys.argv)
+
+import asyncio
+import atexit
+import logging
 
-import pymetasploit3.msfrpc as msfrpc
 import pymetasploit3.msfconsole as msfconsole
 
+# asyncloop, batch, cmdqueue and multiplexer are imported when their option is used
 from offpromptsession import OffPromptSession
+from registry import SessionRegistry, DEFAULT_POLL_INTERVAL
+from rpcconsole import RpcConsole
+from moduleindex import ModuleIndex, DEFAULT_MODULE_INDEX_FILE
 from msf_prompt_styles import msf_style, get_formatted_prompt
-from utils.utils import parseargs, parseconfig
+from utils.utils import parseargs, parseconfig, setup_logging
+from utils.metrics import MetricsExporter, DEFAULT_METRICS_INTERVAL
 from utils.patch_stdout_shim import patch_stdout
+from utils.profiler import PromptProfiler
+from utils.resolver import CachedResolver
+from utils.resultcache import ResultCache
+from utils.snapshot import CacheSnapshot, DEFAULT_SNAPSHOT_INTERVAL
+from utils.transport import PooledMsfRpcClient
 
 
 CONFIG_FILENAME = "configs/prompt_config"
@@ -31,7 +47,15 @@ def main():
         - Get configs (passed on command line and in config file)
         - Setup connections to msfrpcd and ancillary tasks (e.g. logging)
         - Begin user input loop
+
+    Returns
+    -------
+    status : int or None
+        exit status; 1 if setup failed or a resource script didn't fully succeed
     """
+    startup.mark("imports")
+    async_mode = False
+    resource_file = None
     try:
         opts = parseconfig(CONFIG_FILENAME)
         o = parseargs()  # returns a Values object
@@ -40,26 +64,182 @@ def main():
                 # only override config file value if command line param is not None
                 opts[k] = v
 
-        logging.basicConfig(
-            filename=opts.get("log_file", LOGGING_FILENAME),
-            format="===================\n%(asctime)s\n%(message)s",
-            level=logging.INFO,
+        setup_logging(
+            opts.get("log_file", LOGGING_FILENAME), opts.get("queue_logging", False)
         )
+        startup.mark("config")
         with patch_stdout():
             hist = opts.get("history_file", HISTORY_FILENAME)
 
             allow_overrides = opts.get("allow_overrides", True)
 
+            session_opts = {
+                "hist_name": hist,
+                "allow_overrides": allow_overrides,
+                "completion_budget": opts.get("completion_budget"),
+                "suggestion_budget": opts.get("suggestion_budget"),
+                "fanout_workers": opts.get("fanout_workers"),
+                "fanout_timeout": opts.get("fanout_timeout"),
+                "fuzzy_completion": opts.get("fuzzy_completion", False),
+                "resolver": CachedResolver.from_config(opts.get("resolver")),
+                "profiler": PromptProfiler(opts.get("profile_dir")),
+            }
+            consoles = [
+                name.strip()
+                for name in str(opts.get("consoles", "")).split(",")
+                if name.strip()
+            ]
+
+            async_mode = opts.get("async_mode", False)
+            resource_file = opts.get("resource_file")
+            # in asyncio and batch mode console output is read by the caller instead
+            # of a timer thread
+            if async_mode or resource_file:
+                console_factory = RpcConsole
+            else:
+                console_factory = msfconsole.MsfRpcConsole
+
             logging.info("Starting MsfRpcClient, MsfRpcConsole, OffPromptSession")
-            client = msfrpc.MsfRpcClient(**opts)
-            console = msfconsole.MsfRpcConsole(client)
+            # keep-alive connection pool to msfrpcd instead of a connection per call
+            client = PooledMsfRpcClient(**opts)
+            startup.mark("connect to msfrpcd")
+            result_cache_mb = float(opts.get("result_cache_mb", 0))
+            if result_cache_mb:
+                # answer repeated show/info from memory
+                session_opts["result_cache"] = ResultCache(
+                    max_bytes=result_cache_mb * 1024 * 1024
+                )
+            # module metadata for lsearch and 'use' completion, saved between runs
+            session_opts["module_index"] = ModuleIndex(
+                opts.get("module_index_file", DEFAULT_MODULE_INDEX_FILE)
+            )
+            if not resource_file:
+                # only fetches anything after a framework update
+                session_opts["module_index"].start_refresh(client)
+            # one local copy of the sessions and jobs for every console
+            session_opts["registry"] = SessionRegistry(
+                client,
+                interval=opts.get("session_poll_interval", DEFAULT_POLL_INTERVAL),
+            )
+
+            if consoles:
+                from multiplexer import ConsoleMultiplexer, DEFAULT_RPC_WORKERS
+
+                # several named consoles sharing the client, worker pool and caches
+                mux = ConsoleMultiplexer(
+                    client,
+                    consoles,
+                    max_workers=opts.get("rpc_workers", DEFAULT_RPC_WORKERS),
+                    console_factory=console_factory,
+                    **session_opts,
+                )
+                sess = mux.session
+                handler = mux
+                formatted_prompt = mux.formatted_prompt
+                live_consoles = lambda: [slot.console for slot in mux.slots.values()]
+            else:
+                console = console_factory(client)
+                sess = OffPromptSession(console, **session_opts)
+                handler = sess
+                formatted_prompt = lambda: get_formatted_prompt(sess.prompt_text)
+                live_consoles = lambda: [console]
+
+            # the hidden console run_cached queries on
+            atexit.register(sess.close)
 
-            sess = OffPromptSession(
-                console, hist_name=hist, allow_overrides=allow_overrides
+            # session/job counts from the registry (no rpc call per prompt)
+            registry_prompt = formatted_prompt
+            formatted_prompt = lambda: (
+                sess.registry.status_fragments() + registry_prompt()
             )
+
+            if opts.get("pipeline", False):
+                from cmdqueue import CommandPipeline
+
+                # validate commands as they're typed and send them back-to-back
+                pipeline = CommandPipeline(sess, handler)
+                handler = pipeline
+                console_prompt = formatted_prompt
+                formatted_prompt = lambda: (
+                    pipeline.status_fragments() + console_prompt()
+                )
+            snapshot_file = opts.get("snapshot_file")
+            if snapshot_file:
+                # warm caches from the last run (if still valid), saved as they grow
+                snapshot = CacheSnapshot(
+                    snapshot_file,
+                    client,
+                    interval=opts.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL),
+                )
+                snapshot.track("tabs", sess.tab_cache)
+                snapshot.track("results", sess.result_cache)
+                snapshot.track("session_commands", sess.command_index)
+                snapshot.start()
+                atexit.register(snapshot.save)
+            if opts.get("metrics_file") or opts.get("metrics_port"):
+                # health of this instance for node-level scraping
+                metrics = MetricsExporter(
+                    opts.get("metrics_file"),
+                    opts.get("metrics_port"),
+                    interval=opts.get("metrics_interval", DEFAULT_METRICS_INTERVAL),
+                )
+                metrics.track_client(client)
+                metrics.track_perf(sess.perf)
+                metrics.track_cache("completion", sess.tab_cache)
+                metrics.track_cache("policy", sess.policy)
+                metrics.track_cache("results", sess.result_cache)
+                metrics.start()
+                atexit.register(metrics.stop)
+            startup.mark("session")
     except Exception as e:
         print(f"something when very wrong, {e}")
         logging.warning(f"something went very wrong {e}")
+        # nothing to prompt with
+        return 1
+
+    if resource_file:
+        from batch import BatchRunner
+
+        # headless: validate the whole script, run it and write the results
+        runner = BatchRunner(sess, force=opts.get("force", False))
+        succeeded = runner.run(resource_file, opts.get("results_file"))
+        # non-zero when the script was rejected or a command failed (for CI)
+        return 0 if succeeded else 1
+
+    # wordlist, policy files and module index load while the first prompt is up
+    sess.warm_up()
+
+    def first_prompt():
+        startup.mark("first prompt")
+        startup.report()
+
+    if async_mode:
+        from asyncloop import (
+            AsyncPromptLoop,
+            DEFAULT_SESSION_POLL_INTERVAL,
+            DEFAULT_POLICY_RELOAD_INTERVAL,
+        )
+
+        # prompt, command execution, console output, session polling and policy
+        # reload all run as tasks on one event loop
+        loop = AsyncPromptLoop(
+            sess,
+            handler,
+            formatted_prompt,
+            live_consoles,
+            session_poll_interval=opts.get(
+                "session_poll_interval", DEFAULT_SESSION_POLL_INTERVAL
+            ),
+            policy_reload_interval=opts.get(
+                "policy_reload_interval", DEFAULT_POLICY_RELOAD_INTERVAL
+            ),
+            pre_run=first_prompt,
+        )
+        asyncio.run(loop.run())
+        return
+
+    # keep the session registry current (the asyncio loop does this itself)
+    sess.registry.start()
 
     # main user input loop
     while True:
@@ -68,10 +248,14 @@ def main():
             #                                   above the user input line
             # Redirects all output through the default logger
             with patch_stdout():
+                # re-drawn on an interval so the queue depth stays current
                 user_input = sess.prompt(
-                    get_formatted_prompt(sess.prompt_text), style=msf_style
+                    formatted_prompt,
+                    style=msf_style,
+                    refresh_interval=0.5,
+                    pre_run=first_prompt,
                 )
-                sess.handle_input(user_input)
+                handler.handle_input(user_input)
         except KeyboardInterrupt:
             continue
         except EOFError:
@@ -83,4 +267,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""A thin terminal client for msf_promptd.py.
+
+Attaches to the daemon's Unix socket and relays commands, tab-completion and yes/no
+confirmations.  Only the standard library is imported (readline provides line editing,
+history and tab-completion) so the client starts almost instantly; msfrpcd, caches,
+policy and logging all live in the daemon.
+"""
+
+import os
+import queue
+import readline
+import socket
+import sys
+import threading
+from optparse import OptionParser
+
+from ipc import MessageChannel, DEFAULT_SOCKET_FILENAME
+
+CLIENT_HISTORY_FILENAME = os.path.expanduser("~/.msf_prompt_client_hist")
+
+
+class ThinClient(object):
+    """Terminal front end for a DaemonSession
+
+    Output messages are printed as soon as they arrive; every other message is an
+    answer to something the client asked and is handed to the waiting caller.
+
+    Methods
+    -------
+    run(self)
+        Prompt the user until they exit
+    """
+
+    def __init__(self, socket_filename):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_filename)
+        self.channel = MessageChannel(sock)
+        self._replies = queue.Queue()
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _reader(self):
+        while True:
+            message = self.channel.receive()
+            if message is None:
+                self._replies.put({"type": "bye"})
+                return
+            if message.get("type") == "output":
+                sys.stdout.write(message["data"])
+                sys.stdout.flush()
+            else:
+                self._replies.put(message)
+
+    def _request(self, message):
+        self.channel.send(message)
+        return self._replies.get()
+
+    def _complete(self, text, state):
+        """readline completer; asks the daemon for tab-complete strings"""
+        if state == 0:
+            line = readline.get_line_buffer()
+            begin = readline.get_begidx()
+            reply = self._request({"op": "tabs", "text": line})
+            self._matches = [t[begin:] for t in reply.get("tabs", [])]
+        if state < len(self._matches):
+            return self._matches[state]
+        return None
+
+    def run(self):
+        """Prompt the user and send each line to the daemon until they exit"""
+        readline.set_completer(self._complete)
+        readline.set_completer_delims(" /")
+        readline.parse_and_bind("tab: complete")
+        try:
+            readline.read_history_file(CLIENT_HISTORY_FILENAME)
+        except OSError:
+            pass
+
+        prompt = self._request({"op": "prompt"}).get("text", "msf > ")
+        try:
+            while True:
+                try:
+                    text = input(prompt)
+                except KeyboardInterrupt:
+                    print()
+                    continue
+                except EOFError:
+                    break
+                self.channel.send({"op": "input", "text": text})
+                reply = self._replies.get()
+                while reply.get("type") == "confirm":
+                    answer = input(f"{reply['title']}: {reply['text']} [y/N] ")
+                    self.channel.send(
+                        {"op": "confirm_reply", "answer": answer.lower().startswith("y")}
+                    )
+                    reply = self._replies.get()
+                if reply.get("type") == "bye":
+                    break
+                prompt = reply.get("prompt", prompt)
+        finally:
+            readline.write_history_file(CLIENT_HISTORY_FILENAME)
+            self.channel.close()
+
+
+def main():
+    p = OptionParser()
+    p.add_option(
+        "-s",
+        dest="socket_file",
+        default=DEFAULT_SOCKET_FILENAME,
+        help="Unix socket msf_promptd is listening on",
+    )
+    o, a = p.parse_args()
+    try:
+        client = ThinClient(o.socket_file)
+    except OSError as e:
+        print(f"[-] Unable to attach to msf_promptd at {o.socket_file}: {e}")
+        sys.exit(1)
+    client.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,12 @@ msf_style = Style.from_dict(
         "msf": "white underline",
         "module": "ansired bold",
         "plain": "white",
+        # name of the active console when multiplexing
+        "console": "ansicyan",
+        # depth of the type-ahead command queue
+        "queue": "ansiyellow",
+        # session and job counts from the session registry
+        "sessions": "ansigreen",
     }
 )
 
@@ -0,0 +1,348 @@
+"""A long-lived daemon that serves OffPromptSessions to thin clients over a Unix socket.
+
+The daemon owns the single msfrpcd connection (PooledMsfRpcClient), the RPC worker
+pool, the tab-complete cache, the policy cache and the audit log.  Every attached
+msf_prompt_client.py gets its own MsfRpcConsole and OffPromptSession but shares
+everything else, so clients start instantly against warm caches.
+
+The user of each client is taken from the socket's peer credentials, so module
+permissions and the audit log are per operator even though one process does the work.
+"""
+
+from __future__ import unicode_literals
+import logging
+import os
+import pwd
+import socket
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymetasploit3.msfconsole as msfconsole
+
+from hostindex import HostIndex
+from ipc import MessageChannel, DEFAULT_SOCKET_FILENAME
+from multiplexer import DEFAULT_RPC_WORKERS
+from offpromptsession import OffPromptSession
+from moduleindex import ModuleIndex, DEFAULT_MODULE_INDEX_FILE
+from policy import PolicyCache
+from registry import SessionRegistry, DEFAULT_POLL_INTERVAL
+from rpcconsole import close_console
+from utils.utils import parseargs, parseconfig, setup_logging
+from utils.histogram import PerfStats
+from utils.metrics import MetricsExporter, DEFAULT_METRICS_INTERVAL
+from utils.profiler import PromptProfiler
+from utils.resolver import CachedResolver
+from utils.resultcache import ResultCache
+from utils.snapshot import CacheSnapshot, DEFAULT_SNAPSHOT_INTERVAL
+from utils.tabcache import TabsCache
+from utils.transport import PooledMsfRpcClient
+
+
+CONFIG_FILENAME = "configs/prompt_config"
+HISTORY_FILENAME = ".off_prompt_hist"
+LOGGING_FILENAME = ".off_prompt_log"
+# Permissions of the socket; group members can attach
+DEFAULT_SOCKET_MODE = "660"
+
+
+class RoutingStdout(object):
+    """sys.stdout replacement that sends each thread's output to that thread's client
+
+    Threads that haven't registered a sink write to the original stdout.  Everything
+    written by a client thread is also logged like LoggingStdoutProxy does.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._sinks = {}
+
+    def route(self, sink):
+        """Send output written by the calling thread to sink(str)"""
+        self._sinks[threading.get_ident()] = sink
+
+    def unroute(self):
+        self._sinks.pop(threading.get_ident(), None)
+
+    def write(self, data):
+        sink = self._sinks.get(threading.get_ident())
+        if sink is None:
+            return self._default.write(data)
+        sink(data)
+        if len(data.strip()) > 0:
+            logging.info(f"[RESULT]\n{data}")
+        return len(data)
+
+    def flush(self):
+        self._default.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._default, name)
+
+
+class DaemonSession(OffPromptSession):
+    """OffPromptSession driven by a remote thin client instead of a local terminal
+
+    Attributes
+    ----------
+    channel : ipc.MessageChannel
+        connection to the client
+    """
+
+    def __init__(self, console, channel, user, *args, **kwargs):
+        self.channel = channel
+        self._user = user
+        super().__init__(console, *args, **kwargs)
+
+    @property
+    def current_user(self):
+        return self._user
+
+    def confirm(self, title, text):
+        """Ask the yes/no question on the client's terminal"""
+        self.channel.send({"type": "confirm", "title": title, "text": text})
+        reply = self.channel.receive()
+        return bool(reply and reply.get("answer"))
+
+
+class PromptDaemon(object):
+    """Accepts thin clients on a Unix socket and serves each one a DaemonSession
+
+    Attributes
+    ----------
+    client : utils.transport.PooledMsfRpcClient
+        the one connection to msfrpcd
+    executor : concurrent.futures.ThreadPoolExecutor
+        RPC worker pool shared by every client
+    policy : policy.PolicyCache
+        target white-list and permissions shared by every client
+    tab_cache : utils.tabcache.TabsCache
+        tab-complete answers shared by every client, kept per module (clients in the
+        same module share them)
+    registry : registry.SessionRegistry
+        sessions and jobs shared by every client; changes are sent to all of them
+    result_cache : utils.resultcache.ResultCache
+        show/info output shared by every client; None if not enabled
+    module_index : moduleindex.ModuleIndex
+        module metadata for lsearch and 'use' completion shared by every client
+    host_index : hostindex.HostIndex
+        workspace hosts and open ports for RHOSTS/RPORT completion shared by every client
+    resolver : utils.resolver.CachedResolver
+        RHOSTS hostname lookups shared by every client
+    snapshot : utils.snapshot.CacheSnapshot
+        saves the shared caches between runs; None if snapshot_file isn't set
+    perf : utils.histogram.PerfStats
+        latency histograms of every client's sessions ('perf' command)
+    profiler : utils.profiler.PromptProfiler
+        profiles every client's sessions while it's running ('profile' command)
+    metrics : utils.metrics.MetricsExporter
+        publishes the daemon's health; None unless metrics_file or metrics_port is set
+    socket_filename : str
+        path of the Unix socket
+
+    Methods
+    -------
+    serve_forever(self)
+        Accept clients until interrupted
+    """
+
+    def __init__(self, opts):
+        """
+        Parameters
+        ----------
+        opts : dict
+            options from the config file and command line
+        """
+        self.opts = opts
+        self.socket_filename = opts.get("socket_file", DEFAULT_SOCKET_FILENAME)
+        self.socket_mode = int(str(opts.get("socket_mode", DEFAULT_SOCKET_MODE)), 8)
+
+        logging.info("Starting MsfRpcClient for msf_promptd")
+        self.client = PooledMsfRpcClient(**opts)
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(opts.get("rpc_workers", DEFAULT_RPC_WORKERS)),
+            thread_name_prefix="rpc",
+        )
+        self.policy = PolicyCache(opts.get("target_file"), opts.get("user_perm_file"))
+        self.tab_cache = TabsCache()
+        result_cache_mb = float(opts.get("result_cache_mb", 0))
+        if result_cache_mb:
+            self.result_cache = ResultCache(max_bytes=result_cache_mb * 1024 * 1024)
+        else:
+            self.result_cache = None
+        self.module_index = ModuleIndex(
+            opts.get("module_index_file", DEFAULT_MODULE_INDEX_FILE)
+        )
+        self.channels = set()
+        self.registry = SessionRegistry(
+            self.client,
+            interval=opts.get("session_poll_interval", DEFAULT_POLL_INTERVAL),
+            on_event=self._broadcast,
+        )
+        self.host_index = HostIndex(self.client, self.policy)
+        self.resolver = CachedResolver.from_config(opts.get("resolver"))
+        self.perf = PerfStats()
+        self.profiler = PromptProfiler(opts.get("profile_dir"))
+        if opts.get("metrics_file") or opts.get("metrics_port"):
+            self.metrics = MetricsExporter(
+                opts.get("metrics_file"),
+                opts.get("metrics_port"),
+                interval=opts.get("metrics_interval", DEFAULT_METRICS_INTERVAL),
+            )
+            self.metrics.track_client(self.client)
+            self.metrics.track_perf(self.perf)
+            self.metrics.track_cache("completion", self.tab_cache)
+            self.metrics.track_cache("policy", self.policy)
+            self.metrics.track_cache("results", self.result_cache)
+        else:
+            self.metrics = None
+        if opts.get("snapshot_file"):
+            self.snapshot = CacheSnapshot(
+                opts["snapshot_file"],
+                self.client,
+                interval=opts.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL),
+            )
+            self.snapshot.track("tabs", self.tab_cache)
+            self.snapshot.track("results", self.result_cache)
+        else:
+            self.snapshot = None
+
+        self.stdout = RoutingStdout(sys.stdout)
+        sys.stdout = self.stdout
+
+    def _broadcast(self, text):
+        """Send a message (e.g. a session opened) to every attached client"""
+        for channel in list(self.channels):
+            channel.send({"type": "output", "data": text + "\n"})
+
+    def serve_forever(self):
+        """Listen on the Unix socket and serve each client on its own thread"""
+        self.registry.start()
+        self.module_index.start_refresh(self.client)
+        if self.snapshot is not None:
+            self.snapshot.start()
+        if self.metrics is not None:
+            self.metrics.start()
+        if os.path.exists(self.socket_filename):
+            # left behind by a previous daemon
+            os.unlink(self.socket_filename)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_filename)
+        os.chmod(self.socket_filename, self.socket_mode)
+        server.listen()
+        logging.info(f"msf_promptd listening on {self.socket_filename}")
+        try:
+            while True:
+                sock, _ = server.accept()
+                threading.Thread(
+                    target=self._serve_client, args=(sock,), daemon=True
+                ).start()
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.save()
+            if self.metrics is not None:
+                self.metrics.stop()
+            server.close()
+            os.unlink(self.socket_filename)
+
+    @staticmethod
+    def _peer_user(sock):
+        """Name of the user on the other end of the socket"""
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        pid, uid, gid = struct.unpack("3i", creds)
+        return pwd.getpwuid(uid)[0]
+
+    def _serve_client(self, sock):
+        channel = MessageChannel(sock)
+        user = self._peer_user(sock)
+        logging.info(f"[DAEMON][USER: {user}] attached")
+
+        def on_output(data):
+            if data.get("data"):
+                # same as MsfRpcConsole's default print()
+                channel.send({"type": "output", "data": data["data"] + "\n"})
+
+        console = msfconsole.MsfRpcConsole(self.client, cb=on_output)
+        self.stdout.route(lambda data: channel.send({"type": "output", "data": data}))
+        sess = None
+        try:
+            sess = DaemonSession(
+                console,
+                channel,
+                user,
+                hist_name=self.opts.get("history_file", HISTORY_FILENAME),
+                allow_overrides=self.opts.get("allow_overrides", True),
+                completion_budget=self.opts.get("completion_budget"),
+                suggestion_budget=self.opts.get("suggestion_budget"),
+                policy=self.policy,
+                executor=self.executor,
+                tab_cache=self.tab_cache,
+                registry=self.registry,
+                result_cache=self.result_cache,
+                module_index=self.module_index,
+                fuzzy_completion=self.opts.get("fuzzy_completion", False),
+                fanout_workers=self.opts.get("fanout_workers"),
+                fanout_timeout=self.opts.get("fanout_timeout"),
+                host_index=self.host_index,
+                resolver=self.resolver,
+                perf=self.perf,
+                profiler=self.profiler,
+            )
+            sess.warm_up()
+            self.channels.add(channel)
+            while True:
+                message = channel.receive()
+                if message is None:
+                    break
+                op = message.get("op")
+                if op == "prompt":
+                    channel.send({"type": "prompt", "text": sess.prompt_text})
+                elif op == "tabs":
+                    if sess.active_shell:
+                        completer = sess.active_shell.completer
+                    else:
+                        completer = sess.msf_completer.tab_source
+                    tabs = completer.tabs(message.get("text", ""))
+                    channel.send({"type": "tabs", "tabs": tabs or []})
+                elif op == "input":
+                    try:
+                        sess.handle_input(message.get("text", ""))
+                    except EOFError:
+                        channel.send({"type": "bye"})
+                        break
+                    channel.send({"type": "done", "prompt": sess.prompt_text})
+        except Exception as e:
+            logging.warning(f"from msf_promptd client {user}\n<<< {str(e)}")
+        finally:
+            self.channels.discard(channel)
+            self.stdout.unroute()
+            close_console(console)
+            if sess is not None:
+                sess.close()
+            channel.close()
+            logging.info(f"[DAEMON][USER: {user}] detached")
+
+
+def main():
+    """Start the daemon with the same config file and options as msf_prompt.py"""
+    opts = parseconfig(CONFIG_FILENAME)
+    o = parseargs()  # returns a Values object
+    for k, v in o.__dict__.items():
+        if k and v:
+            # only override config file value if command line param is not None
+            opts[k] = v
+
+    setup_logging(
+        opts.get("log_file", LOGGING_FILENAME), opts.get("queue_logging", False)
+    )
+    try:
+        PromptDaemon(opts).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+multiplexer
+===========
+
+Provides ConsoleMultiplexer, which hosts several named MsfRpcConsoles in one process
+behind a single OffPromptSession.
+
+Every console shares the one MsfRpcClient (and its keep-alive connection pool), one
+bounded RPC worker pool and the session's caches (tab-complete cache, policy).  Only
+the console-specific state (the MsfRpcConsole, the active shell and any output that
+arrived while the console was in the background) is kept per console, so switching
+consoles is a handful of attribute assignments.
+
+Built-in commands (handled before anything is sent to msfrpcd):
+    console                 list the consoles
+    console <name>          switch to a console
+    console -n <name>       create a new console and switch to it
+    console -k <name>       destroy a console
+"""
+from __future__ import unicode_literals
+
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pymetasploit3.msfconsole as msfconsole
+
+try:
+    from .offpromptsession import OffPromptSession
+    from .msf_prompt_styles import get_formatted_prompt
+    from .rpcconsole import close_console
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from offpromptsession import OffPromptSession
+    from msf_prompt_styles import get_formatted_prompt
+    from rpcconsole import close_console
+
+# Size of the worker pool shared by every console for RPC calls
+DEFAULT_RPC_WORKERS = 4
+# Number of output chunks kept for a console while it's in the background
+DEFAULT_BACKLOG = 1000
+
+
+class ConsoleSlot(object):
+    """State kept for each console hosted by a ConsoleMultiplexer
+
+    Attributes
+    ----------
+    name : str
+        name the user switches to the console with
+    console : pymetasploit3.msfconsole.MsfRpcConsole
+        console session for MetasploitFramework
+    active_shell : OffPromptShellSession
+        the shell the user was interacting with on this console
+    pending : collections.deque[str]
+        output that arrived while the console was in the background
+    """
+
+    __slots__ = ("name", "console", "active_shell", "pending", "dropped")
+
+    def __init__(self, name, backlog=DEFAULT_BACKLOG):
+        self.name = name
+        self.console = None
+        self.active_shell = None
+        self.pending = deque(maxlen=backlog)
+        self.dropped = 0
+
+
+class ConsoleMultiplexer(object):
+    """Several named MsfRpcConsoles sharing one client, worker pool and OffPromptSession
+
+    Attributes
+    ----------
+    client : pymetasploit3.msfrpc.MsfRpcClient
+        client shared by every console
+    executor : concurrent.futures.ThreadPoolExecutor
+        bounded worker pool shared by every console for RPC calls
+    session : OffPromptSession
+        the prompt; pointed at whichever console is active
+    slots : OrderedDict[str, ConsoleSlot]
+        hosted consoles by name
+    active : ConsoleSlot
+        the console the user is interacting with
+
+    Methods
+    -------
+    handle_input(self, text)
+        Handle the multiplexer's built-in commands or pass text to the active console
+    add(self, name)
+        Create a new console
+    switch(self, name)
+        Make a console the active one
+    remove(self, name)
+        Destroy a console
+    formatted_prompt(self)
+        Prompt for the active console prefixed with its name
+    """
+
+    # first words handled by handle_input itself rather than sent to msfrpcd
+    builtin_commands = ("console",)
+
+    def __init__(
+        self,
+        client,
+        names,
+        max_workers=DEFAULT_RPC_WORKERS,
+        backlog=DEFAULT_BACKLOG,
+        console_factory=msfconsole.MsfRpcConsole,
+        **session_kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        client : pymetasploit3.msfrpc.MsfRpcClient
+            client shared by every console
+        names : list[str]
+            names of the consoles to create; the first is active
+        max_workers : int, optional
+            size of the RPC worker pool shared by every console
+        backlog : int, optional
+            number of output chunks kept for a console in the background
+        console_factory : callable(client, cb=...), optional
+            creates each console; MsfRpcConsole or rpcconsole.RpcConsole
+        **session_kwargs
+            passed to OffPromptSession (hist_name, allow_overrides, ...)
+        """
+        if not names:
+            raise ValueError("at least one console name is required")
+        self.client = client
+        self.backlog = backlog
+        self.console_factory = console_factory
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(max_workers), thread_name_prefix="rpc"
+        )
+        self.slots = OrderedDict()
+        self.active = None
+
+        first = self._create(names[0])
+        self.session = OffPromptSession(
+            first.console, executor=self.executor, **session_kwargs
+        )
+        self._activate(first)
+        for name in names[1:]:
+            self.add(name)
+
+    def _create(self, name):
+        slot = ConsoleSlot(name, self.backlog)
+        self.slots[name] = slot
+        # the callback is used from the console's poller thread
+        slot.console = self.console_factory(
+            self.client, cb=partial(self._on_output, slot)
+        )
+        logging.info(f"[CONSOLE] created {name}")
+        return slot
+
+    def _on_output(self, slot, data):
+        """Print output for the active console; hold it for background consoles"""
+        text = data.get("data")
+        if not text:
+            return
+        if slot is self.active:
+            print(text)
+        else:
+            if len(slot.pending) == slot.pending.maxlen:
+                slot.dropped += 1
+            slot.pending.append(text)
+
+    def _activate(self, slot):
+        if self.active is not None:
+            self.active.active_shell = self.session.active_shell
+        self.active = slot
+        self.session.switch_console(slot.console, slot.active_shell)
+
+        if slot.dropped:
+            print(f"[*] {slot.dropped} older output chunks from {slot.name} were dropped")
+            slot.dropped = 0
+        while slot.pending:
+            print(slot.pending.popleft())
+
+    def add(self, name):
+        """Create a new console without switching to it
+
+        Parameters
+        ----------
+        name : str
+            name of the new console
+        """
+        if name in self.slots:
+            print(f"[-] Console {name} already exists")
+            return
+        self._create(name)
+
+    def switch(self, name):
+        """Make a console the active one
+
+        Parameters
+        ----------
+        name : str
+            name of the console
+        """
+        slot = self.slots.get(name)
+        if slot is None:
+            print(f"[-] Invalid console: {name}")
+            return
+        if slot is not self.active:
+            self._activate(slot)
+            logging.info(f"[CONSOLE][USER: {self.session.current_user}] switched to {name}")
+
+    def remove(self, name):
+        """Destroy a console; the active console can't be removed
+
+        Parameters
+        ----------
+        name : str
+            name of the console
+        """
+        slot = self.slots.get(name)
+        if slot is None:
+            print(f"[-] Invalid console: {name}")
+            return
+        if slot is self.active:
+            print(f"[-] Can't remove the active console; switch to another first")
+            return
+        del self.slots[name]
+        close_console(slot.console)
+        logging.info(f"[CONSOLE] destroyed {name}")
+
+    def list_consoles(self):
+        """Print every console, marking the active one and any unread output"""
+        for name, slot in self.slots.items():
+            marker = "*" if slot is self.active else " "
+            unread = f" ({len(slot.pending)} unread)" if slot.pending else ""
+            print(f"[{marker}] {name}{unread}")
+
+    def handle_input(self, text):
+        """Handle the built-in console commands, otherwise pass text to the session
+
+        Parameters
+        ----------
+        text : str
+            The user-submitted command
+        """
+        words = text.split()
+        if words and words[0].lower() == "console" and not self.session.active_shell:
+            logging.info(f"[COMMAND][USER: {self.session.current_user}]\n+ {text}")
+            if len(words) == 1:
+                self.list_consoles()
+            elif words[1] == "-n" and len(words) == 3:
+                self.add(words[2])
+                self.switch(words[2])
+            elif words[1] == "-k" and len(words) == 3:
+                self.remove(words[2])
+            elif len(words) == 2:
+                self.switch(words[1])
+            else:
+                print("Usage: console [<name> | -n <name> | -k <name>]")
+            return
+        self.session.handle_input(text)
+
+    def formatted_prompt(self):
+        """
+        Returns
+        -------
+        prompt_text : list
+            List of tuples describing prompt formatting for the active console
+        """
+        return [("class:console", f"[{self.active.name}] ")] + get_formatted_prompt(
+            self.session.prompt_text
+        )
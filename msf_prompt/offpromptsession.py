@@ -1,26 +1,73 @@
 from __future__ import unicode_literals
+import asyncio
 import ipaddress
 import logging
 import os
-import pickle
 import pwd
 import re
 import string
-from time import sleep
+import threading
+from collections import deque
+from time import monotonic, sleep
+from urllib.parse import urlsplit
 
 from prompt_toolkit import PromptSession, HTML
+from prompt_toolkit.application import run_in_terminal
+from prompt_toolkit.application.current import set_app
 from prompt_toolkit.completion import (
     WordCompleter,
     Completer,
     Completion,
+    DynamicCompleter,
     merge_completers,
 )
-from prompt_toolkit.lexers import PygmentsLexer
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.auto_suggest import *
+from prompt_toolkit.history import FileHistory, InMemoryHistory, ThreadedHistory
+from prompt_toolkit.auto_suggest import (
+    AutoSuggestFromHistory,
+    DynamicAutoSuggest,
+    Suggestion,
+)
 from prompt_toolkit.validation import Validator, ValidationError
 from prompt_toolkit.shortcuts import yes_no_dialog
 
+import pymetasploit3.msfrpc as msfrpc
+
+try:
+    from .fanout import FanOut, DEFAULT_FANOUT_WORKERS, DEFAULT_FANOUT_TIMEOUT
+    from .hostindex import HostIndex
+    from .policy import PolicyCache
+    from .moduleindex import ModuleIndex
+    from .registry import SessionRegistry
+    from .sessionindex import (
+        CommandIndex,
+        IndexAutoSuggest,
+        IndexCompleter,
+        stream_command,
+    )
+    from .utils.breaker import CircuitBreaker
+    from .utils.histogram import PerfStats
+    from .utils.profiler import PromptProfiler, CPROFILE
+    from .utils.resolver import CachedResolver
+    from .utils.tabcache import TabsCache
+except ImportError:
+    # running as a script from inside the msf_prompt directory
+    from fanout import FanOut, DEFAULT_FANOUT_WORKERS, DEFAULT_FANOUT_TIMEOUT
+    from hostindex import HostIndex
+    from policy import PolicyCache
+    from moduleindex import ModuleIndex
+    from registry import SessionRegistry
+    from sessionindex import (
+        CommandIndex,
+        IndexAutoSuggest,
+        IndexCompleter,
+        stream_command,
+    )
+    from utils.breaker import CircuitBreaker
+    from utils.histogram import PerfStats
+    from utils.profiler import PromptProfiler, CPROFILE
+    from utils.resolver import CachedResolver
+    from utils.tabcache import TabsCache
+
 # The file that stores user permissions for modules
 DEFAULT_USER_MODULE_FILE = "configs/user_module_list.pickle"
 # The file that stores list of valid targets
@@ -28,14 +75,129 @@ DEFAULT_ALLOWED_TARGETS_FILE = "configs/allowed_targets.pickle"
 # The file that contains a list of standard msfconsole commands
 DEFAULT_COMPLETER_WORDLIST = "configs/word_suggestions.txt"
 # The file that contains the list of user command history
-DEFAULT_COMPLETER_WORDLIST = ".off_prompt_hist"
 DEFAULT_HISTORY_FILENAME = ".off_prompt_hist"
+# Seconds tab-complete/auto-suggest will wait on msfrpcd before using local sources
+DEFAULT_COMPLETION_BUDGET = 0.5
+DEFAULT_SUGGESTION_BUDGET = 0.2
+# Number of output lines kept for each shell session
+DEFAULT_SCROLLBACK_LINES = 1000
+# Number of scrollback lines re-printed when going back to a shell session
+DEFAULT_SCROLLBACK_REPLAY = 20
+# Seconds a cached-result query may run on msfrpcd
+DEFAULT_QUERY_TIMEOUT = 120
+# RHOSTS hosts that are hostnames (at least one letter); underscores are accepted
+# because the resolver accepts them
+HOSTNAME_PATTERN = re.compile(
+    r"^(?=.*[a-z])[a-z0-9_]([a-z0-9_-]*[a-z0-9_])?"
+    r"(\.[a-z0-9_]([a-z0-9_-]*[a-z0-9_])?)*\.?$",
+    re.I,
+)
+
+
+# Only one session fills the shared wordlist
+_wordlist_lock = threading.Lock()
+
+
+def module_from_prompt(prompt):
+    """Module a console prompt shows (e.g. 'exploit/multi/handler'), None if none"""
+    prompt = "".join(c for c in prompt if c in string.printable)
+    match = re.search(r"(\w+)\(([^)]+)\)", prompt)
+    if match:
+        return f"{match.group(1)}/{match.group(2)}"
+    return None
+
+
+def load_wordlist(filename=DEFAULT_COMPLETER_WORDLIST):
+    """
+    Parameters
+    ----------
+    filename : str, optional
+        comma separated list of standard msfconsole commands
+
+    Returns
+    -------
+    wordlist : list[str]
+        the commands; empty if the file can't be read
+    """
+    try:
+        with open(filename, "r") as infi:
+            return infi.read().strip().split(",")
+    except FileNotFoundError as e:
+        logging.warning(e)
+        return []
 
 
 class InvalidTargetError(Exception):
     pass
 
 
+def split_rhost(value):
+    """Host and CIDR prefix of one RHOSTS value
+
+    Takes apart the forms Metasploit accepts besides a bare host: 'host/24',
+    'host:445', 'scheme://host[:port][/path]' and '[ipv6]:port'.
+
+    Parameters
+    ----------
+    value : str
+        one value of a 'set RHOSTS' command
+
+    Returns
+    -------
+    host, prefix : tuple(str, str or None)
+        the address, range or hostname, and the CIDR prefix length if there was one
+
+    Raises
+    ------
+    InvalidTargetError
+        If the value can't be checked here (a file: list, a URL without a host, a
+        prefix that isn't a number)
+    """
+    unchecked = InvalidTargetError(
+        f"Warning {value} can't be checked against the allowed list"
+    )
+    if value.lower().startswith("file:"):
+        raise unchecked
+    if "://" in value:
+        try:
+            host = urlsplit(value).hostname
+        except ValueError:
+            host = None
+        if not host:
+            raise unchecked
+        return host, None
+    prefix = None
+    if "/" in value:
+        value, prefix = value.rsplit("/", 1)
+        if not prefix.isdigit():
+            raise unchecked
+    if value.startswith("[") and "]" in value:
+        value = value[1 : value.index("]")]
+    elif value.count(":") == 1:
+        # host:port; more colons is an IPv6 address
+        value = value.split(":")[0]
+    return value, prefix
+
+
+def _literal_targets(host, prefix):
+    """Address, CIDR or range as targets; ValueError if host is none of those"""
+    if "-" in host and prefix is None:
+        return [str(net) for net in _address_range(host)]
+    if prefix is None:
+        return [str(ipaddress.ip_address(host))]
+    return [str(ipaddress.ip_network(f"{host}/{prefix}", strict=False))]
+
+
+def _address_range(host):
+    """Networks covering an address range ('10.0.0.1-10.0.0.9' or '10.0.0.1-9')"""
+    start, end = host.split("-", 1)
+    start = ipaddress.ip_address(start)
+    if "." not in end and ":" not in end and start.version == 4:
+        # only the last octet given
+        end = start.exploded.rsplit(".", 1)[0] + "." + end
+    return ipaddress.summarize_address_range(start, ipaddress.ip_address(end))
+
+
 class InvalidPermissionError(Exception):
     pass
 
@@ -55,6 +217,111 @@ class ShellExitError(Exception):
     pass
 
 
+class TabSource(object):
+    """Source of tab-complete strings for MsfCompleter and MsfAutoSuggest
+
+    Asks msfrpcd through console.console.tabs; when a circuit breaker is given the call
+    is held to the breaker's latency budget and, if msfrpcd is slow or failing, the
+    answer comes from local sources only (cached tabs answers, wordlist and history).
+    Module paths after 'use ' come from the local module index once it has been built.
+
+    Attributes
+    ----------
+    console : pymetasploit3.MsfRpcConsole
+        current console that can be used to search through tab-complete
+    breaker : utils.breaker.CircuitBreaker
+        latency budget for the feature using this source; None to always ask msfrpcd
+    tab_cache : utils.tabcache.TabsCache
+        answers msfrpcd has already given, kept per module the console was using
+    wordlist : list[str]
+        static list of words that are common for msfconsole
+    history : prompt_toolkit.history.History
+        user command history
+    module_index : moduleindex.ModuleIndex
+        local module index; answers 'use <module>' without msfrpcd
+    perf : utils.histogram.PerfStats
+        times of the tabs calls to msfrpcd ('tabs')
+
+    Methods
+    -------
+    tabs(self, text)
+        Tab-complete strings for text
+    local_tabs(self, text)
+        Tab-complete strings for text without asking msfrpcd
+    """
+
+    def __init__(
+        self,
+        console,
+        breaker=None,
+        tab_cache=None,
+        wordlist=None,
+        history=None,
+        module_index=None,
+        perf=None,
+    ):
+        self.console = console
+        self.breaker = breaker
+        self.tab_cache = tab_cache if tab_cache is not None else TabsCache()
+        # the session's shared list is kept even while it's empty (it's filled later)
+        self.wordlist = wordlist if wordlist is not None else []
+        self.history = history
+        self.module_index = module_index
+        self.perf = perf if perf is not None else PerfStats()
+
+    def tabs(self, text):
+        """
+        Parameters
+        ----------
+        text : str
+            text to tab-complete
+
+        Returns
+        -------
+        tabs : list[str]
+            full strings that complete text
+        """
+        if self.module_index is not None and text.startswith("use "):
+            paths = self.module_index.complete(text[4:].lstrip())
+            if paths:
+                return ["use " + path for path in paths]
+        if self.breaker is None:
+            return self._rpc_tabs(text)
+        return self.breaker.call(
+            self._rpc_tabs, text, fallback=lambda: self.local_tabs(text)
+        )
+
+    def _rpc_tabs(self, text):
+        # main call to the rpc hook to get what msfrpcd thinks is a propper tab-complete
+        with self.perf.timer("tabs"):
+            tabs = self.console.console.tabs(text)
+        self.tab_cache.put(text, tabs, module_from_prompt(self.console.prompt))
+        return tabs
+
+    def local_tabs(self, text):
+        """Tab-complete strings from local sources: cached answers, wordlist, history
+
+        Parameters
+        ----------
+        text : str
+            text to tab-complete
+
+        Returns
+        -------
+        tabs : list[str]
+            full strings that complete text
+        """
+        context = module_from_prompt(self.console.prompt)
+        tabs = list(self.tab_cache.lookup(text, context))
+        if text and " " not in text:
+            tabs.extend(w for w in self.wordlist if w.startswith(text))
+        if self.history is not None:
+            tabs.extend(
+                h for h in self.history.get_strings() if h.startswith(text) and h != text
+            )
+        return tabs
+
+
 class MsfCompleter(Completer):
     """Class used for suggesting tab-complete strings to user
 
@@ -67,15 +334,48 @@ class MsfCompleter(Completer):
     ----------
     console : pymetasploit3.MsfRpcConsole
         current console that can be used to search through tab-complete
+    tab_source : TabSource
+        where tab-complete strings come from (msfrpcd or local fallbacks)
+    registry : registry.SessionRegistry
+        local copy of the sessions; completes 'sessions -i' without asking msfrpcd
+    fuzzy : bool
+        complete 'use <words>' with full module paths that roughly contain the words
+        (e.g. 'use smb ms17') when no path starts with what was typed
+    host_index : hostindex.HostIndex
+        in-scope hosts and open ports of the workspace; completes 'set RHOSTS'/'set RPORT'
+    perf : utils.histogram.PerfStats
+        time from a complete event to the last completion being shown ('complete')
+    profiler : utils.profiler.PromptProfiler
+        profiles completions while it's running
 
     Methods
     -------
     get_completions(self, document, compete_event)
         Main callback from when the user hits <tab>
+    group_completions(text, full_completions)
+        Count full-line completions by the next path segment after text
     """
 
-    def __init__(self, console):
+    def __init__(
+        self,
+        console,
+        tab_source=None,
+        registry=None,
+        fuzzy=False,
+        host_index=None,
+        perf=None,
+        profiler=None,
+    ):
         self.console = console
+        if tab_source:
+            self.tab_source = tab_source
+        else:
+            self.tab_source = TabSource(console)
+        self.registry = registry
+        self.fuzzy = fuzzy
+        self.host_index = host_index
+        self.perf = perf if perf is not None else PerfStats()
+        self.profiler = profiler if profiler is not None else PromptProfiler()
 
     def get_completions(self, document, complete_event):
         """Main callback from when a complete_event occurs (usually when the user hits <tab>)
@@ -90,30 +390,100 @@ class MsfCompleter(Completer):
         _ : prompt_toolkit.completion.Completion
             single suggestion to the user wrapped by a Completion class
         """
+        with self.perf.timer("complete"), self.profiler.section():
+            yield from self._get_completions(document, complete_event)
+
+    def _get_completions(self, document, complete_event):
+        # session ids come from the registry
+        if self.registry is not None:
+            match = re.match(r"sessions? -i\s+(\d*)$", document.text.lstrip())
+            if match:
+                sessions = self.registry.sessions
+                for sid in sorted(sessions, key=int):
+                    if sid.startswith(match.group(1)):
+                        info = sessions[sid]
+                        yield Completion(
+                            sid,
+                            -len(match.group(1)),
+                            display_meta=f"{info.get('type', '')} {info.get('session_host', '')}",
+                        )
+                return
 
-        # main call to the rpc hook to get what msfrpcd thinks is a propper tab-complete
-        full_completions = self.console.console.tabs(document.text)
-
-        already_suggested = (
-            []
-        )  # keeps track of things already suggested to the user between yields
-        if full_completions:
-            for a in full_completions:
-                partial_completion = a[len(document.text) :].split("/")[
-                    0
-                ]  # from the cursor to the next '/'
-                first_half = re.split("[ /]", a[: len(document.text)])[
-                    -1
-                ]  # from the beginning of word to cursor
-                comp = first_half + partial_completion
-                if comp in already_suggested:
-                    # prevents duplicates from being suggested to the user
-                    # "already_suggested gets cleared on each time a CompleteEvent is called
-                    continue
+        # in-scope hosts and open ports come from the host index
+        if self.host_index is not None:
+            match = re.match(
+                r"setg?\s+(rhosts?|rport)\s+(.*)$", document.text.lstrip(), re.I
+            )
+            if match:
+                word = re.split("[ ,]", match.group(2))[-1]
+                if match.group(1).lower() == "rport":
+                    for port, name, count in self.host_index.complete_ports(word):
+                        yield Completion(
+                            port, -len(word), display_meta=f"{name} ({count} hosts)"
+                        )
                 else:
-                    already_suggested.append(comp)
-                    # yield the entire text and input the text at the beginning of where the word begins
-                    yield Completion(comp, -len(first_half))
+                    services = self.host_index.services
+                    for address in self.host_index.complete_hosts(word):
+                        ports = sorted(services.get(address, ()))
+                        yield Completion(
+                            address,
+                            -len(word),
+                            display_meta=",".join(str(p) for p in ports[:8]),
+                        )
+                return
+
+        # fuzzy module paths from the local module index's trigrams
+        module_index = self.tab_source.module_index
+        if self.fuzzy and module_index is not None and document.text.startswith("use "):
+            query = document.text[4:]
+            if query.strip() and not module_index.complete(query.lstrip()):
+                for path in module_index.fuzzy(query):
+                    yield Completion(
+                        path,
+                        -len(query),
+                        display_meta=module_index.modules.get(path, {}).get("rank", ""),
+                    )
+                return
+
+        # msfrpcd's tab-complete (or local sources if msfrpcd is degraded)
+        full_completions = self.tab_source.tabs(document.text)
+        if not full_completions:
+            return
+
+        # from the beginning of the word to the cursor; the same for every candidate
+        first_half = re.split("[ /]", document.text)[-1]
+        groups = self.group_completions(document.text, full_completions)
+        for partial_completion, count in groups.items():
+            # yield the entire word and insert it at the beginning of where the word begins
+            yield Completion(
+                first_half + partial_completion,
+                -len(first_half),
+                display_meta=f"{count} matches" if count > 1 else "",
+            )
+
+    @staticmethod
+    def group_completions(text, full_completions):
+        """Group full-line completions by the next path segment after text
+
+        Parameters
+        ----------
+        text : str
+            the text before the cursor
+        full_completions : list[str]
+            full-line completions (from TabSource.tabs)
+
+        Returns
+        -------
+        groups : dict{str: int}
+            each segment (from the cursor to the next '/') and the number of
+            completions under it, in the order they were first seen
+        """
+        groups = {}
+        start = len(text)
+        for completion in full_completions:
+            partial_completion = completion[start:].split("/", 1)[0]
+            groups[partial_completion] = groups.get(partial_completion, 0) + 1
+        return groups
 
 
 class MsfAutoSuggest(AutoSuggestFromHistory):
@@ -129,6 +499,12 @@ class MsfAutoSuggest(AutoSuggestFromHistory):
         current console that can be used to search through tab-complete
     wordlist : list[str]
         static list of words that are common for msfconsole
+    tab_source : TabSource
+        where tab-complete strings come from (msfrpcd or local fallbacks)
+    perf : utils.histogram.PerfStats
+        time taken to find each suggestion ('suggest')
+    profiler : utils.profiler.PromptProfiler
+        profiles suggestions while it's running
 
     Methods
     -------
@@ -136,7 +512,9 @@ class MsfAutoSuggest(AutoSuggestFromHistory):
         Main callback for when an auto_suggest is called; usually when the buffer updates
     """
 
-    def __init__(self, console, wordlist=None, **kwargs):
+    def __init__(
+        self, console, wordlist=None, tab_source=None, perf=None, profiler=None, **kwargs
+    ):
         """
         Parameters
         ----------
@@ -144,13 +522,25 @@ class MsfAutoSuggest(AutoSuggestFromHistory):
             current console that can be used to search through tab-complete
         wordlist : list[str], optional
             static list of words that are common for msfconsole
+        tab_source : TabSource, optional
+            where tab-complete strings come from; asks msfrpcd directly if not given
+        perf : utils.histogram.PerfStats, optional
+            where suggestion times are recorded
+        profiler : utils.profiler.PromptProfiler, optional
+            profiler that covers suggestions while it's running
         """
 
         self.console = console
-        if wordlist:
+        if wordlist is not None:
             self.wordlist = wordlist
         else:
             self.wordlist = []
+        if tab_source:
+            self.tab_source = tab_source
+        else:
+            self.tab_source = TabSource(console, wordlist=self.wordlist)
+        self.perf = perf if perf is not None else PerfStats()
+        self.profiler = profiler if profiler is not None else PromptProfiler()
 
     def get_suggestion(self, buffer, document):
         """main callback when a suggestion is needed from auto_suggest
@@ -167,7 +557,10 @@ class MsfAutoSuggest(AutoSuggestFromHistory):
         suggestion : prompt_toolkit.auto_suggest.Suggestion
             The suggestion to load on the line
         """
+        with self.perf.timer("suggest"), self.profiler.section():
+            return self._get_suggestion(buffer, document)
 
+    def _get_suggestion(self, buffer, document):
         # check user history first
         suggestion = super().get_suggestion(buffer, document)
         if suggestion is None:  # nothing in our history
@@ -182,7 +575,7 @@ class MsfAutoSuggest(AutoSuggestFromHistory):
                         break
                 if suggestion is None:  # nothing from wordlist
                     # check tab complete suggestions from rpc
-                    tabs = self.console.console.tabs(
+                    tabs = self.tab_source.tabs(
                         text
                     )  # should return a list of strings that match tab-complete for the console
                     if tabs:
@@ -218,10 +611,20 @@ class OffPromptSession(PromptSession):
     ----------
     active_shell : OffPromptShellSession
         the shell the user has chosen to interact with
-    auto_suggest : prompt_toolkit.auto_suggest.AutoSuggestFromHistory
-        auto populate line based on user's history
-    completer : prompt_toolkit.completion.WordCompleter
-        suggests completion to user based on string currently typed
+    auto_suggest : prompt_toolkit.auto_suggest.DynamicAutoSuggest
+        auto populate line; msf_auto_suggest, or the active shell's auto_suggest
+    completer : prompt_toolkit.completion.DynamicCompleter
+        suggests completion; msf_completer, or the active shell's completer
+    msf_completer : MsfCompleter
+        tab-complete from msfrpcd (or local fallbacks)
+    msf_auto_suggest : MsfAutoSuggest
+        auto populate line based on user's history, word-list and msf tab-completes
+    command_index : sessionindex.CommandIndex
+        commands for each session type and platform, shared by every shell
+    result_cache : utils.resultcache.ResultCache
+        output of read-only commands (show/info); None if not enabled
+    module_index : moduleindex.ModuleIndex
+        local module metadata for 'lsearch' and 'use' tab-complete
     module_filename : str
         filename of the file that maps users to allowed modules
     msf_console : pymetasploit3.msfconsole.MsfRpcConsole
@@ -232,26 +635,57 @@ class OffPromptSession(PromptSession):
         filename of the file that defines allowed targets
     wordlist : list
         list of words to populate the completer
+    tab_cache : utils.tabcache.TabsCache
+        tab-complete answers from msfrpcd; used when msfrpcd is degraded
+    completion_breaker, suggestion_breaker : utils.breaker.CircuitBreaker
+        latency budgets that switch completer/auto_suggest to local sources
+    policy : policy.PolicyCache
+        cached target white-list and user/module permissions
+    fanout : fanout.FanOut
+        runs a command on several sessions at once ('fanout' command)
+    registry : registry.SessionRegistry
+        local copy of the sessions and jobs on msfrpcd
+    host_index : hostindex.HostIndex
+        in-scope hosts and open ports of the workspace (RHOSTS/RPORT completion)
+    resolver : utils.resolver.CachedResolver
+        resolves hostnames in 'set RHOSTS' so they can be checked against the white-list
+    perf : utils.histogram.PerfStats
+        latency histograms of the rpc calls, checks and completions ('perf' command)
+    profiler : utils.profiler.PromptProfiler
+        profiles handle_input, completion and suggestion on demand ('profile' command)
         
 
     Methods
     -------
     handle_input(self, text)
         Main callback for when the user submits input
+    rhosts_targets(self, text)
+        Addresses and networks a 'set RHOSTS' command targets (hostnames resolved)
     validate_targets(self, targets)
         Ensure targets are on approved white list
     validate_user_perms(self, module)
         Ensure user has permission to run module.
     allowed_modules(self, user)
         Returns list of allowed modules for a given user.
+    switch_console(self, console, active_shell=None)
+        Point the session at a different MsfRpcConsole
+    confirm(self, title, text)
+        Ask the user a yes/no question
+    warm_up(self)
+        Load the wordlist, policy files and module index in the background
+    print_perf(self, reset=False)
+        Print the latency percentiles of every timed operation
+    profile_command(self, text)
+        Start or stop the profiler ('profile start [cprofile|sample]', 'profile stop')
+    close(self)
+        Destroy the msfrpcd console used for cached queries
     """
 
+    # first words handled by handle_input itself rather than sent to msfrpcd
+    builtin_commands = ("fanout", "lsearch", "perf", "profile")
+
+    # filled in by warm_up(); shared by every session and its completers
     wordlist = []
-    try:
-        with open(DEFAULT_COMPLETER_WORDLIST, "r+") as infi:
-            wordlist = infi.read().strip().split(",")
-    except FileNotFoundError as e:
-        logging.warning(e)
 
     def __init__(
         self,
@@ -260,6 +694,21 @@ class OffPromptSession(PromptSession):
         allow_overrides=False,
         module_filename=None,
         target_filename=None,
+        completion_budget=None,
+        suggestion_budget=None,
+        policy=None,
+        executor=None,
+        tab_cache=None,
+        fanout_workers=None,
+        fanout_timeout=None,
+        registry=None,
+        result_cache=None,
+        module_index=None,
+        fuzzy_completion=False,
+        host_index=None,
+        resolver=None,
+        perf=None,
+        profiler=None,
         *args,
         **kwargs,
     ):
@@ -276,6 +725,42 @@ class OffPromptSession(PromptSession):
             filename of the file that maps users to allowed modules
         target_filename : str, optional
             filename of the file that defines allowed targets
+        completion_budget : float, optional
+            seconds tab-complete waits on msfrpcd before using local sources
+        suggestion_budget : float, optional
+            seconds auto-suggest waits on msfrpcd before using local sources
+        policy : policy.PolicyCache, optional
+            target/permission cache to share with other sessions; built from
+            target_filename and module_filename if not given
+        executor : concurrent.futures.Executor, optional
+            bounded worker pool for RPC calls shared with other sessions
+        tab_cache : utils.tabcache.TabsCache, optional
+            tab-complete cache to share with other sessions
+        fanout_workers : int, optional
+            number of sessions a fanout command runs on at the same time
+        fanout_timeout : float, optional
+            seconds a fanout command may run on one session
+        registry : registry.SessionRegistry, optional
+            sessions/jobs copy to share with other sessions; one that is refreshed on
+            demand is created if not given (call registry.start() to poll)
+        result_cache : utils.resultcache.ResultCache, optional
+            cache for the output of read-only commands; they always go to msfrpcd if
+            not given
+        module_index : moduleindex.ModuleIndex, optional
+            local module index to share with other sessions; the saved index is used
+            if not given (call module_index.start_refresh() to bring it up to date)
+        fuzzy_completion : bool, optional
+            complete 'use <words>' with module paths that roughly contain the words
+        host_index : hostindex.HostIndex, optional
+            workspace hosts and services shared between sessions; one that pulls from
+            this session's msfrpcd is created if not given
+        resolver : utils.resolver.CachedResolver, optional
+            resolves hostnames in 'set RHOSTS'; the system resolver if not given
+        perf : utils.histogram.PerfStats, optional
+            latency histograms to share with other sessions
+        profiler : utils.profiler.PromptProfiler, optional
+            profiler to share with other sessions; writes to the current directory if
+            not given
             
         *args, **kwargs:
             args to override default PromptSession behavoir
@@ -283,7 +768,13 @@ class OffPromptSession(PromptSession):
 
         self.msf_console = console
         self._allow_overrides = allow_overrides
-        self.active_shell = None
+        self._active_shell = None
+        self.result_cache = result_cache
+        # msfrpcd console that cached-result queries run on (created when needed)
+        self._query_console = None
+        self._query_module = None
+        # shell sessions by session id; reused on every 'sessions -i'
+        self.shell_sessions = {}
 
         if module_filename:
             self._module_filename = module_filename
@@ -297,6 +788,34 @@ class OffPromptSession(PromptSession):
             self.hist_name = hist_name
         else:
             self.hist_name = DEFAULT_HISTORY_FILENAME
+        if policy:
+            self.policy = policy
+        else:
+            self.policy = PolicyCache(self._target_filename, self._module_filename)
+        if module_index:
+            self.module_index = module_index
+        else:
+            self.module_index = ModuleIndex()
+        if registry:
+            self.registry = registry
+        else:
+            self.registry = SessionRegistry(self.msf_console.console.rpc)
+        if host_index:
+            self.host_index = host_index
+        else:
+            self.host_index = HostIndex(self.msf_console.console.rpc, self.policy)
+        if resolver:
+            self.resolver = resolver
+        else:
+            self.resolver = CachedResolver()
+        if perf:
+            self.perf = perf
+        else:
+            self.perf = PerfStats()
+        if profiler:
+            self.profiler = profiler
+        else:
+            self.profiler = PromptProfiler()
 
         # If file doesn't exist, create it
         try:
@@ -305,20 +824,138 @@ class OffPromptSession(PromptSession):
         except FileNotFoundError as e:
             with open(self.hist_name, "w+") as outfi:
                 pass
-        _history = FileHistory(self.hist_name)
+        # read by a background thread so a long history doesn't hold up the first prompt
+        _history = ThreadedHistory(FileHistory(self.hist_name))
 
         super().__init__(history=_history, *args, **kwargs)
 
-        self.completer = MsfCompleter(self.msf_console)
+        # tab-complete and auto-suggest fall back to local sources when msfrpcd is slow
+        if tab_cache is not None:
+            self.tab_cache = tab_cache
+        else:
+            self.tab_cache = TabsCache()
+        self.completion_breaker = CircuitBreaker(
+            "completion",
+            budget=completion_budget or DEFAULT_COMPLETION_BUDGET,
+            probe=self._probe_tabs,
+            executor=executor,
+        )
+        self.suggestion_breaker = CircuitBreaker(
+            "suggestion",
+            budget=suggestion_budget or DEFAULT_SUGGESTION_BUDGET,
+            probe=self._probe_tabs,
+            executor=executor,
+        )
+
+        self.msf_completer = MsfCompleter(
+            self.msf_console,
+            TabSource(
+                self.msf_console,
+                self.completion_breaker,
+                self.tab_cache,
+                self.wordlist,
+                _history,
+                self.module_index,
+                self.perf,
+            ),
+            self.registry,
+            fuzzy_completion,
+            self.host_index,
+            self.perf,
+            self.profiler,
+        )
         self.enable_history_search = True
-        self.auto_suggest = MsfAutoSuggest(self.msf_console, self.wordlist)
+        self.msf_auto_suggest = MsfAutoSuggest(
+            self.msf_console,
+            self.wordlist,
+            TabSource(
+                self.msf_console,
+                self.suggestion_breaker,
+                self.tab_cache,
+                self.wordlist,
+                module_index=self.module_index,
+                perf=self.perf,
+            ),
+            perf=self.perf,
+            profiler=self.profiler,
+        )
+
+        # while a shell is active it provides tab-complete and auto-suggest
+        self.completer = DynamicCompleter(
+            lambda: self.active_shell.completer
+            if self.active_shell
+            else self.msf_completer
+        )
+        self.auto_suggest = DynamicAutoSuggest(
+            lambda: self.active_shell.auto_suggest
+            if self.active_shell
+            else self.msf_auto_suggest
+        )
+        # commands for each session type and platform, shared by every shell
+        self.command_index = CommandIndex()
+
+        self.fanout = FanOut(
+            self,
+            max_workers=fanout_workers or DEFAULT_FANOUT_WORKERS,
+            timeout=fanout_timeout or DEFAULT_FANOUT_TIMEOUT,
+        )
+
+    def warm_up(self):
+        """Load what the first prompt doesn't need on a background thread
+
+        The wordlist, the target/permission files and the saved module index are all
+        read on first use otherwise; this gets them ready while the user types.
+        """
+        threading.Thread(target=self._warm_up, name="warm-up", daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            with _wordlist_lock:
+                if not self.wordlist:
+                    # filled in place; the completers hold the same list
+                    self.wordlist.extend(load_wordlist())
+            self.policy.refresh()
+            self.module_index._ensure_loaded()
+        except Exception as e:
+            logging.warning(f"from warm up\n<<< {str(e)}")
+
+    def close(self):
+        """Destroy the query console run_cached opened, if any"""
+        query_console, self._query_console = self._query_console, None
+        if query_console is not None:
+            try:
+                query_console.destroy()
+            except Exception as e:
+                logging.warning(f"from query console destroy\n<<< {str(e)}")
+
+    def _probe_tabs(self):
+        """Cheap tab-complete used by the circuit breakers to test msfrpcd"""
+        return self.msf_console.console.tabs("")
+
+    def switch_console(self, console, active_shell=None):
+        """Point the session (and its completer and auto_suggest) at another console
+
+        Used to multiplex several MsfRpcConsoles through one prompt.
+
+        Parameters
+        ----------
+        console : pymetasploit3.msfconsole.MsfRpcConsole
+            console session for MetasploitFramework
+        active_shell : OffPromptShellSession, optional
+            the shell the user was interacting with on that console
+        """
+        self.msf_console = console
+        self.active_shell = active_shell
+        for feature in (self.msf_completer, self.msf_auto_suggest):
+            feature.console = console
+            feature.tab_source.console = console
 
     def handle_input(self, text):
         """Main callback for when the user submits input
 
         The main flow for this method is to:
             1) check if user is in an active shell (divert execution to shell if true)
-            2) check for keywords that will divert execution ('exit', 'sessions -i')
+            2) check for keywords that will divert execution ('exit', 'sessions -i', 'fanout')
             3) check for keywords that will trigger permission checks ('exploit', 'use', 'set rhost')
             4) execute
     
@@ -340,9 +977,14 @@ class OffPromptSession(PromptSession):
         UserOverrideDenied
             If user declines to override warning
         """
+        with self.profiler.section():
+            self._handle_input(text)
+
+    def _handle_input(self, text):
         try:
             # Log the command
             logging.info(f"[COMMAND][USER: {self.current_user}]\n+ {text}")
+            self.perf.incr("commands")
             lower_text = (
                 text.lower().strip()
             )  # temp variable to prevent re-writing text.lower().strip() all the time
@@ -351,10 +993,10 @@ class OffPromptSession(PromptSession):
             if self.active_shell:
                 # send all input down to shell's handle_input function
                 try:
-                    self.active_shell.handle_input(text)
+                    with self.perf.timer("shell_command"):
+                        self.active_shell.handle_input(text)
                 except ShellExitError as e:
-                    # Shell has exited
-                    # BUG: is there a memory leak here....?
+                    # Shell has been backgrounded; it stays in shell_sessions for reuse
                     self.active_shell = None
 
             # 2) check for keywords that will divert execution ('exit', 'sessions -i')
@@ -369,154 +1011,435 @@ class OffPromptSession(PromptSession):
                 # find which session the user wants to interact with
                 try:
                     requested_session = re.findall(
-                        "sessions? -i\W+([0-9]{1,9})", lower_text
+                        r"sessions? -i\W+([0-9]{1,9})", lower_text
                     )[0]
-                    if (
-                        requested_session
-                        in self.msf_console.console.rpc.sessions.list.keys()
-                    ):
-                        # Create new MsfSession (either MeterpreterSession or ShellSession)
-                        # found valid session, now do something
-                        shell = self.msf_console.console.rpc.sessions.session(
-                            requested_session
-                        )
-                        # create a new object for them to interact with
-                        shellSession = OffPromptShellSession(
-                            shell, self.msf_console, hist_name=self.hist_name
-                        )
-                        self.active_shell = shellSession
-                        # somehow gracefully get back to msfconsole when they exit?
+                    with self.perf.timer("sessions.list"):
+                        info = self.registry.session(requested_session)
+                    if info:
+                        self.attach_shell(requested_session, self.registry.sessions)
                     else:
+                        # drop the pooled shell of a session that has closed
+                        self.shell_sessions.pop(requested_session, None)
                         print(f"[-] Invalid session identifier: {requested_session}")
                 except Exception as e:
                     print(e)
                     logging.warning(f"from sessions -i\n <<< {str(e)}")
 
+            # run a command on several sessions at once
+            elif lower_text.split()[:1] == ["fanout"]:
+                self.fanout.run(text)
+
+            # ranked search of the local module index
+            elif lower_text.split()[:1] == ["lsearch"]:
+                query = text.split(None, 1)[1] if " " in text.strip() else ""
+                self.module_index.print_results(self.module_index.search(query))
+
+            # latency percentiles of everything timed so far
+            elif lower_text.split()[:1] == ["perf"]:
+                self.print_perf(reset=lower_text.split()[1:] == ["reset"])
+
+            # start/stop profiling this prompt
+            elif lower_text.split()[:1] == ["profile"]:
+                self.profile_command(text)
+
+            # read-only commands answered from the result cache
+            elif self.result_cache is not None and self.result_cache.cacheable(text):
+                self.run_cached(text)
+
             else:
+                if lower_text.startswith("reload_all") and self.result_cache is not None:
+                    # module output may change
+                    self.result_cache.clear()
                 # 3) check for keywords that will trigger permission checks
                 # ('exploit', 'use', 'set rhost')
-                if lower_text.startswith("exploit"):
-                    """getting the attributes of the module is going to be difficult;
-                    instead the program will check against valid list when user enters; 
-                    investigate more
-
-                    turns out you can run console.execute("get [parameter (e.g. rhost)]") and you'll get
-                    the answer back in as: "[parameter] => [value]"; need to look into this more
-                    """
-                    # validate targets
-                    # validate user permissions
-
-                    # prompt for confirm if 'exploit'
-                    confirm = yes_no_dialog(
-                        title="Confirm Exploit", text="Confirm Submission"
-                    )
-                    if confirm:
-                        pass
-                    else:
-                        raise Exception("User aborted exploitation")
-
-                ############################################
-                # Validate rhost against allowed target file
-                ############################################
-                elif lower_text.startswith("set") and "rhost" in lower_text:
-
-                    # find all IPs in 'set' command
-                    # future: add hostnames as well
-                    targets = re.findall("(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})", text)
-                    try:
-                        self.validate_targets(targets)
-
-                    except InvalidTargetError as e:
-                        print("in set rhost")
-                        print(e)
-                        logging.warning(f"from invalid target error\n<<< {str(e)}")
-
-                        if self.allow_overrides:
-                            # ask user if they want to override the warning
-                            override = yes_no_dialog(
-                                title="Target Override",
-                                text="An invalid target was added; do you want to continue anyway?",
-                            )
-                            if override:
-                                raise UserOverride(
-                                    f"{self.current_user} overrode warning: {e}"
-                                )
-                            else:
-                                raise UserOverrideDenied(
-                                    f"{self.current_user} chose not to overide warning: {e}"
-                                )
-                        else:
-                            raise UserOverrideDenied(
-                                f"{self.current_user} attempted disallowed action: {e}"
-                            )
-
-                #######################################################################
-                # Validate selected module against list of allowed modules for the user
-                #######################################################################
-                elif lower_text.startswith("use"):
-                    try:
-                        module = re.findall("use (.*)", lower_text)[0]
-                        self.validate_user_perms(module)
-                    except InvalidPermissionError as e:
-                        print(e)
-
-                        logging.warning(f"from invalid permission error<<< {str(e)}")
-
-
-                        if self.allow_overrides:
-                            # ask user if they want to override the warning
-                            override = yes_no_dialog(
-                                title="User Module Permission Override",
-                                text="The current user does not have permission to run the selected module. \
-                                        Would you like to continue anyway?",
-                            )
-                            if override:
-                                raise UserOverride(
-                                    f"{self.current_user} overrode warning: {e}"
-                                )
-                            else:
-                                raise UserOverrideDenied(
-                                    f"{self.current_user} chose not to overide warning: {e}"
-                                )
-                        else:
-                            raise UserOverrideDenied(
-                                f"{self.current_user} attempted disallowed action: {e}"
-                            )
-
-                    except Exception as e:
-                        print(e)
-                        logging.warning(f"from use\n<<< {str(e)}")
-
-                ######################
-                # finally do something
-                ######################
-                self.msf_console.execute(text)
-
-                # this is a terrible way to account for the prompt printing before it's changed
-                # on the msfrpcd side, but sleeping for 1 second seems to reduce this error
-                sleep(1)
+                if self.validate_input(text):
+                    ######################
+                    # finally do something
+                    ######################
+                    with self.perf.timer("execute"):
+                        self.msf_console.execute(text)
+
+                    # this is a terrible way to account for the prompt printing before it's changed
+                    # on the msfrpcd side, but sleeping for 1 second seems to reduce this error
+                    sleep(1)
+
+        except EOFError as e:
+            raise e
+
+        except Exception as e:
+            print(str(e))
+            logging.warning(f"from handle input\n<<< {str(e)}")
+
+    def print_perf(self, reset=False):
+        """Print p50/p95/p99 of every timed step, then of every msfrpcd call
+
+        Parameters
+        ----------
+        reset : bool, optional
+            start the report over afterwards ('perf reset'); exported metrics keep
+            counting
+        """
+        self.perf.print_report("operation")
+        rpc_perf = getattr(self.msf_console.console.rpc, "perf", None)
+        if rpc_perf is not None:
+            rpc_perf.print_report("rpc method")
+        if reset:
+            self.perf.reset()
+            if rpc_perf is not None:
+                rpc_perf.reset()
+
+    def profile_command(self, text):
+        """Start, stop or show the profiler
+
+            profile start [cprofile|sample]
+            profile stop
+            profile
+
+        Parameters
+        ----------
+        text : str
+            the 'profile' command
+        """
+        args = text.lower().split()[1:]
+        try:
+            if args[:1] == ["start"]:
+                mode = args[1] if len(args) > 1 else CPROFILE
+                self.profiler.start(mode)
+                print(f"[*] {mode} profiler started; 'profile stop' writes the profile")
+            elif args[:1] == ["stop"]:
+                filename, summary = self.profiler.stop()
+                print(summary)
+                print(f"[*] Profile written to {filename}")
+            else:
+                print(f"[*] Profiler: {self.profiler.mode or 'stopped'}")
+                print("    profile start [cprofile|sample] | profile stop")
+        except ValueError as e:
+            print(f"[-] {e}")
+            logging.warning(f"from profile\n<<< {str(e)}")
+
+    def attach_shell(self, sid, sessions):
+        """Make a session's shell the active one, reusing it if it's been used before
+
+        Parameters
+        ----------
+        sid : str
+            session id
+        sessions : dict[str, dict]
+            sessions.list from msfrpcd
+        """
+        shell_session = self.shell_sessions.get(sid)
+        if shell_session is None:
+            # build the MeterpreterSession/ShellSession from the list we already have
+            # rather than letting sessions.session() fetch it again
+            rpc = self.msf_console.console.rpc
+            info = sessions[sid]
+            if info.get("type") == "meterpreter":
+                shell = msfrpc.MeterpreterSession(sid, rpc, {sid: info})
+            else:
+                shell = msfrpc.ShellSession(sid, rpc, {sid: info})
+            shell_session = OffPromptShellSession(
+                shell, self.msf_console, info, self.command_index
+            )
+            self.shell_sessions[sid] = shell_session
+        else:
+            shell_session.replay()
+        self.active_shell = shell_session
 
+    def run_cached(self, text):
+        """Print a read-only command's output, from the result cache if possible
+
+        On a miss the command runs on a separate msfrpcd console (in the same module
+        as this one) so its output can be collected without racing the console
+        poller.
+
+        Parameters
+        ----------
+        text : str
+            a command ResultCache.cacheable accepts
+        """
+        rpc = self.msf_console.console.rpc
+        self.result_cache.check_version(lambda: rpc.core.version.get("version"))
+        module = self.current_module
+        key = self.result_cache.key(text, module)
+        output = self.result_cache.get(key)
+        if output is None:
+            with self.perf.timer("cached_query"):
+                output = self._query(text, module)
+            self.result_cache.put(key, output)
+        print(output)
+
+    def _query(self, text, module):
+        """Run text on the query console with module selected and return its output"""
+        if self._query_console is None:
+            self._query_console = self.msf_console.console.rpc.consoles.console()
+            self._query_module = None
+            self._read_until_idle(self._query_console)  # banner
+        if module != self._query_module:
+            self._query_console.write(f"use {module}" if module else "back")
+            self._read_until_idle(self._query_console)
+            self._query_module = module
+        self._query_console.write(text)
+        return self._read_until_idle(self._query_console)
+
+    @staticmethod
+    def _read_until_idle(console, timeout=DEFAULT_QUERY_TIMEOUT):
+        """Read a console until msfrpcd reports it idle; returns everything read"""
+        output = []
+        idle_reads = 0
+        start = monotonic()
+        while monotonic() - start < timeout:
+            data = console.read()
+            if data.get("data"):
+                output.append(data["data"])
+            # msfrpcd may not have picked up the write yet; done once it has produced
+            # output or stays idle
+            idle_reads = 0 if data.get("busy") else idle_reads + 1
+            if idle_reads and (output or idle_reads >= 2):
+                break
+            sleep(0.05)
+        return "".join(output)
+
+    def validate_input(self, text):
+        """Run the target and permission checks for a command bound for msfrpcd
+
+        Asks the user to confirm 'exploit' and, if overrides are allowed, whether to
+        override a warning.  Overrides and denials are logged here.
+
+        Parameters
+        ----------
+        text : str
+            The user-submitted command
+
+        Returns
+        -------
+        _ : bool
+            True if the command should be sent to msfrpcd
+
+        Raises
+        ------
+        Exception
+            If the user aborts exploitation
+        """
+        try:
+            self.check_policy(text)
         except UserOverride as e:
             # user approved warning override
             # future consider sending this to alternate/remote logs
             logging.warning(f"USER WARNING OVERRIDE: {e}")
+            self.perf.incr("overrides")
             # execute command
-            self.msf_console.execute(text)
-            sleep(1)
-
+            return True
         except UserOverrideDenied as e:
             print(e)
             # user chose not to override warning message
             logging.warning(f"WARNING OVERRIDE DENIED: {e}")
+            self.perf.incr("denials")
             # do not execute command
+            return False
+        return True
 
-        except EOFError as e:
-            raise e
+    def check_policy(self, text):
+        """Check a command against the target white-list and user/module permissions
 
-        except Exception as e:
-            print(str(e))
-            logging.warning(f"from handle input\n<<< {str(e)}")
+        Parameters
+        ----------
+        text : str
+            The user-submitted command
 
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        UserOverride
+            If user elects to override warning
+        UserOverrideDenied
+            If user declines to override warning
+        Exception
+            If the user aborts exploitation
+        """
+        lower_text = text.lower().strip()
+        if lower_text.startswith("exploit"):
+            """getting the attributes of the module is going to be difficult;
+            instead the program will check against valid list when user enters; 
+            investigate more
+
+            turns out you can run console.execute("get [parameter (e.g. rhost)]") and you'll get
+            the answer back in as: "[parameter] => [value]"; need to look into this more
+            """
+            # validate targets
+            # validate user permissions
+
+            # prompt for confirm if 'exploit'
+            confirm = self.confirm(
+                title="Confirm Exploit", text="Confirm Submission"
+            )
+            if confirm:
+                pass
+            else:
+                raise Exception("User aborted exploitation")
+
+        ############################################
+        # Validate rhost against allowed target file
+        ############################################
+        elif lower_text.startswith("set") and "rhost" in lower_text:
+
+            try:
+                # every address, network and resolved hostname in the 'set' command
+                with self.perf.timer("rhosts_targets"):
+                    targets = self.rhosts_targets(text)
+                with self.perf.timer("validate_targets"):
+                    self.validate_targets(targets)
+
+            except InvalidTargetError as e:
+                print("in set rhost")
+                print(e)
+                logging.warning(f"from invalid target error\n<<< {str(e)}")
+
+                if self.allow_overrides:
+                    # ask user if they want to override the warning
+                    override = self.confirm(
+                        title="Target Override",
+                        text="An invalid target was added; do you want to continue anyway?",
+                    )
+                    if override:
+                        raise UserOverride(
+                            f"{self.current_user} overrode warning: {e}"
+                        )
+                    else:
+                        raise UserOverrideDenied(
+                            f"{self.current_user} chose not to overide warning: {e}"
+                        )
+                else:
+                    raise UserOverrideDenied(
+                        f"{self.current_user} attempted disallowed action: {e}"
+                    )
+
+        #######################################################################
+        # Validate selected module against list of allowed modules for the user
+        #######################################################################
+        elif lower_text.startswith("use"):
+            try:
+                module = re.findall("use (.*)", lower_text)[0]
+                with self.perf.timer("validate_user_perms"):
+                    self.validate_user_perms(module)
+            except InvalidPermissionError as e:
+                print(e)
+
+                logging.warning(f"from invalid permission error<<< {str(e)}")
+
+
+                if self.allow_overrides:
+                    # ask user if they want to override the warning
+                    override = self.confirm(
+                        title="User Module Permission Override",
+                        text="The current user does not have permission to run the selected module. \
+                                Would you like to continue anyway?",
+                    )
+                    if override:
+                        raise UserOverride(
+                            f"{self.current_user} overrode warning: {e}"
+                        )
+                    else:
+                        raise UserOverrideDenied(
+                            f"{self.current_user} chose not to overide warning: {e}"
+                        )
+                else:
+                    raise UserOverrideDenied(
+                        f"{self.current_user} attempted disallowed action: {e}"
+                    )
+
+            except Exception as e:
+                print(e)
+                logging.warning(f"from use\n<<< {str(e)}")
+
+    def confirm(self, title, text):
+        """Ask the user a yes/no question (e.g. to override a warning)
+
+        Parameters
+        ----------
+        title : str
+            title of the dialog
+        text : str
+            question to ask
+
+        Returns
+        -------
+        _ : bool
+            True if the user answered yes
+        """
+        if self.app.is_running and self.app.loop is not None:
+            # the prompt is live (asyncio mode) so ask on the terminal above it
+            return self._confirm_in_terminal(title, text)
+        answer = yes_no_dialog(title=title, text=text)
+        if hasattr(answer, "run"):
+            # prompt_toolkit 3 returns the dialog instead of running it
+            answer = answer.run()
+        return bool(answer)
+
+    def _confirm_in_terminal(self, title, text):
+        """confirm() from a worker thread while prompt_async owns the terminal"""
+
+        async def ask():
+            with set_app(self.app):
+                return await run_in_terminal(
+                    lambda: input(f"{title}: {text} [y/N] "), in_executor=True
+                )
+
+        answer = asyncio.run_coroutine_threadsafe(ask(), self.app.loop).result()
+        return answer.strip().lower().startswith("y")
+
+    def rhosts_targets(self, text):
+        """
+        Every address and network a 'set RHOSTS' command targets
+
+        Each value is taken apart with split_rhost; addresses, CIDRs and ranges are
+        kept as they are and hostnames are resolved (with their prefix applied to
+        each address).  Anything else fails closed.
+
+        Parameters
+        ----------
+            text : str
+                The user-submitted command
+
+        Returns
+        -------
+            targets : list[str]
+                addresses and CIDR networks, for validate_targets
+
+        Raises
+        ------
+            InvalidTargetError
+                Raised if a value can't be checked or a hostname doesn't resolve
+        """
+        targets = []
+        names = {}
+        for value in re.split(r"[\s,]+", text.strip())[2:]:
+            if not value:
+                continue
+            host, prefix = split_rhost(value)
+            try:
+                targets.extend(_literal_targets(host, prefix))
+                continue
+            except (ValueError, TypeError):
+                # not an address, CIDR or range
+                pass
+            if not HOSTNAME_PATTERN.match(host):
+                raise InvalidTargetError(
+                    f"Warning {value} can't be checked against the allowed list"
+                )
+            names.setdefault(host, set()).add(prefix)
+        if not names:
+            return targets
+        for name, resolved in self.resolver.resolve_all(list(names)).items():
+            if not resolved:
+                raise InvalidTargetError(f"Warning {name} does not resolve")
+            logging.info(f"[RESOLVER] {name} => {', '.join(resolved)}")
+            for prefix in names[name]:
+                for address in resolved:
+                    targets.extend(_literal_targets(address, prefix))
+        return targets
 
     def validate_targets(self, targets):
         """
@@ -525,7 +1448,7 @@ class OffPromptSession(PromptSession):
         Parameters
         ----------
             targets : list[str]
-                List of strings representing string of RHOST IPs
+                RHOST addresses and CIDR networks (see rhosts_targets)
 
         Returns
         -------
@@ -538,7 +1461,11 @@ class OffPromptSession(PromptSession):
         """
 
         for target in targets:
-            if ipaddress.ip_address(target) not in self.allowed_targets:
+            if "/" in target:
+                allowed = self.policy.network_allowed(ipaddress.ip_network(target))
+            else:
+                allowed = self.policy.target_allowed(ipaddress.ip_address(target))
+            if not allowed:
                 raise InvalidTargetError(f"Warning {target} is not on allowed list")
         return True
 
@@ -605,45 +1532,39 @@ class OffPromptSession(PromptSession):
             module_list.get(user, []) + module_list.get('ALL', [])
                 List of approved modules for a given user and all users, otherwise empty list
         """
-
         # future: make this a DB not a pickle
-        module_list = {}
-        try:
-            with open(self.module_filename, "rb") as infi:
-                module_list = pickle.load(infi)
-        except FileNotFoundError as e:
-            module_list["ALL"] = "*"  # fails open if no module list is found
-            logging.warning(e)
-            print(e)
-
-        return module_list.get(user, []) + module_list.get("ALL", [])
+        return self.policy.allowed_modules(user)
 
     @property
     def allowed_targets(self):
-        """Loads and returns list of approved targets from ALLOWED_TARGET_FILE
+        """Returns list of approved targets from ALLOWED_TARGET_FILE
 
         This function assumes that the target file is a pickled list of ipaddresses and
-        subnets from the ipaddress module
+        subnets from the ipaddress module; the file is cached by self.policy and only
+        re-read when it changes
 
         Returns
         -------
         tgts : list[ipaddress.IPv4Address]
             list of allowed IPv4 Addresses
         """
-        tgts = []
-        try:
-            with open(self.target_filename, "rb") as infi:
-                tmp_tgts = pickle.load(infi)
-            for tgt in tmp_tgts:
-                if isinstance(tgt, ipaddress.IPv4Network):
-                    tgts.extend(tgt.hosts())
-                else:
-                    tgts.append(tgt)
-        except Exception as e:
-            print(e)
-            logging.warning(f"from allowed_targets\n<<< {str(e)}")
+        return self.policy.allowed_targets()
 
-        return tgts
+    @property
+    def current_module(self):
+        """Module the console is using (e.g. 'exploit/multi/handler'), None if none"""
+        return module_from_prompt(self.msf_console.prompt)
+
+    @property
+    def active_shell(self):
+        return self._active_shell
+
+    @active_shell.setter
+    def active_shell(self, shell):
+        """Attach to (or detach from) a shell; the prompt uses the shell's history"""
+        self._active_shell = shell
+        if hasattr(self, "default_buffer"):
+            self.default_buffer.history = shell.history if shell else self.history
 
     @property
     def prompt_text(self):
@@ -654,50 +1575,123 @@ class OffPromptSession(PromptSession):
         prompt : str
             String represtation of what msfrpcd would display to user given the context
         """
-        if self.active_shell:
-            return self.active_shell.prompt_text
-        else:
-            return self.msf_console.prompt
+        with self.perf.timer("prompt"):
+            if self.active_shell:
+                return self.active_shell.prompt_text
+            else:
+                return self.msf_console.prompt
+
 
+class OffPromptShellSession(object):
+    """A shell from a target, driven through the parent OffPromptSession's prompt
 
-class OffPromptShellSession(OffPromptSession):
-    """Extension of OffPromptSession used for shells from targets
+    Launched when a user types "sessions -i [#]" at the OffPromptSession console.
+    It is deliberately small (no PromptSession or history file); the parent's prompt
+    is used and only the shell's own state is kept here.  One is kept per session id by
+    the parent and reused every time the user goes back to that session, so
+    'background' followed by 'sessions -i' keeps the scrollback and command history.
 
-    Launched when a user types "interact -i [#]" at the OffPromptSession console.
-    An OffPromptShellSession is much less featured than its parent and disables
-    the completer and auto_suggest since there's not a non-trivial way to do that with 
-    a generic shell.
+    The parent's prompt delegates tab-complete and auto-suggest to this object's
+    completer and auto_suggest while the shell is active.  Both are served from a
+    sessionindex.CommandIndex entry for the session's type and platform (meterpreter's
+    own command list, or common shell commands), so no rpc call is made per keystroke.
+    Commands are sent with the session's write API and output is printed as it is read.
 
     Attributes
     ----------
-    parent_console : OffPromptSession
-        unclear if this is a link to or a deep copy of the parent console
-    shell : pymetasploit3.msfrpc.ShellSession
+    parent_console : pymetasploit3.msfconsole.MsfRpcConsole
+        console the shell was opened from
+    shell : pymetasploit3.msfrpc.MeterpreterSession or ShellSession
         The shell instance the user is interacting with
+    session_type : str
+        'meterpreter' or 'shell'
+    platform : str
+        platform msfrpcd reported for the session
+    history : prompt_toolkit.history.InMemoryHistory
+        commands typed in this shell; used by the prompt while the shell is active
+    scrollback : collections.deque[str]
+        the most recent output lines from the shell
+    completer : sessionindex.IndexCompleter
+        tab-complete for the session's commands
+    auto_suggest : sessionindex.IndexAutoSuggest
+        suggestions from the shell's history and the session's commands
     """
 
-    def __init__(self, shell, console, *args, **kwargs):
-        """The OffPromptSession comes with a lot of functionality that standard shells
-        won't have so this init will turn a lot of them off.
+    __slots__ = (
+        "parent_console",
+        "shell",
+        "session_type",
+        "platform",
+        "history",
+        "scrollback",
+        "completer",
+        "auto_suggest",
+        "_prompt_text",
+    )
 
-        # future : consider a refactor where there is a more basic superclass and the 
-        subclasses implement more, not the other way around
+    def __init__(
+        self,
+        shell,
+        console,
+        info=None,
+        command_index=None,
+        scrollback=DEFAULT_SCROLLBACK_LINES,
+    ):
         """
-        super().__init__(console, *args, **kwargs)
-        # Turn off the normal OffPromptSession features
-        self.completer = None
-        self.enable_history_search = False
-        self.auto_suggest = None
-
-        # There's currently no non-trivial way of getting the shell's prompt
-        self._prompt_text = "unknown-shell > "
+        Parameters
+        ----------
+        shell : pymetasploit3.msfrpc.MeterpreterSession or ShellSession
+            The shell instance the user is interacting with
+        console : pymetasploit3.msfconsole.MsfRpcConsole
+            console the shell was opened from
+        info : dict, optional
+            the session's entry in sessions.list ('type', 'platform', ...)
+        command_index : sessionindex.CommandIndex, optional
+            command index to share with other sessions
+        scrollback : int, optional
+            number of output lines kept
+        """
+        info = info or {}
+        self.session_type = info.get("type", "shell")
+        self.platform = info.get("platform", "")
+        if self.session_type == "meterpreter":
+            self._prompt_text = "meterpreter > "
+        else:
+            # There's currently no non-trivial way of getting the shell's prompt
+            self._prompt_text = "unknown-shell > "
         self.parent_console = console
         self.shell = shell
+        self.history = InMemoryHistory()
+        self.scrollback = deque(maxlen=scrollback)
+
+        if command_index is None:
+            command_index = CommandIndex()
+        commands = command_index.commands(shell, self.session_type, self.platform)
+        self.completer = IndexCompleter(commands)
+        self.auto_suggest = IndexAutoSuggest(commands)
 
     @property
     def prompt_text(self):
         return self._prompt_text
 
+    def replay(self, lines=DEFAULT_SCROLLBACK_REPLAY):
+        """Print the end of the scrollback (e.g. when going back to the shell)
+
+        Parameters
+        ----------
+        lines : int, optional
+            number of lines to print
+        """
+        start = max(len(self.scrollback) - lines, 0)
+        for n, line in enumerate(self.scrollback):
+            if n >= start:
+                print(line)
+
+    def _late_output(self, output):
+        """Print output a command sent after it settled, before the next one runs"""
+        print(output, end="" if output.endswith("\n") else "\n")
+        self.scrollback.extend(output.splitlines())
+
     def handle_input(self, text):
         """
         Main callback for when the user submits input
@@ -728,7 +1722,15 @@ class OffPromptShellSession(OffPromptSession):
 
             elif lower_text:
                 # future: ID when the command is finished more gracefully
-                print(self.shell.run_with_output(text, "\n", timeout=5))
+                status, output = stream_command(
+                    self.shell,
+                    text,
+                    on_chunk=lambda chunk: print(chunk, end=""),
+                    on_stale=self._late_output,
+                )
+                self.scrollback.extend(output.splitlines())
+                if status == "timeout" and not output:
+                    print(f"[-] No output from session {self.shell.sid}")
         except ShellExitError as e:
             # pass up to the next level to set the active_shell to None
             raise e
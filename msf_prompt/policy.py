@@ -0,0 +1,270 @@
+"""
+policy
+======
+
+Provides PolicyCache, an in-memory copy of the target white-list and user/module
+permissions that is shared by every console in the process.
+
+The pickles written by usr_tgt_mod.py are only re-read when their modification time
+changes, and target subnets are kept as networks instead of being expanded into every
+host address, so a target check is a set lookup plus a scan of the subnets.
+"""
+from __future__ import unicode_literals
+
+import ipaddress
+import logging
+import os
+import pickle
+import threading
+from time import monotonic
+
+# The file that stores user permissions for modules
+DEFAULT_USER_MODULE_FILE = "configs/user_module_list.pickle"
+# The file that stores list of valid targets
+DEFAULT_ALLOWED_TARGETS_FILE = "configs/allowed_targets.pickle"
+# Seconds between checks of the policy files for changes
+DEFAULT_CHECK_INTERVAL = 1.0
+# Largest target range checked address by address; bigger ones must fit in a subnet
+DEFAULT_MAX_RANGE_CHECK = 4096
+
+
+class PolicyCache(object):
+    """Cached target white-list and user/module permissions
+
+    Attributes
+    ----------
+    target_filename : str
+        filename of the pickled list of allowed ipaddress addresses and networks
+    module_filename : str
+        filename of the pickled dict mapping users to allowed modules
+    version : int
+        incremented every time either file is (re)loaded
+    hits, misses : int
+        refreshes answered from memory and ones that reloaded a file
+
+    Methods
+    -------
+    refresh(self, force=False)
+        Reload either file if it changed on disk
+    target_allowed(self, address)
+        True if the address is on the target white-list
+    network_allowed(self, network)
+        True if every address of the network is on the target white-list
+    allowed_modules(self, user)
+        List of allowed modules for the user and all users
+    allowed_targets(self)
+        Expanded list of allowed addresses (as OffPromptSession.allowed_targets)
+    """
+
+    def __init__(
+        self,
+        target_filename=None,
+        module_filename=None,
+        check_interval=DEFAULT_CHECK_INTERVAL,
+    ):
+        """
+        Parameters
+        ----------
+        target_filename : str, optional
+            filename of the pickled list of allowed addresses and networks
+        module_filename : str, optional
+            filename of the pickled dict mapping users to allowed modules
+        check_interval : float, optional
+            seconds between checks of the files for changes
+        """
+        self.target_filename = target_filename or DEFAULT_ALLOWED_TARGETS_FILE
+        self.module_filename = module_filename or DEFAULT_USER_MODULE_FILE
+        self.check_interval = check_interval
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._checked = None
+        # -1 is never a real mtime so the first refresh always loads
+        self._target_mtime = -1
+        self._module_mtime = -1
+        self._raw_targets = []
+        self._addresses = frozenset()
+        self._networks = ()
+        self._modules = {}
+
+    @staticmethod
+    def _mtime(filename):
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force=False):
+        """Reload either policy file if its modification time changed
+
+        Parameters
+        ----------
+        force : bool, optional
+            check the files even if check_interval hasn't passed
+
+        Returns
+        -------
+        _ : bool
+            True if anything was reloaded
+        """
+        now = monotonic()
+        with self._lock:
+            if (
+                not force
+                and self._checked is not None
+                and now - self._checked < self.check_interval
+            ):
+                self.hits += 1
+                return False
+            self._checked = now
+
+            reloaded = False
+            mtime = self._mtime(self.target_filename)
+            if mtime != self._target_mtime:
+                self._target_mtime = mtime
+                self._load_targets()
+                reloaded = True
+            mtime = self._mtime(self.module_filename)
+            if mtime != self._module_mtime:
+                self._module_mtime = mtime
+                self._load_modules()
+                reloaded = True
+            if reloaded:
+                self.version += 1
+                self.misses += 1
+            else:
+                self.hits += 1
+            return reloaded
+
+    def _load_targets(self):
+        raw = []
+        try:
+            with open(self.target_filename, "rb") as infi:
+                raw = list(pickle.load(infi))
+        except Exception as e:
+            print(e)
+            logging.warning(f"from allowed_targets\n<<< {str(e)}")
+
+        addresses = set()
+        networks = []
+        for tgt in raw:
+            if isinstance(tgt, ipaddress.IPv4Network):
+                networks.append(tgt)
+            else:
+                addresses.add(tgt)
+        self._raw_targets = raw
+        self._addresses = frozenset(addresses)
+        self._networks = tuple(networks)
+
+    def _load_modules(self):
+        # future: make this a DB not a pickle
+        module_list = {}
+        try:
+            with open(self.module_filename, "rb") as infi:
+                module_list = pickle.load(infi)
+        except FileNotFoundError as e:
+            module_list["ALL"] = ["*"]  # fails open if no module list is found
+            logging.warning(e)
+            print(e)
+        self._modules = module_list
+
+    def target_allowed(self, address):
+        """
+        Parameters
+        ----------
+        address : ipaddress.IPv4Address or ipaddress.IPv6Address
+            address to check
+
+        Returns
+        -------
+        _ : bool
+            True if the address is on the white-list or is a host of a white-listed subnet
+        """
+        self.refresh()
+        return self._address_allowed(address)
+
+    def _address_allowed(self, address):
+        if address in self._addresses:
+            return True
+        for net in self._networks:
+            if address in net and (
+                net.prefixlen >= 31
+                or address not in (net.network_address, net.broadcast_address)
+            ):
+                # same addresses as IPv4Network.hosts()
+                return True
+        return False
+
+    def network_allowed(self, network):
+        """
+        Parameters
+        ----------
+        network : ipaddress.IPv4Network or ipaddress.IPv6Network
+            every address of it is a target (as Metasploit expands a CIDR RHOSTS)
+
+        Returns
+        -------
+        _ : bool
+            True if every address of the network is allowed
+        """
+        self.refresh()
+        for net in self._networks:
+            if (
+                net.version == network.version
+                and network.subnet_of(net)
+                and (
+                    net.prefixlen >= 31
+                    or not {net.network_address, net.broadcast_address}
+                    & {network.network_address, network.broadcast_address}
+                )
+            ):
+                return True
+        if network.num_addresses > DEFAULT_MAX_RANGE_CHECK:
+            return False
+        return all(self._address_allowed(address) for address in network)
+
+    def allowed_modules(self, user):
+        """
+        Parameters
+        ----------
+        user : str
+            String name of the user.
+
+        Returns
+        -------
+        _ : list[str]
+            List of approved modules for a given user and all users, otherwise empty list
+        """
+        self.refresh()
+        modules = self._modules
+        return list(modules.get(user, [])) + list(modules.get("ALL", []))
+
+    def allowed_targets(self):
+        """
+        Returns
+        -------
+        tgts : list[ipaddress.IPv4Address]
+            every allowed address with subnets expanded into their hosts
+        """
+        self.refresh()
+        tgts = []
+        for tgt in self._raw_targets:
+            if isinstance(tgt, ipaddress.IPv4Network):
+                tgts.extend(tgt.hosts())
+            else:
+                tgts.append(tgt)
+        return tgts
+
+    @property
+    def networks(self):
+        """White-listed IPv4 subnets"""
+        self.refresh()
+        return self._networks
+
+    @property
+    def addresses(self):
+        """White-listed single addresses"""
+        self.refresh()
+        return self._addresses
@@ -0,0 +1,173 @@
+"""
+registry
+========
+
+Provides SessionRegistry, a local copy of msfrpcd's sessions and jobs.
+
+One poller keeps the copy current; each poll is diffed against the last one and
+sessions/jobs that opened or closed are announced.  Everything that needs to know
+which sessions exist ('sessions -i' checks and completion, fanout, the prompt's
+status) reads the copy instead of asking msfrpcd.
+
+The poller is either the registry's own thread (start()) or whoever calls refresh()
+on an interval (e.g. the asyncio loop).  If nothing has refreshed the copy recently it
+is refreshed on first use, so a registry that was never started still works.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from time import monotonic
+
+# Seconds between polls of msfrpcd for sessions and jobs
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class SessionRegistry(object):
+    """Sessions and jobs on msfrpcd, refreshed by one background poller
+
+    Attributes
+    ----------
+    sessions : dict[str, dict]
+        sessions.list as of the last refresh; replaced (never mutated) on refresh
+    jobs : dict[str, str]
+        jobs.list as of the last refresh; replaced (never mutated) on refresh
+    on_event : callable(str)
+        called with a message for every session/job that opened or closed
+
+    Methods
+    -------
+    refresh(self)
+        Poll msfrpcd once and announce what changed
+    start(self)
+        Refresh on an interval from a background thread
+    session(self, sid)
+        Info for a session, or None if it doesn't exist
+    list_sessions(self)
+        All sessions, refreshed first if the copy is stale
+    status_fragments(self)
+        Prompt fragments with the session and job counts
+    """
+
+    def __init__(self, rpc, interval=DEFAULT_POLL_INTERVAL, on_event=print):
+        """
+        Parameters
+        ----------
+        rpc : pymetasploit3.msfrpc.MsfRpcClient
+            client connected to msfrpcd
+        interval : float, optional
+            seconds between polls; the copy is considered stale after two intervals
+        on_event : callable(str), optional
+            called with a message for every session/job that opened or closed
+        """
+        self.rpc = rpc
+        self.interval = float(interval)
+        self.on_event = on_event
+        self.sessions = {}
+        self.jobs = {}
+
+        self._updated = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Poll msfrpcd once, swap in the new lists and announce the differences
+
+        Returns
+        -------
+        events : list[str]
+            messages for the sessions/jobs that opened or closed
+        """
+        with self._lock:
+            sessions = self.rpc.sessions.list
+            jobs = self.rpc.jobs.list
+            events = []
+            if self._updated is not None:
+                # nothing is announced for what already existed at the first poll
+                for sid in sorted(sessions.keys() - self.sessions.keys(), key=int):
+                    info = sessions[sid]
+                    events.append(
+                        f"[*] Session {sid} opened ({info.get('type', '')} "
+                        f"{info.get('session_host', '')})"
+                    )
+                for sid in sorted(self.sessions.keys() - sessions.keys(), key=int):
+                    events.append(f"[*] Session {sid} closed")
+                for jid in jobs.keys() - self.jobs.keys():
+                    events.append(f"[*] Job {jid} started ({jobs[jid]})")
+                for jid in self.jobs.keys() - jobs.keys():
+                    events.append(f"[*] Job {jid} finished")
+            self.sessions = sessions
+            self.jobs = jobs
+            self._updated = monotonic()
+
+        for event in events:
+            logging.info(f"[REGISTRY] {event}")
+            self.on_event(event)
+        return events
+
+    def start(self):
+        """Refresh every interval from a background thread until stop() is called"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._poll_loop, name="registry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"from session registry\n<<< {str(e)}")
+            self._stop.wait(self.interval)
+
+    def _ensure_fresh(self):
+        if self._updated is None or monotonic() - self._updated > 2 * self.interval:
+            self.refresh()
+
+    def list_sessions(self):
+        """
+        Returns
+        -------
+        sessions : dict[str, dict]
+            every session, as in sessions.list
+        """
+        self._ensure_fresh()
+        return self.sessions
+
+    def session(self, sid):
+        """
+        Parameters
+        ----------
+        sid : str
+            session id
+
+        Returns
+        -------
+        info : dict
+            the session's entry in sessions.list; None if it doesn't exist
+        """
+        self._ensure_fresh()
+        info = self.sessions.get(sid)
+        if info is None:
+            # it may have opened since the last poll
+            self.refresh()
+            info = self.sessions.get(sid)
+        return info
+
+    def status_fragments(self):
+        """
+        Returns
+        -------
+        _ : list
+            prompt fragments with the session and job counts; empty when there are none
+        """
+        sessions, jobs = len(self.sessions), len(self.jobs)
+        if not sessions and not jobs:
+            return []
+        return [("class:sessions", f"[sessions: {sessions} jobs: {jobs}] ")]
@@ -0,0 +1,131 @@
+"""
+rpcconsole
+==========
+
+Provides RpcConsole, a drop-in replacement for the pymetasploit3 MsfRpcConsole that does
+not start its own polling thread.
+
+MsfRpcConsole re-arms a threading.Timer every half second to read console output.
+RpcConsole has the same attributes that OffPromptSession uses (console, prompt,
+execute) but output is only read when read() is called, so the caller decides how it
+is polled (e.g. an asyncio task, see asyncloop).
+
+close_console stops and destroys either kind of console.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+
+class RpcConsole(object):
+    """msfrpcd console whose output is read on demand
+
+    Attributes
+    ----------
+    console : pymetasploit3.msfrpc.MsfConsole
+        the console on msfrpcd (tabs, read, write, ...)
+    prompt : str
+        prompt msfrpcd returned with the last read
+    busy : bool
+        True if msfrpcd reported the console busy on the last read
+    callback : callable(dict)
+        called with {'data': str, 'prompt': str} when output arrives; prints if None
+
+    Methods
+    -------
+    read(self)
+        Read any pending output from msfrpcd and hand it to the callback
+    execute(self, command)
+        Execute a command on the console
+    destroy(self)
+        Destroy the console on msfrpcd
+    """
+
+    def __init__(self, rpc, cb=None, cid=None):
+        """
+        Parameters
+        ----------
+        rpc : pymetasploit3.msfrpc.MsfRpcClient
+            client connected to msfrpcd
+        cb : callable(dict), optional
+            called with {'data': str, 'prompt': str} when output arrives
+        cid : str, optional
+            id of an existing console to attach to; a new console is created if None
+        """
+        self.console = rpc.consoles.console(cid)
+        self.callback = cb
+        self.prompt = ""
+        self.busy = False
+        self.lock = threading.Lock()
+
+    def read(self):
+        """Read any pending output and hand it to the callback
+
+        Returns
+        -------
+        data : dict
+            what msfrpcd returned ('data', 'prompt', 'busy')
+        """
+        with self.lock:
+            data = self.console.read()
+        self.busy = bool(data.get("busy", False))
+        if data.get("data") or self.prompt != data.get("prompt", self.prompt):
+            self.prompt = data.get("prompt", self.prompt)
+            if self.callback is not None:
+                self.callback(data)
+            elif data.get("data"):
+                print(data["data"])
+        return data
+
+    def execute(self, command):
+        """
+        Execute a command on the console.
+
+        Parameters
+        ----------
+        command : str
+            the command to execute
+        """
+        if not command.endswith("\n"):
+            command += "\n"
+        with self.lock:
+            self.console.write(command)
+        self.busy = True
+
+    def destroy(self):
+        """Destroy the console on msfrpcd"""
+        with self.lock:
+            self.console.destroy()
+
+
+def close_console(console):
+    """Stop polling a console and destroy it on msfrpcd
+
+    Setting MsfRpcConsole.running to False makes its poller return with the lock still
+    held, so its __del__ deadlocks and the Timer thread is leaked.  Instead the poller
+    is replaced: the Timer already armed reads once more (releasing the lock) and then
+    re-arms with a function that destroys the console and doesn't re-arm.
+
+    Parameters
+    ----------
+    console : RpcConsole or pymetasploit3.msfconsole.MsfRpcConsole
+        console to close
+    """
+    if isinstance(console, RpcConsole):
+        try:
+            console.destroy()
+        except Exception as e:
+            logging.warning(f"from console destroy\n<<< {str(e)}")
+        return
+
+    def destroy():
+        try:
+            console.console.destroy()
+        except Exception as e:
+            logging.warning(f"from console destroy\n<<< {str(e)}")
+        # so __del__ doesn't destroy it again
+        console.type_ = None
+        console.running = False
+
+    console._poller = destroy
@@ -0,0 +1,314 @@
+"""
+sessionindex
+============
+
+Session-type aware pieces used by OffPromptShellSession and FanOut.
+
+CommandIndex holds the commands available in a session, built once per session type
+and platform ('meterpreter'/'shell', 'windows'/'linux'/...) and then shared by every
+session of that kind.  Meterpreter's index is parsed from its own 'help' output; shells
+use a list of common commands for the platform.  IndexCompleter and IndexAutoSuggest
+serve tab-complete and suggestions from the index and the session's history without
+any rpc call per keystroke.
+
+stream_command sends a command with the session's write API and reads the output back
+as it arrives (rather than sleeping and collecting it all at the end).
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import threading
+from concurrent.futures import Future
+from time import monotonic, sleep
+
+from prompt_toolkit.auto_suggest import AutoSuggestFromHistory, Suggestion
+from prompt_toolkit.completion import Completer, Completion
+
+# Seconds between reads of a session's output
+DEFAULT_READ_INTERVAL = 0.2
+# Number of empty reads after output has arrived before a command is considered done
+DEFAULT_SETTLE_READS = 3
+# Seconds to wait for output before giving up on a command
+DEFAULT_IDLE_TIMEOUT = 5
+# Seconds without any output after which empty reads also settle a command, as
+# 'silent' (commands like 'cd' never print anything; slow ones may print later)
+DEFAULT_SILENT_GRACE = 2
+# Most reads spent draining output left over from an earlier command
+DEFAULT_MAX_DRAIN_READS = 50
+# Commands offered in plain shells, by platform
+SHELL_COMMANDS = {
+    "windows": (
+        "cd cls copy del dir echo hostname ipconfig move net netstat ping powershell "
+        "reg set systeminfo tasklist taskkill type whoami"
+    ).split(),
+    "unix": (
+        "cat cd cp echo env find grep hostname id ifconfig ip ls mv netstat ps pwd rm "
+        "ss uname whoami"
+    ).split(),
+}
+# Commands every session type understands (handled by OffPromptShellSession)
+SESSION_COMMANDS = [("background", "Return to the msf console")]
+
+
+def stream_command(
+    shell,
+    command,
+    on_chunk=None,
+    timeout=DEFAULT_IDLE_TIMEOUT,
+    read_interval=DEFAULT_READ_INTERVAL,
+    settle_reads=DEFAULT_SETTLE_READS,
+    max_time=None,
+    grace=DEFAULT_SILENT_GRACE,
+    on_stale=None,
+):
+    """Write a command to a session and read its output until it goes quiet
+
+    Output already waiting in the session (late output of an earlier command that
+    settled as 'silent') is drained first so it isn't taken as this command's.
+
+    Parameters
+    ----------
+    shell : pymetasploit3.msfrpc.MeterpreterSession or ShellSession
+        session to run the command in
+    command : str
+        the command
+    on_chunk : callable(str), optional
+        called with each piece of output as it arrives
+    timeout : float, optional
+        seconds without any output before giving up
+    read_interval : float, optional
+        seconds between reads
+    settle_reads : int, optional
+        empty reads after output has arrived before the command is considered done
+    max_time : float, optional
+        seconds the command may run in total, even if it's still producing output
+    grace : float, optional
+        seconds after which a command that hasn't printed anything is settled by
+        empty reads like one that has
+    on_stale : callable(str), optional
+        called with output drained before the command was written; logged if None
+
+    Returns
+    -------
+    status, output : tuple(str, str)
+        'done', 'silent' (settled without printing anything; it may still be running)
+        or 'timeout', and everything that was read
+    """
+    stale = drain(shell)
+    if stale:
+        if on_stale is not None:
+            on_stale(stale)
+        else:
+            logging.info(f"[SESSION] output left over before '{command}'\n{stale}")
+    shell.write(command)
+    output = []
+    quiet = 0
+    start = last_output = monotonic()
+    while True:
+        chunk = shell.read()
+        if chunk:
+            output.append(chunk)
+            quiet = 0
+            last_output = monotonic()
+            if on_chunk is not None:
+                on_chunk(chunk)
+        elif output or monotonic() - start >= grace:
+            quiet += 1
+            if quiet >= settle_reads:
+                return ("done" if output else "silent"), "".join(output)
+        now = monotonic()
+        if now - last_output > timeout or (max_time and now - start > max_time):
+            return "timeout", "".join(output)
+        sleep(read_interval)
+
+
+def drain(shell, max_reads=DEFAULT_MAX_DRAIN_READS):
+    """Read whatever output a session already has waiting
+
+    Parameters
+    ----------
+    shell : pymetasploit3.msfrpc.MeterpreterSession or ShellSession
+        session to read
+    max_reads : int, optional
+        most reads made (a command may still be streaming output)
+
+    Returns
+    -------
+    output : str
+        everything read
+    """
+    output = []
+    for _ in range(max_reads):
+        chunk = shell.read()
+        if not chunk:
+            break
+        output.append(chunk)
+    return "".join(output)
+
+
+def parse_meterpreter_help(text):
+    """
+    Parameters
+    ----------
+    text : str
+        output of meterpreter's 'help'
+
+    Returns
+    -------
+    commands : list[tuple(str, str)]
+        command and description
+    """
+    commands = {}
+    for line in text.splitlines():
+        match = re.match(r"\s{4}(\S+)\s{2,}(.*)$", line)
+        if match and match.group(1) not in ("Command", "-------"):
+            commands.setdefault(match.group(1), match.group(2).strip())
+    return sorted(commands.items())
+
+
+class CommandIndex(object):
+    """Commands available in each kind of session, built once per type and platform
+
+    Methods
+    -------
+    commands(self, shell, session_type, platform)
+        Commands for a kind of session, building the index if needed
+    export(self)
+        Every index in a JSON-serializable form (for utils.snapshot)
+    restore(self, data)
+        Add indexes from export()
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(session_type, platform):
+        """Index key; shells on anything that isn't windows share the unix list"""
+        platform = (platform or "").lower()
+        if session_type != "meterpreter":
+            platform = "windows" if "win" in platform else "unix"
+        return (session_type, platform)
+
+    def commands(self, shell, session_type, platform):
+        """
+        Parameters
+        ----------
+        shell : pymetasploit3.msfrpc.MeterpreterSession or ShellSession
+            a session of this kind; used to ask meterpreter for its help
+        session_type : str
+            'meterpreter' or 'shell'
+        platform : str
+            platform reported by msfrpcd (e.g. 'windows', 'linux')
+
+        Returns
+        -------
+        commands : list[tuple(str, str)]
+            command and description
+        """
+        key = self.key(session_type, platform)
+        with self._lock:
+            commands = self._index.get(key)
+            if commands is not None:
+                return commands
+            # built outside the lock (meterpreter's help takes seconds); other
+            # callers for the same kind wait on the build already running
+            future = self._building.get(key)
+            building = future is None
+            if building:
+                future = self._building[key] = Future()
+        if not building:
+            return future.result()
+        try:
+            commands = self._build(shell, *key)
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            # restore() may have added it meanwhile
+            commands = self._index.setdefault(key, commands)
+            del self._building[key]
+        future.set_result(commands)
+        return commands
+
+    def export(self):
+        """Indexes as [session_type, platform, commands]"""
+        with self._lock:
+            return [
+                [session_type, platform, commands]
+                for (session_type, platform), commands in self._index.items()
+            ]
+
+    def restore(self, data):
+        """Add indexes from export(); indexes already built are kept"""
+        with self._lock:
+            for session_type, platform, commands in data:
+                self._index.setdefault(
+                    (session_type, platform), [tuple(c) for c in commands]
+                )
+
+    @staticmethod
+    def _build(shell, session_type, platform):
+        if session_type == "meterpreter":
+            try:
+                status, output = stream_command(shell, "help")
+                commands = parse_meterpreter_help(output)
+                if commands:
+                    return commands
+            except Exception as e:
+                logging.warning(f"from meterpreter help\n<<< {str(e)}")
+            return list(SESSION_COMMANDS)
+        return list(SESSION_COMMANDS) + [
+            (command, "") for command in SHELL_COMMANDS[platform]
+        ]
+
+
+class IndexCompleter(Completer):
+    """Completes the first word of a session command from a CommandIndex entry
+
+    Attributes
+    ----------
+    commands : list[tuple(str, str)]
+        command and description
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def tabs(self, text):
+        """Full-line completions for text (same form as msfrpcd's console.tabs)"""
+        if " " in text.lstrip():
+            return []
+        word = text.lstrip()
+        return [command for command, _ in self.commands if command.startswith(word)]
+
+    def get_completions(self, document, complete_event):
+        word = document.text_before_cursor.lstrip()
+        if " " in word:
+            return
+        for command, description in self.commands:
+            if command.startswith(word):
+                yield Completion(command, -len(word), display_meta=description)
+
+
+class IndexAutoSuggest(AutoSuggestFromHistory):
+    """Suggests from the session's history, then from its CommandIndex entry"""
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def get_suggestion(self, buffer, document):
+        suggestion = super().get_suggestion(buffer, document)
+        if suggestion is not None:
+            return suggestion
+        text = document.text
+        if text and " " not in text:
+            for command, _ in self.commands:
+                if command.startswith(text) and command != text:
+                    return Suggestion(command[len(text) :])
+        return None
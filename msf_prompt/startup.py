@@ -0,0 +1,117 @@
+"""
+startup
+=======
+
+Provides StartupTrace, which times how long msf_prompt takes to show its first
+prompt ('--trace-startup').
+
+The time is broken down by phase (imports, config, connecting to msfrpcd, building
+the session, first prompt) and by module imported, like 'python -X importtime': each
+import's own time and its time including the imports it triggered.  It is imported
+before anything else so the imports that follow it can be timed.
+"""
+from __future__ import unicode_literals
+
+import builtins
+import logging
+import sys
+import threading
+from collections import defaultdict
+from importlib.util import resolve_name
+from time import perf_counter
+
+# Number of imports listed in the report, slowest first
+DEFAULT_REPORT_IMPORTS = 15
+
+
+class StartupTrace(object):
+    """Timer for the phases and imports of startup
+
+    Attributes
+    ----------
+    enabled : bool
+        False makes every method a no-op
+    phases : list[tuple(str, float)]
+        each phase and the seconds it took
+    imports : dict[str, list[float]]
+        own and cumulative seconds of each module imported while tracing
+
+    Methods
+    -------
+    mark(self, phase)
+        End a phase
+    report(self)
+        Print and log the breakdown (once) and stop timing imports
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = []
+        self.imports = defaultdict(lambda: [0.0, 0.0])
+        self.reported = False
+        self._start = self._last = perf_counter()
+        self._stack = []
+        self._thread = threading.get_ident()
+        self._import = builtins.__import__
+        if enabled:
+            builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if (
+            (level == 0 and name in sys.modules)
+            or threading.get_ident() != self._thread
+        ):
+            # already imported, or a background thread's import
+            return self._import(name, globals, locals, fromlist, level)
+        start = perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - start
+            nested = self._stack.pop()
+            if level:
+                package = (globals or {}).get("__package__") or ""
+                name = resolve_name("." * level + name, package) if package else name
+            timing = self.imports[name]
+            timing[0] += elapsed - nested
+            timing[1] += elapsed
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def mark(self, phase):
+        """
+        Parameters
+        ----------
+        phase : str
+            name of the phase that just finished
+        """
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self, top=DEFAULT_REPORT_IMPORTS):
+        """Print and log the phase and import breakdown (only the first call does anything)
+
+        Parameters
+        ----------
+        top : int, optional
+            number of imports listed, slowest (own time) first
+        """
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        builtins.__import__ = self._import
+
+        lines = [f"[STARTUP] {(self._last - self._start) * 1000:8.1f} ms total"]
+        for phase, seconds in self.phases:
+            lines.append(f"  {seconds * 1000:8.1f} ms  {phase}")
+        lines.append("  imports (self ms | cumulative ms | module):")
+        slowest = sorted(self.imports.items(), key=lambda item: -item[1][0])
+        for name, (own, cumulative) in slowest[:top]:
+            lines.append(f"  {own * 1000:8.1f} | {cumulative * 1000:8.1f} | {name}")
+        report = "\n".join(lines)
+        print(report)
+        logging.info(report)
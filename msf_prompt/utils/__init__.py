@@ -4,18 +4,59 @@ utils
 
 Author: starksimilarity <starksimilarity@gmail.com>
 
-Description: utility modules for msf_prompt.  Provides argument and config parsing and 
-output redirection with logging.
+Description: utility modules for msf_prompt.  Provides argument and config parsing, 
+output redirection with logging and the pooled msfrpcd transport.
 """
 
 from .utils import *
 from .patch_stdout_shim import *
+from .transport import *
+from .coalesce import *
+from .breaker import *
+from .tabcache import *
+from .resultcache import *
+from .trigram import *
+from .resolver import *
+from .histogram import *
+from .metrics import *
+from .profiler import *
+from .snapshot import *
+from .tape import *
 
 __all__ = [
     # Utils.
     "parseargs",
     "parseconfig",
+    "setup_logging",
     # patch_stdout_shim
     "patch_stdout",
     "LoggingStdoutProxy",
+    # transport
+    "PooledMsfRpcClient",
+    # coalesce
+    "RpcCoalescer",
+    # breaker
+    "CircuitBreaker",
+    # tabcache
+    "TabsCache",
+    # resultcache
+    "ResultCache",
+    # trigram
+    "TrigramIndex",
+    # resolver
+    "CachedResolver",
+    "HostsFileResolver",
+    "system_resolver",
+    # histogram
+    "Histogram",
+    "PerfStats",
+    # profiler
+    "PromptProfiler",
+    # metrics
+    "MetricsExporter",
+    # snapshot
+    "CacheSnapshot",
+    # tape
+    "TapeRecorder",
+    "TapeRpcClient",
 ]
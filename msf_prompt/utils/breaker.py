@@ -0,0 +1,254 @@
+"""
+breaker
+=======
+
+Provides CircuitBreaker, a latency budget and circuit breaker for features that depend on
+msfrpcd answering quickly (e.g. tab-completion and auto-suggest).
+
+Calls are run on a worker thread and the caller waits at most the latency budget for the
+answer.  When the p95 latency over the recent calls goes over budget, or calls keep
+failing/timing out, the breaker opens and callers are sent straight to their fallback.
+While open, a background probe periodically retries the backend and closes the breaker
+again once it answers within budget.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from time import perf_counter, sleep
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Seconds a caller waits for an answer before using the fallback
+DEFAULT_BUDGET = 0.25
+# Number of recent latencies used for the p95
+DEFAULT_WINDOW = 20
+# Latencies needed before the p95 is trusted
+DEFAULT_MIN_SAMPLES = 5
+# Consecutive failures/timeouts that open the breaker
+DEFAULT_FAILURE_THRESHOLD = 3
+# Seconds between background probes while the breaker is open
+DEFAULT_PROBE_INTERVAL = 5.0
+
+
+class CircuitBreaker(object):
+    """Per-feature latency budget with a self-healing circuit breaker
+
+    Attributes
+    ----------
+    name : str
+        feature the breaker protects (used in log messages)
+    budget : float
+        seconds a caller will wait for an answer; also the p95 latency limit
+    state : str
+        one of CLOSED, OPEN or HALF_OPEN
+
+    Methods
+    -------
+    call(self, fn, *args, fallback=None)
+        Run fn within the latency budget, or return fallback() if not allowed/too slow
+    allow(self)
+        True if calls should go to the backend
+    record(self, elapsed, ok=True)
+        Record the outcome of a call made to the backend
+    p95(self)
+        95th percentile of the recent latencies
+    """
+
+    def __init__(
+        self,
+        name,
+        budget=DEFAULT_BUDGET,
+        probe=None,
+        window=DEFAULT_WINDOW,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        probe_interval=DEFAULT_PROBE_INTERVAL,
+        executor=None,
+    ):
+        """
+        Parameters
+        ----------
+        name : str
+            feature the breaker protects (used in log messages)
+        budget : float, optional
+            seconds a caller will wait for an answer; also the p95 latency limit
+        probe : callable, optional
+            cheap call against the backend used to test it while the breaker is open;
+            without one the breaker simply re-closes after probe_interval
+        window : int, optional
+            number of recent latencies used for the p95
+        min_samples : int, optional
+            latencies needed before the p95 can open the breaker
+        failure_threshold : int, optional
+            consecutive failures/timeouts that open the breaker
+        probe_interval : float, optional
+            seconds between background probes while the breaker is open
+        executor : concurrent.futures.Executor, optional
+            worker pool that runs the calls; a small private pool if not given
+        """
+        self.name = name
+        self.budget = float(budget)
+        self.probe = probe
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+
+        self._latencies = deque(maxlen=window)
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._probing = threading.Event()
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix=f"breaker-{name}"
+            )
+        self._executor = executor
+
+    def allow(self):
+        """
+        Returns
+        -------
+        _ : bool
+            True if calls should go to the backend
+        """
+        return self.state == CLOSED
+
+    def call(self, fn, *args, fallback=None):
+        """Run fn(*args) within the latency budget
+
+        If the breaker is open, or the answer doesn't arrive within the budget, the result
+        of fallback() is returned instead (None if no fallback).  A call that runs over
+        budget keeps running in the background so its latency is still recorded.
+
+        Parameters
+        ----------
+        fn : callable
+            call against the backend
+        *args
+            arguments for fn
+        fallback : callable, optional
+            local source to use when the backend can't be used
+
+        Returns
+        -------
+        _ : object
+            return value of fn or fallback
+        """
+        if not self.allow():
+            return fallback() if fallback else None
+
+        future = self._executor.submit(self._timed, fn, *args)
+        try:
+            return future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            logging.debug(f"[BREAKER] {self.name} call went over {self.budget}s budget")
+            self._fail()
+        except Exception as e:
+            logging.debug(f"[BREAKER] {self.name} call failed: {e}")
+        return fallback() if fallback else None
+
+    def _timed(self, fn, *args):
+        start = perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.record(perf_counter() - start, ok=False)
+            raise
+        self.record(perf_counter() - start)
+        return result
+
+    def record(self, elapsed, ok=True):
+        """Record the outcome of a call made to the backend
+
+        Parameters
+        ----------
+        elapsed : float
+            seconds the call took
+        ok : bool, optional
+            False if the call raised
+        """
+        if not ok:
+            self._fail()
+            return
+        with self._lock:
+            self._latencies.append(elapsed)
+            self._failures = 0
+            # sorting the window is only worth it once there are enough samples
+            p95 = self._p95() if len(self._latencies) >= self.min_samples else 0.0
+            trip = p95 > self.budget
+        if trip:
+            self._open(f"p95 latency {p95:.3f}s over {self.budget}s budget")
+
+    def _fail(self):
+        with self._lock:
+            self._failures += 1
+            failures = self._failures
+            trip = failures >= self.failure_threshold
+        if trip:
+            self._open(f"{failures} consecutive failures")
+
+    def _p95(self):
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def p95(self):
+        """
+        Returns
+        -------
+        _ : float
+            95th percentile of the recent latencies in seconds
+        """
+        with self._lock:
+            return self._p95()
+
+    def _open(self, reason):
+        with self._lock:
+            if self.state != CLOSED:
+                return
+            self.state = OPEN
+        logging.warning(f"[BREAKER] {self.name} disabled; falling back to local: {reason}")
+        if not self._probing.is_set():
+            self._probing.set()
+            threading.Thread(
+                target=self._probe_loop, name=f"probe-{self.name}", daemon=True
+            ).start()
+
+    def _close(self):
+        with self._lock:
+            self.state = CLOSED
+            self._latencies.clear()
+            self._failures = 0
+        logging.warning(f"[BREAKER] {self.name} re-enabled")
+
+    def _probe_loop(self):
+        """Retry the backend in the background until it answers within budget"""
+        try:
+            while True:
+                sleep(self.probe_interval)
+                with self._lock:
+                    self.state = HALF_OPEN
+                ok = True
+                if self.probe is not None:
+                    start = perf_counter()
+                    try:
+                        self.probe()
+                        ok = perf_counter() - start <= self.budget
+                    except Exception as e:
+                        logging.debug(f"[BREAKER] {self.name} probe failed: {e}")
+                        ok = False
+                if ok:
+                    # without a probe the next real call is the test
+                    self._probing.clear()
+                    self._close()
+                    return
+                with self._lock:
+                    self.state = OPEN
+        finally:
+            self._probing.clear()
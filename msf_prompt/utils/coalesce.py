@@ -0,0 +1,204 @@
+"""
+coalesce
+========
+
+Provides RpcCoalescer, a facade in front of an RPC call function that collapses
+identical read-only calls into a single round trip to msfrpcd.
+
+Two callers asking for the same thing at the same time (e.g. MsfCompleter and
+MsfAutoSuggest both calling console.tabs on the same text) share one in-flight call
+(single-flight).  A caller that asks again within a short window after the answer
+arrived is handed the same answer instead of making another round trip.  Any call
+that can change the console state (e.g. console.write) drops the remembered answers.
+"""
+from __future__ import unicode_literals
+
+import threading
+from time import monotonic
+
+# RPC methods that only read state and can safely share an answer
+COALESCED_METHODS = frozenset(
+    [
+        "console.tabs",
+        "console.list",
+        "session.list",
+        "session.meterpreter_tabs",
+        "session.compatible_modules",
+        "job.list",
+        "job.info",
+        "core.version",
+        "core.module_stats",
+        "module.exploits",
+        "module.auxiliary",
+        "module.post",
+        "module.payloads",
+        "module.encoders",
+        "module.nops",
+        "module.evasion",
+        "module.info",
+        "module.options",
+        "module.compatible_payloads",
+        "db.hosts",
+        "db.services",
+        "db.current_workspace",
+    ]
+)
+# RPC methods that consume output but don't change anything a coalesced call returns
+PASSIVE_METHODS = frozenset(
+    [
+        "console.read",
+        "session.shell_read",
+        "session.meterpreter_read",
+        "session.ring_read",
+        "session.ring_last",
+    ]
+)
+# Seconds a finished answer is handed to repeat callers (about one keystroke)
+DEFAULT_WINDOW = 0.5
+
+
+class _Flight(object):
+    """A single call to msfrpcd that other callers can wait on"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _freeze(value):
+    """Turn RPC arguments into something hashable so they can be used as a key"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class RpcCoalescer(object):
+    """Single-flight and short-window deduplication of read-only RPC calls
+
+    msfrpcd has no multi-call method so requests can't be merged into one HTTP
+    request; instead identical requests are merged into one call.
+
+    Attributes
+    ----------
+    issued : int
+        calls actually sent to msfrpcd
+    saved : int
+        calls answered without a round trip
+    window : float
+        seconds a finished answer is reused for an identical call
+
+    Methods
+    -------
+    call(self, fn, method, opts)
+        Make the call through fn unless an identical one is in flight or just finished
+    invalidate(self)
+        Forget every remembered answer
+    stats(self)
+        Dictionary of the issued/saved counters
+    """
+
+    def __init__(self, methods=COALESCED_METHODS, window=DEFAULT_WINDOW):
+        """
+        Parameters
+        ----------
+        methods : iterable[str], optional
+            RPC methods that are safe to coalesce
+        window : float, optional
+            seconds a finished answer is reused for an identical call
+        """
+        self.methods = frozenset(methods)
+        self.window = window
+        self.issued = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._recent = {}
+
+    def call(self, fn, method, opts=None):
+        """Make an RPC call, sharing the answer with identical concurrent calls
+
+        Parameters
+        ----------
+        fn : callable(method, opts)
+            function that actually makes the call to msfrpcd
+        method : str
+            RPC method name
+        opts : list, optional
+            arguments to the RPC method
+
+        Returns
+        -------
+        _ : object
+            the answer from msfrpcd (possibly shared with other callers)
+        """
+        opts = list(opts) if opts else []
+
+        if method not in self.methods:
+            if method not in PASSIVE_METHODS:
+                # the call might change what a coalesced call would return
+                self.invalidate()
+            with self._lock:
+                self.issued += 1
+            return fn(method, opts)
+
+        key = (method, _freeze(opts))
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is not None and recent[0] > monotonic():
+                self.saved += 1
+                return recent[1]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.issued += 1
+            else:
+                self.saved += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(method, opts)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None:
+                    self._recent[key] = (monotonic() + self.window, flight.result)
+                    self._expire()
+            flight.done.set()
+
+    def _expire(self):
+        """Drop remembered answers that have outlived the window; caller holds the lock"""
+        now = monotonic()
+        for key in [k for k, v in self._recent.items() if v[0] <= now]:
+            del self._recent[key]
+
+    def invalidate(self):
+        """Forget every remembered answer (in-flight calls are unaffected)"""
+        with self._lock:
+            self._recent.clear()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        _ : dict
+            calls issued to msfrpcd and calls saved by coalescing
+        """
+        with self._lock:
+            return {"issued": self.issued, "saved": self.saved}
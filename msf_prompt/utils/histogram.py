@@ -0,0 +1,264 @@
+"""
+histogram
+=========
+
+Provides Histogram, a fixed-bucket latency histogram, and PerfStats, a set of them by
+operation name (plus plain counters), for timing RPC calls and the steps between a
+keystroke and the screen.
+
+Recording a time is a bisect and two additions, and the memory used doesn't grow with
+the number of calls, so every call can be timed for the whole life of a session.
+Percentiles are estimated from the buckets, interpolating inside the one the
+percentile falls in, so they're only as precise as the bucket bounds.
+"""
+from __future__ import unicode_literals
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+# Upper bounds (seconds) of the buckets; anything slower goes in a last, open bucket
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram(object):
+    """Counts of times that fell in each of a fixed set of buckets
+
+    Attributes
+    ----------
+    bounds : tuple[float]
+        upper bound (seconds) of each bucket but the last
+    counts : list[int]
+        times in each bucket; one more than there are bounds
+    count : int
+        times recorded
+    sum : float
+        total of the times recorded
+    max : float
+        slowest time recorded
+
+    Methods
+    -------
+    observe(self, seconds)
+        Record a time
+    percentile(self, p)
+        Estimated p-th percentile in seconds
+    snapshot(self)
+        Consistent copy of the counts
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        """
+        Parameters
+        ----------
+        bounds : tuple[float], optional
+            upper bound (seconds) of each bucket, in increasing order
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        """
+        Parameters
+        ----------
+        p : float
+            percentile (0-100)
+
+        Returns
+        -------
+        seconds : float
+            estimated p-th percentile; 0 if nothing has been recorded
+        """
+        with self._lock:
+            counts = list(self.counts)
+            count, largest = self.count, self.max
+        if not count:
+            return 0.0
+        rank = p / 100 * count
+        seen = 0
+        for index, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else largest
+                # never report more than was actually seen
+                upper = min(upper, largest)
+                return lower + (upper - lower) * max(rank - seen, 0) / n
+            seen += n
+        return largest
+
+    def snapshot(self):
+        """
+        Returns
+        -------
+        counts, count, sum : tuple(list[int], int, float)
+            per-bucket counts, total count and total seconds, read together
+        """
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+
+class _Timer(object):
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.observe(self.name, perf_counter() - self.start)
+        return False
+
+
+class PerfStats(object):
+    """Latency histograms by operation name (e.g. 'tabs', 'execute') and counters
+
+    Attributes
+    ----------
+    histograms : dict[str, Histogram]
+        one per operation, created on its first time; never reset (these are what
+        utils.metrics exports, and Prometheus expects them to only grow)
+    recent : dict[str, Histogram]
+        the same, since the last reset(); what report() shows
+    counters : dict[str, int]
+        running totals by name (e.g. 'commands', 'denials')
+
+    Methods
+    -------
+    observe(self, name, seconds)
+        Record a time for an operation
+    incr(self, name, n=1)
+        Add to a counter
+    timer(self, name)
+        Context manager that times its block as the operation
+    report(self)
+        Rows of count, p50, p95, p99 and max per operation
+    print_report(self, title)
+        Print report() as a table
+    reset(self)
+        Start report() over
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        """
+        Parameters
+        ----------
+        bounds : tuple[float], optional
+            bucket bounds for every histogram
+        """
+        self.bounds = bounds
+        self.histograms = {}
+        self.recent = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(self.bounds))
+        return histogram
+
+    def _recent(self, name):
+        histogram = self.recent.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.recent.setdefault(name, Histogram(self.bounds))
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+        self._recent(name).observe(seconds)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timer(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            operation the block is timed as
+
+        Returns
+        -------
+        _ : context manager
+            records the time spent in the with block, even if it raises
+        """
+        return _Timer(self, name)
+
+    def report(self):
+        """
+        Returns
+        -------
+        rows : list[tuple]
+            (name, count, p50, p95, p99, max) in seconds, for each operation by name,
+            since the last reset()
+        """
+        return [
+            (
+                name,
+                h.count,
+                h.percentile(50),
+                h.percentile(95),
+                h.percentile(99),
+                h.max,
+            )
+            for name, h in sorted(self.recent.items())
+            if h.count
+        ]
+
+    def print_report(self, title):
+        rows = self.report()
+        print(
+            f"{title:<32}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)"
+        )
+        if not rows:
+            print("  (nothing timed yet)")
+        for name, count, p50, p95, p99, largest in rows:
+            print(
+                f"  {name:<30}{count:>8}{p50 * 1000:10.2f}{p95 * 1000:10.2f}"
+                f"{p99 * 1000:10.2f}{largest * 1000:10.2f}"
+            )
+
+    def reset(self):
+        """Forget the times report() shows; the exported histograms and the counters
+        keep running totals"""
+        with self._lock:
+            self.recent = {}
@@ -0,0 +1,330 @@
+"""
+metrics
+=======
+
+Provides MetricsExporter, which publishes the health of a msf_prompt process in the
+Prometheus text format so every instance on a shared host can be scraped.
+
+The metrics are written to a file every interval (atomically, for node_exporter's
+textfile collector), served over HTTP on a local port, or both.  They cover:
+
+    msf_prompt_rpc_duration_seconds         histogram per RPC method
+    msf_prompt_operation_duration_seconds   histogram per prompt step (tabs, execute,
+                                            complete, suggest, validate_targets, ...)
+    msf_prompt_rpc_coalesced_total          RPC calls answered without a round trip
+    msf_prompt_cache_hits_total             hits per cache (completion, policy, results)
+    msf_prompt_cache_misses_total           misses per cache
+    msf_prompt_commands_total               commands run
+    msf_prompt_denials_total                commands denied by the target/module checks
+    msf_prompt_overrides_total              warnings the user overrode
+    msf_prompt_output_bytes_total           console and session output read
+    msf_prompt_log_queue_depth              records waiting on queued logging
+    process_resident_memory_bytes           RSS of the process
+
+Every sample is labelled with the pid and user of the process.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import pwd
+import resource
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler
+
+# Seconds between writes of the metrics file
+DEFAULT_METRICS_INTERVAL = 15
+# Address the HTTP listener binds to; metrics are only served to the local host
+DEFAULT_METRICS_ADDRESS = "127.0.0.1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Counters exported as 0 before they're first counted, so alerts on them work
+SESSION_COUNTERS = ("commands", "denials", "overrides")
+CLIENT_COUNTERS = ("output_bytes",)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as infi:
+            return int(infi.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # the peak rather than the current size where /proc isn't available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _log_queue_depth():
+    """Records waiting in the queues of the root logger's QueueHandlers"""
+    return sum(
+        handler.queue.qsize()
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, QueueHandler)
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsExporter(object):
+    """Writes or serves a process's metrics in the Prometheus text format
+
+    Attributes
+    ----------
+    filename : str
+        file rewritten every interval; None to not write one
+    port : int
+        local port metrics are served on (/metrics); None to not serve them
+    interval : float
+        seconds between writes of the file
+    labels : dict[str, str]
+        labels added to every sample
+
+    Methods
+    -------
+    track_client(self, client)
+        Export a PooledMsfRpcClient's RPC latencies, coalescing and output read
+    track_perf(self, perf)
+        Export a session's step latencies and counters
+    track_cache(self, name, cache)
+        Export a cache's hits and misses
+    render(self)
+        The metrics as Prometheus text
+    write(self)
+        Replace the metrics file with the current metrics
+    start(self)
+        Start writing and/or serving in the background
+    stop(self)
+        Stop and remove the metrics file
+    """
+
+    def __init__(
+        self, filename=None, port=None, interval=DEFAULT_METRICS_INTERVAL, labels=None
+    ):
+        """
+        Parameters
+        ----------
+        filename : str, optional
+            file to rewrite every interval; '{pid}' and '{user}' are filled in so
+            instances sharing a directory don't overwrite each other
+        port : int, optional
+            local port to serve /metrics on
+        interval : float, optional
+            seconds between writes of the file
+        labels : dict[str, str], optional
+            labels added to every sample; the pid and user by default
+        """
+        user = pwd.getpwuid(os.getuid())[0]
+        if filename:
+            self.filename = filename.format(pid=os.getpid(), user=user)
+        else:
+            self.filename = None
+        self.port = int(port) if port else None
+        self.interval = float(interval)
+        if labels is None:
+            labels = {"pid": str(os.getpid()), "user": user}
+        self.labels = labels
+
+        self._clients = []
+        self._perfs = []
+        self._caches = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def track_client(self, client):
+        self._clients.append(client)
+
+    def track_perf(self, perf):
+        self._perfs.append(perf)
+
+    def track_cache(self, name, cache):
+        """
+        Parameters
+        ----------
+        name : str
+            label of the cache (e.g. 'completion')
+        cache : object
+            anything with hits and misses counts; None is ignored
+        """
+        if cache is not None:
+            self._caches.append((name, cache))
+
+    def _collect(self):
+        """Families as {name: (type, help, [(suffix, labels, value)])}"""
+        families = {}
+
+        def add(name, kind, description, value, suffix="", **labels):
+            families.setdefault(name, (kind, description, []))[2].append(
+                (suffix, labels, value)
+            )
+
+        def add_histograms(name, description, label, perf):
+            for key, histogram in sorted(perf.histograms.items()):
+                counts, count, total = histogram.snapshot()
+                cumulative = 0
+                for bound, n in zip(histogram.bounds + (None,), counts):
+                    cumulative += n
+                    le = "+Inf" if bound is None else repr(float(bound))
+                    labels = {label: key, "le": le}
+                    add(name, "histogram", description, cumulative, "_bucket", **labels)
+                add(name, "histogram", description, total, "_sum", **{label: key})
+                add(name, "histogram", description, count, "_count", **{label: key})
+
+        def add_counters(perf, known):
+            counters = dict.fromkeys(known, 0)
+            counters.update(perf.counters)
+            for key, value in sorted(counters.items()):
+                add(
+                    f"msf_prompt_{key}_total",
+                    "counter",
+                    f"{key.replace('_', ' ').capitalize()} since the process started",
+                    value,
+                )
+
+        for client in self._clients:
+            add_histograms(
+                "msf_prompt_rpc_duration_seconds",
+                "Seconds each msfrpcd call took",
+                "method",
+                client.perf,
+            )
+            add_counters(client.perf, CLIENT_COUNTERS)
+            coalescer = getattr(client, "coalescer", None)
+            if coalescer is not None:
+                add(
+                    "msf_prompt_rpc_coalesced_total",
+                    "counter",
+                    "RPC calls answered by an identical call instead of msfrpcd",
+                    coalescer.saved,
+                )
+        for perf in self._perfs:
+            add_histograms(
+                "msf_prompt_operation_duration_seconds",
+                "Seconds each prompt step took",
+                "operation",
+                perf,
+            )
+            add_counters(perf, SESSION_COUNTERS)
+        for name, cache in self._caches:
+            add(
+                "msf_prompt_cache_hits_total",
+                "counter",
+                "Cache lookups answered from memory",
+                cache.hits,
+                cache=name,
+            )
+            add(
+                "msf_prompt_cache_misses_total",
+                "counter",
+                "Cache lookups that had to go to msfrpcd or disk",
+                cache.misses,
+                cache=name,
+            )
+        add(
+            "msf_prompt_log_queue_depth",
+            "gauge",
+            "Log records waiting to be written",
+            _log_queue_depth(),
+        )
+        add(
+            "process_resident_memory_bytes",
+            "gauge",
+            "Resident memory size in bytes",
+            _rss(),
+        )
+        return families
+
+    def render(self):
+        """
+        Returns
+        -------
+        text : str
+            every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for name, (kind, description, samples) in self._collect().items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                labels = _format_labels(dict(self.labels, **labels))
+                lines.append(f"{name}{suffix}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Replace the metrics file; a scrape never sees a partly written file"""
+        text = self.render().encode("utf-8")
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(text)
+            # mkstemp makes the file private; the collector may run as another user
+            os.chmod(temp, 0o644)
+            os.replace(temp, self.filename)
+        except Exception:
+            os.unlink(temp)
+            raise
+
+    def start(self):
+        """Write the file every interval and/or serve /metrics on the local port"""
+        if self.port:
+            self._server = ThreadingHTTPServer(
+                (DEFAULT_METRICS_ADDRESS, self.port), _Handler
+            )
+            self._server.daemon_threads = True
+            self._server.exporter = self
+            threading.Thread(
+                target=self._server.serve_forever, name="metrics-http", daemon=True
+            ).start()
+        if self.filename:
+            self._thread = threading.Thread(
+                target=self._write_loop, name="metrics", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write()
+            except Exception as e:
+                logging.warning(f"from metrics {self.filename}\n<<< {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop and remove the metrics file so a dead process doesn't look healthy"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
@@ -0,0 +1,303 @@
+"""
+profiler
+========
+
+Provides PromptProfiler, an on-demand profiler for a running prompt.
+
+Only the work done for the user is profiled: handle_input and the completion and
+suggestion callbacks each run inside section(), which does nothing until the profiler
+is started.  Two modes are available:
+
+    cprofile    deterministic; every call in a section is counted (cProfile), which
+                slows the profiled code down noticeably
+    sample      a background thread looks at the stacks of the threads inside a
+                section every few milliseconds; little overhead, statistical counts
+
+Stopping writes the profile to a timestamped file in the profile directory (a pstats
+file for cprofile, folded stacks for flamegraph.pl/speedscope for sample) next to a
+.txt summary of the hot spots, and returns the summary.
+"""
+from __future__ import unicode_literals
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from time import strftime
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+# Where profiles are written
+DEFAULT_PROFILE_DIR = "."
+# Seconds between stack samples in sample mode
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Functions listed in the summary
+DEFAULT_TOP = 20
+
+
+class _Idle(object):
+    """section() while the profiler isn't running"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_IDLE = _Idle()
+
+
+class _CProfileSection(object):
+    __slots__ = ("profiler", "profile")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.profile = None
+
+    def __enter__(self):
+        # one section at a time; a nested or concurrent one is covered or skipped
+        if not self.profiler._section_lock.acquire(blocking=False):
+            return self
+        profile = self.profiler._profile
+        try:
+            if profile is not None:
+                profile.enable()
+                self.profile = profile
+                self.profiler._owner = threading.get_ident()
+        except ValueError:
+            # another profiler (e.g. a debugger) is active
+            pass
+        if self.profile is None:
+            self.profiler._section_lock.release()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._owner = None
+            self.profiler._section_lock.release()
+        return False
+
+
+class _SampleSection(object):
+    __slots__ = ("profiler", "ident")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.ident = threading.get_ident()
+        with self.profiler._lock:
+            self.profiler._active[self.ident] += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.profiler._lock:
+            active = self.profiler._active
+            active[self.ident] -= 1
+            if active[self.ident] <= 0:
+                del active[self.ident]
+        return False
+
+
+class PromptProfiler(object):
+    """Profiler started and stopped from the prompt ('profile start', 'profile stop')
+
+    Attributes
+    ----------
+    directory : str
+        where profiles and summaries are written
+    mode : str
+        CPROFILE or SAMPLE while running; None when stopped
+    interval : float
+        seconds between stack samples in sample mode
+
+    Methods
+    -------
+    section(self)
+        Context manager around work that should be profiled
+    start(self, mode=CPROFILE)
+        Start profiling
+    stop(self, top=DEFAULT_TOP)
+        Stop profiling and write the profile and its summary
+    """
+
+    def __init__(self, directory=DEFAULT_PROFILE_DIR, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        Parameters
+        ----------
+        directory : str, optional
+            where profiles and summaries are written
+        interval : float, optional
+            seconds between stack samples in sample mode
+        """
+        self.directory = directory or DEFAULT_PROFILE_DIR
+        self.interval = float(interval)
+        self.mode = None
+        self._lock = threading.Lock()
+        self._section_lock = threading.Lock()
+        self._profile = None
+        # thread whose section the cprofile profile is enabled in
+        self._owner = None
+        self._active = Counter()
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def section(self):
+        """
+        Returns
+        -------
+        _ : context manager
+            profiles its with block if the profiler is running
+        """
+        mode = self.mode
+        if mode is None:
+            return _IDLE
+        if mode == CPROFILE:
+            return _CProfileSection(self)
+        return _SampleSection(self)
+
+    def start(self, mode=CPROFILE):
+        """
+        Parameters
+        ----------
+        mode : str, optional
+            CPROFILE or SAMPLE
+
+        Raises
+        ------
+        ValueError
+            If mode is unknown or the profiler is already running
+        """
+        if mode not in (CPROFILE, SAMPLE):
+            raise ValueError(
+                f"unknown profiler mode {mode} (use {CPROFILE} or {SAMPLE})"
+            )
+        with self._lock:
+            if self.mode is not None:
+                raise ValueError(f"the {self.mode} profiler is already running")
+            if mode == CPROFILE:
+                self._profile = cProfile.Profile()
+            else:
+                self._stacks = Counter()
+                self._samples = 0
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._sample_loop, name="profiler", daemon=True
+                )
+                self._thread.start()
+            self.mode = mode
+        logging.info(f"[PROFILER] {mode} started")
+
+    def stop(self, top=DEFAULT_TOP):
+        """
+        Parameters
+        ----------
+        top : int, optional
+            functions listed in the summary
+
+        Returns
+        -------
+        filename, summary : tuple(str, str)
+            the profile written and its hot spots
+
+        Raises
+        ------
+        ValueError
+            If the profiler isn't running
+        """
+        with self._lock:
+            mode, self.mode = self.mode, None
+            profile, self._profile = self._profile, None
+        if mode is None:
+            raise ValueError("the profiler isn't running")
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory, f"msf_prompt-{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        )
+        if mode == CPROFILE:
+            if self._owner == threading.get_ident():
+                # stopped from inside a section (e.g. by the 'profile stop' command)
+                profile.disable()
+            else:
+                # wait for a section still running on another thread to finish
+                with self._section_lock:
+                    pass
+            filename = base + ".prof"
+            profile.dump_stats(filename)
+            summary = self._cprofile_summary(profile, top)
+        else:
+            self._stop.set()
+            self._thread.join()
+            filename = base + ".folded"
+            with open(filename, "w") as outfi:
+                for stack, count in self._stacks.most_common():
+                    outfi.write(f"{stack} {count}\n")
+            summary = self._sample_summary(top)
+        with open(base + ".txt", "w") as outfi:
+            outfi.write(summary)
+        logging.info(f"[PROFILER] {mode} stopped; wrote {filename}")
+        return filename, summary
+
+    @staticmethod
+    def _cprofile_summary(profile, top):
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(top)
+        stats.sort_stats("tottime").print_stats(top)
+        return stream.getvalue()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                idents = list(self._active)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} "
+                        f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                if stack:
+                    self._stacks[";".join(reversed(stack))] += 1
+                    self._samples += 1
+
+    def _sample_summary(self, top):
+        own = Counter()
+        total = Counter()
+        for stack, count in self._stacks.items():
+            functions = stack.split(";")
+            own[functions[-1]] += count
+            # a recursive function is counted once per sample
+            for function in set(functions):
+                total[function] += count
+        samples = max(self._samples, 1)
+        lines = [
+            f"{self._samples} samples every {self.interval * 1000:g}ms",
+            "",
+            f"{'self %':>8}{'total %':>9}  function",
+        ]
+        for function, count in own.most_common(top):
+            lines.append(
+                f"{count / samples * 100:8.1f}{total[function] / samples * 100:9.1f}"
+                f"  {function}"
+            )
+        lines += ["", f"{'total %':>8}  function"]
+        for function, count in total.most_common(top):
+            lines.append(f"{count / samples * 100:8.1f}  {function}")
+        return "\n".join(lines) + "\n"
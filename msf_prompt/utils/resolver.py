@@ -0,0 +1,199 @@
+"""
+resolver
+========
+
+Provides CachedResolver, which turns the hostnames in 'set RHOSTS' into addresses so
+they can be checked against the target white-list.
+
+Where names are looked up is pluggable: the system resolver, the local hosts file, or a
+hosts-format file of names that come with the scope (so in-scope names resolve the same
+way for everyone, whatever DNS says).  Answers are cached for a TTL and failures for a
+shorter one, and the names of a multi-host value are resolved at the same time.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+# Seconds a resolved name is remembered
+DEFAULT_TTL = 300
+# Seconds a name that didn't resolve is remembered
+DEFAULT_NEGATIVE_TTL = 30
+# Names resolved at the same time
+DEFAULT_RESOLVER_WORKERS = 8
+# The system's hosts file
+DEFAULT_HOSTS_FILE = "/etc/hosts"
+
+
+def system_resolver(name):
+    """
+    Parameters
+    ----------
+    name : str
+        hostname
+
+    Returns
+    -------
+    addresses : list[str]
+        every address the system resolver returns for name; empty if it doesn't resolve
+    """
+    try:
+        infos = socket.getaddrinfo(name, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return []
+    return sorted({info[4][0] for info in infos})
+
+
+class HostsFileResolver(object):
+    """Looks names up in a hosts-format file ('address name [alias ...]' per line)
+
+    The file is read again when its modification time changes.
+    """
+
+    def __init__(self, filename=DEFAULT_HOSTS_FILE):
+        self.filename = filename
+        self._mtime = -1
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        names = {}
+        if mtime is not None:
+            with open(self.filename) as infi:
+                for line in infi:
+                    fields = line.split("#", 1)[0].split()
+                    for name in fields[1:]:
+                        names.setdefault(name.lower(), []).append(fields[0])
+        self._names = names
+        self._mtime = mtime
+
+    def __call__(self, name):
+        with self._lock:
+            self._load()
+            return list(self._names.get(name.lower(), []))
+
+
+class CachedResolver(object):
+    """TTL cache (with negative caching) in front of a resolver
+
+    Attributes
+    ----------
+    resolve : callable(str)
+        returns the addresses for a hostname; empty if it doesn't resolve
+
+    Methods
+    -------
+    resolve_all(self, names)
+        Addresses for every name, resolving the uncached ones at the same time
+    """
+
+    def __init__(
+        self,
+        resolve=system_resolver,
+        ttl=DEFAULT_TTL,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+        max_workers=DEFAULT_RESOLVER_WORKERS,
+    ):
+        """
+        Parameters
+        ----------
+        resolve : callable(str), optional
+            returns the addresses for a hostname (system_resolver, a HostsFileResolver, ...)
+        ttl : float, optional
+            seconds a resolved name is remembered
+        negative_ttl : float, optional
+            seconds a name that didn't resolve is remembered
+        max_workers : int, optional
+            names resolved at the same time
+        """
+        self.resolve = resolve
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_workers = max_workers
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_config(cls, source, **kwargs):
+        """
+        Parameters
+        ----------
+        source : str
+            'system', 'hosts' (the system's hosts file) or the filename of a
+            hosts-format file of in-scope names
+
+        Returns
+        -------
+        _ : CachedResolver
+        """
+        source = str(source or "system")
+        if source == "system":
+            return cls(system_resolver, **kwargs)
+        if source == "hosts":
+            return cls(HostsFileResolver(), **kwargs)
+        return cls(HostsFileResolver(source), **kwargs)
+
+    def _lookup(self, name):
+        try:
+            addresses = list(self.resolve(name))
+        except Exception as e:
+            logging.warning(f"from resolver ({name})\n<<< {str(e)}")
+            addresses = []
+        ttl = self.ttl if addresses else self.negative_ttl
+        with self._lock:
+            self._entries[name] = (monotonic() + ttl, addresses)
+        return addresses
+
+    def cached(self, name):
+        """Addresses for name if they're cached and fresh, otherwise None"""
+        entry = self._entries.get(name.lower())
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+        return None
+
+    def resolve_all(self, names):
+        """
+        Parameters
+        ----------
+        names : iterable[str]
+            hostnames
+
+        Returns
+        -------
+        addresses : dict[str, list[str]]
+            addresses of each name; empty for names that don't resolve
+        """
+        results = {}
+        missing = []
+        for name in names:
+            addresses = self.cached(name)
+            if addresses is None:
+                missing.append(name.lower())
+            else:
+                results[name] = addresses
+        missing = sorted(set(missing))
+        if len(missing) == 1:
+            looked_up = {missing[0]: self._lookup(missing[0])}
+        elif missing:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="resolver"
+                )
+            looked_up = dict(zip(missing, self._executor.map(self._lookup, missing)))
+        else:
+            looked_up = {}
+        for name in names:
+            if name not in results:
+                results[name] = looked_up[name.lower()]
+        return results
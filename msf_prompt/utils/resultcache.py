@@ -0,0 +1,179 @@
+"""
+resultcache
+===========
+
+Provides ResultCache, a byte-bounded cache of the output of read-only console
+commands ('show exploits', 'info <module>', ...).
+
+'search' isn't cached: it sets the numbered results that 'use N' and 'info N' pick
+from, so it has to run on the user's own console.  Nothing whose output depends on the
+datastore is cached either: 'show payloads' and 'show all' (the payloads depend on the
+target) and a bare 'info' (it prints the module's current settings), since the query
+console running them only has the module's defaults.
+
+Those answers only change when the framework's modules change, so the cache is
+cleared on 'reload_all' and whenever msfrpcd reports a different framework version.
+Entries are keyed by the command and the module the console was using, and the least
+recently used entries are dropped once the total size of the cached output goes over
+the byte budget.
+"""
+from __future__ import unicode_literals
+
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+# Total size of cached output before least recently used entries are dropped
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# Seconds between checks of the framework version
+DEFAULT_VERSION_CHECK_INTERVAL = 60
+# Read-only commands whose output can be cached
+CACHEABLE_COMMANDS = (
+    r"show (exploits|auxiliary|post|encoders|nops|evasion)",
+    # a named module; not 'info N', which refers to the user's last search
+    r"info (?!-|\d+$)\S+",
+)
+
+
+class ResultCache(object):
+    """Least-recently-used cache of command output with a byte budget
+
+    Attributes
+    ----------
+    max_bytes : int
+        total size of cached output allowed
+    size : int
+        total size of cached output
+    hits, misses : int
+        lookups answered from the cache and lookups that weren't
+
+    Methods
+    -------
+    cacheable(text)
+        True if text is a read-only command whose output can be cached
+    get(self, key)
+        Cached output for key or None
+    put(self, key, output)
+        Cache output for key
+    clear(self)
+        Drop everything
+    check_version(self, get_version)
+        Clear the cache if the framework version has changed
+    export(self)
+        Entries in a JSON-serializable form (for utils.snapshot)
+    restore(self, data)
+        Add entries from export()
+    """
+
+    _cacheable = re.compile("^(?:" + "|".join(CACHEABLE_COMMANDS) + ")$", re.I)
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_MAX_BYTES,
+        version_check_interval=DEFAULT_VERSION_CHECK_INTERVAL,
+    ):
+        self.max_bytes = int(max_bytes)
+        self.version_check_interval = version_check_interval
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self._checked = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def cacheable(cls, text):
+        """
+        Parameters
+        ----------
+        text : str
+            the user-submitted command
+
+        Returns
+        -------
+        _ : bool
+            True if the command's output can be cached
+        """
+        return bool(cls._cacheable.match(" ".join(text.split())))
+
+    @staticmethod
+    def key(text, module):
+        """Cache key for a command run with module selected (None at the top level)"""
+        return (" ".join(text.split()).lower(), module)
+
+    def get(self, key):
+        """
+        Returns
+        -------
+        _ : str or None
+            cached output for key
+        """
+        with self._lock:
+            output = self._entries.get(key)
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return output
+
+    def put(self, key, output):
+        """
+        Parameters
+        ----------
+        key : tuple
+            from ResultCache.key
+        output : str
+            everything the command printed
+        """
+        size = len(output.encode("utf-8", "replace"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key).encode("utf-8", "replace"))
+            self._entries[key] = output
+            self.size += size
+            while self.size > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= len(dropped.encode("utf-8", "replace"))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def export(self):
+        """Entries as [command, module, output], least recently used first"""
+        with self._lock:
+            return [[key[0], key[1], output] for key, output in self._entries.items()]
+
+    def restore(self, data):
+        """Add entries from export(); output already cached is kept"""
+        for text, module, output in data:
+            key = (text, module)
+            if self._entries.get(key) is None:
+                self.put(key, output)
+
+    def check_version(self, get_version):
+        """Clear the cache if the framework version changed (at most once an interval)
+
+        Parameters
+        ----------
+        get_version : callable
+            returns the framework version from msfrpcd
+        """
+        now = monotonic()
+        if self._checked is not None and now - self._checked < self.version_check_interval:
+            return
+        self._checked = now
+        version = get_version()
+        if version != self.version:
+            if self.version is not None:
+                self.clear()
+            self.version = version
@@ -0,0 +1,266 @@
+"""
+snapshot
+========
+
+Provides CacheSnapshot, which saves the session's warm caches (tab-complete answers,
+cached command output, session command indexes) to disk and loads them back when
+msf_prompt restarts.
+
+The file is a one line JSON header followed by one JSON section per cache.  The header
+records the format, the framework version and the workspace the caches were built
+against, and where each section starts and ends, so a snapshot is checked by reading
+the header alone.  The file is memory-mapped and each section is only decoded when its
+cache is restored.  A snapshot taken against a different framework version or
+workspace is ignored.
+"""
+from __future__ import unicode_literals
+
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+
+# Format of the snapshot file; files in another format are ignored
+SNAPSHOT_FORMAT = 1
+# File the snapshot is saved to
+DEFAULT_SNAPSHOT_FILE = ".msf_prompt_snapshot"
+# Seconds between saves of the snapshot
+DEFAULT_SNAPSHOT_INTERVAL = 300
+
+
+def write_snapshot(filename, sections, version=None, workspace=None):
+    """Atomically write sections to filename
+
+    Parameters
+    ----------
+    filename : str
+        snapshot file
+    sections : dict[str, object]
+        JSON-serializable contents of each cache by name
+    version : str, optional
+        framework version the caches were built against
+    workspace : str, optional
+        workspace the caches were built against
+    """
+    payloads = []
+    offsets = {}
+    position = 0
+    for name, data in sections.items():
+        payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        offsets[name] = [position, position + len(payload)]
+        payloads.append(payload)
+        position += len(payload)
+    header = json.dumps(
+        {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "workspace": workspace,
+            "sections": offsets,
+        }
+    ).encode("utf-8")
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header + b"\n")
+            for payload in payloads:
+                f.write(payload)
+        os.replace(temp, filename)
+    except Exception:
+        os.unlink(temp)
+        raise
+
+
+class Snapshot(object):
+    """A snapshot file opened for reading; sections are decoded on request
+
+    Attributes
+    ----------
+    header : dict
+        format, version, workspace and section offsets
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            snapshot file
+
+        Raises
+        ------
+        OSError
+            If the file can't be opened or mapped
+        ValueError
+            If the header isn't a snapshot header
+        """
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = self._map.find(b"\n")
+        if end < 0:
+            self._map.close()
+            raise ValueError(f"{filename} is not a snapshot")
+        self.header = json.loads(self._map[:end].decode("utf-8"))
+        self._start = end + 1
+
+    def valid(self, version, workspace):
+        """True if the snapshot is in this format and matches version and workspace"""
+        return (
+            self.header.get("format") == SNAPSHOT_FORMAT
+            and self.header.get("version") == version
+            and self.header.get("workspace") == workspace
+        )
+
+    def section(self, name):
+        """
+        Returns
+        -------
+        data : object
+            the decoded section; None if the snapshot doesn't have it
+        """
+        offsets = self.header.get("sections", {}).get(name)
+        if offsets is None:
+            return None
+        start, end = offsets
+        return json.loads(self._map[self._start + start : self._start + end])
+
+    def close(self):
+        self._map.close()
+
+
+class CacheSnapshot(object):
+    """Saves and restores caches that have export() and restore(data) methods
+
+    Attributes
+    ----------
+    filename : str
+        snapshot file
+    caches : dict[str, object]
+        caches by section name
+
+    Methods
+    -------
+    track(self, name, cache)
+        Include a cache in the snapshot
+    load(self)
+        Restore every tracked cache from the snapshot if it's still valid
+    save(self)
+        Write every tracked cache to the snapshot (after load)
+    start(self)
+        Load, then save every interval, from a background thread
+    """
+
+    def __init__(
+        self, filename=DEFAULT_SNAPSHOT_FILE, rpc=None, interval=DEFAULT_SNAPSHOT_INTERVAL
+    ):
+        """
+        Parameters
+        ----------
+        filename : str, optional
+            snapshot file
+        rpc : pymetasploit3.msfrpc.MsfRpcClient, optional
+            client connected to msfrpcd; asked for the framework version and workspace
+        interval : float, optional
+            seconds between saves
+        """
+        self.filename = filename
+        self.rpc = rpc
+        self.interval = float(interval)
+        self.caches = {}
+
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, name, cache):
+        """
+        Parameters
+        ----------
+        name : str
+            section name
+        cache : object
+            has export() and restore(data); None is ignored
+        """
+        if cache is not None:
+            self.caches[name] = cache
+
+    def _identity(self):
+        """Framework version and workspace the caches are valid for"""
+        if self.rpc is None:
+            return None, None
+        version = self.rpc.call("core.version").get("version")
+        try:
+            workspace = self.rpc.call("db.current_workspace").get("workspace")
+        except Exception:
+            # no database connected
+            workspace = None
+        return version, workspace
+
+    def load(self):
+        """
+        Returns
+        -------
+        restored : list[str]
+            names of the caches that were restored
+        """
+        try:
+            snapshot = Snapshot(self.filename)
+        except FileNotFoundError:
+            self._loaded.set()
+            return []
+        except (OSError, ValueError) as e:
+            logging.warning(f"from snapshot {self.filename}\n<<< {str(e)}")
+            self._loaded.set()
+            return []
+        restored = []
+        try:
+            if not snapshot.valid(*self._identity()):
+                logging.info(f"[SNAPSHOT] {self.filename} is stale; starting cold")
+                return []
+            for name, cache in self.caches.items():
+                data = snapshot.section(name)
+                if data is not None:
+                    cache.restore(data)
+                    restored.append(name)
+        finally:
+            snapshot.close()
+            self._loaded.set()
+        logging.info(f"[SNAPSHOT] restored {', '.join(restored) or 'nothing'}")
+        return restored
+
+    def save(self):
+        """Write every tracked cache to the snapshot (once load() has run, so a
+        snapshot that hasn't been read yet isn't overwritten with cold caches)"""
+        if not self._loaded.is_set():
+            return
+        with self._lock:
+            version, workspace = self._identity()
+            sections = {name: cache.export() for name, cache in self.caches.items()}
+            write_snapshot(self.filename, sections, version, workspace)
+
+    def start(self):
+        """Load the snapshot, then save it every interval until stop() is called"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.warning(f"from snapshot load\n<<< {str(e)}")
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                logging.warning(f"from snapshot save\n<<< {str(e)}")
@@ -0,0 +1,132 @@
+"""
+tabcache
+========
+
+Provides TabsCache, a bounded cache of answers msfrpcd has given to console.tabs.
+
+The cache is a local source of completions when msfrpcd can't be asked (see breaker):
+the answer for the longest cached prefix of the text is filtered down to the entries
+that still match.  msfrpcd's answers depend on the module a console is using ('set '
+completes different options in different modules), so every answer is kept under
+that module as well as the text; consoles in the same module share answers.
+"""
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+
+# Number of distinct tab-complete texts remembered
+DEFAULT_MAX_ENTRIES = 512
+
+
+class TabsCache(object):
+    """Least-recently-used cache of console.tabs answers keyed by module and text
+
+    Attributes
+    ----------
+    hits, misses : int
+        lookups that did and didn't find an answer
+
+    Methods
+    -------
+    put(self, text, tabs, context=None)
+        Remember the tab-complete answer for text
+    get(self, text, context=None)
+        Exact cached answer for text or None
+    lookup(self, text, context=None)
+        Answer for text derived from the longest cached prefix of text
+    export(self)
+        Entries in a JSON-serializable form (for utils.snapshot)
+    restore(self, data)
+        Add entries from export()
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, text, tabs, context=None):
+        """
+        Parameters
+        ----------
+        text : str
+            text that was tab-completed
+        tabs : list[str]
+            what msfrpcd returned for text
+        context : str, optional
+            module the console was using; None at the top level
+        """
+        key = (context, text)
+        with self._lock:
+            self._entries[key] = list(tabs or [])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, text, context=None):
+        """
+        Returns
+        -------
+        _ : list[str] or None
+            exact cached answer for text in the module context
+        """
+        key = (context, text)
+        with self._lock:
+            tabs = self._entries.get(key)
+            if tabs is not None:
+                self._entries.move_to_end(key)
+            return tabs
+
+    def export(self):
+        """Entries as [context, text, tabs], least recently used first"""
+        with self._lock:
+            return [[key[0], key[1], tabs] for key, tabs in self._entries.items()]
+
+    def restore(self, data):
+        """Add entries from export(); answers already cached are kept"""
+        with self._lock:
+            # newest first, each in front of the last, so the order is kept
+            for entry in reversed(data):
+                if len(entry) == 2:
+                    # saved before answers were kept per module
+                    continue
+                context, text, tabs = entry
+                key = (context, text)
+                if key not in self._entries:
+                    self._entries[key] = tabs
+                    self._entries.move_to_end(key, last=False)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, text, context=None):
+        """Answer for text derived from the cache without asking msfrpcd
+
+        Parameters
+        ----------
+        text : str
+            text to tab-complete
+        context : str, optional
+            module the console is using; None at the top level
+
+        Returns
+        -------
+        _ : list[str]
+            cached completions that start with text; empty if nothing is known
+        """
+        exact = self.get(text, context)
+        if exact is not None:
+            self.hits += 1
+            return exact
+        for end in range(len(text) - 1, -1, -1):
+            tabs = self.get(text[:end], context)
+            if tabs:
+                self.hits += 1
+                return [t for t in tabs if t.startswith(text)]
+        self.misses += 1
+        return []
@@ -0,0 +1,231 @@
+"""
+tape
+====
+
+Record and replay msfrpcd traffic.
+
+TapeRecorder writes every RPC call a PooledMsfRpcClient makes (method, arguments,
+decoded answer, when it started and how long it took) to a tape: a msgpack stream
+with a header followed by one record per call, appended as the calls happen.
+Credentials and tokens in auth.* calls are never written, nor are the values of
+credential options set on a console ('set SMBPass ...', and msfconsole's
+'SMBPass => ...' answer) or credential fields in answers (db.creds).  Everything
+else is: session output, loot and hosts end up on the tape, so treat a tape like
+the engagement data it was recorded from.
+
+TapeRpcClient is an MsfRpcClient that answers from a tape instead of msfrpcd, at the
+recorded latency or faster, so a real session can be run again (see
+benchmarks/replay.py) as a repeatable latency and allocation test.
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import threading
+from collections import defaultdict, deque
+from time import monotonic, sleep
+
+import msgpack
+
+import pymetasploit3.msfrpc as msfrpc
+
+from .coalesce import _freeze
+
+# Format of the tape; tapes in another format are refused
+TAPE_FORMAT = 1
+# Written in place of the arguments and answer values of auth.* calls
+REDACTED = "<redacted>"
+# Option names and answer fields whose values are credentials
+CREDENTIAL_PATTERN = re.compile(
+    r"pass|secret|token|hash|cred|privkey|private_?key", re.I
+)
+# 'set'/'setg' of a credential option on a console
+SET_CREDENTIAL = re.compile(r"^(\s*setg?\s+(\S+)\s+)(.+?)(\s*)$", re.I | re.S)
+# msfconsole's answer to a 'set' ('SMBPass => hunter2'), one per line
+SET_ANSWER = re.compile(r"^(\s*(\S+)\s+=>\s+)(.*)$", re.M)
+
+
+class TapeRecorder(object):
+    """Appends RPC calls to a tape file
+
+    Methods
+    -------
+    record(self, method, opts, started, elapsed, response)
+        Append one call
+    close(self)
+        Flush and close the tape
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            tape file; overwritten
+        """
+        self.filename = filename
+        self._start = monotonic()
+        self._lock = threading.Lock()
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._file = open(filename, "wb")
+        self._file.write(self._packer.pack({"format": TAPE_FORMAT}))
+
+    def record(self, method, opts, started, elapsed, response):
+        """
+        Parameters
+        ----------
+        method : str
+            RPC method
+        opts : list
+            arguments (without the token)
+        started : float
+            monotonic() when the call started
+        elapsed : float
+            seconds the call took
+        response : object
+            decoded answer from msfrpcd
+        """
+        if method.startswith("auth."):
+            # the answer to auth.login is a token; keep only the shape of it
+            opts = [REDACTED] * len(opts)
+            if isinstance(response, dict):
+                response = dict.fromkeys(response, REDACTED)
+            else:
+                response = REDACTED
+        else:
+            opts = [
+                _redact_command(opt) if isinstance(opt, str) else opt for opt in opts
+            ]
+            response = _redact_fields(response)
+            if method == "console.read" and isinstance(response, dict):
+                if isinstance(response.get("data"), str):
+                    response["data"] = _redact_output(response["data"])
+        record = [started - self._start, elapsed, method, opts, response]
+        with self._lock:
+            if self._file.closed:
+                return
+            try:
+                self._file.write(self._packer.pack(record))
+            except TypeError as e:
+                logging.warning(f"from tape ({method})\n<<< {str(e)}")
+                return
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _redact_command(text):
+    """text with the value of a credential option being set replaced"""
+    match = SET_CREDENTIAL.match(text)
+    if match and CREDENTIAL_PATTERN.search(match.group(2)):
+        return match.group(1) + REDACTED + match.group(4)
+    return text
+
+
+def _redact_output(text):
+    """console output with the values of credential options being set replaced"""
+
+    def redact(match):
+        if CREDENTIAL_PATTERN.search(match.group(2)):
+            return match.group(1) + REDACTED
+        return match.group(0)
+
+    text = SET_ANSWER.sub(redact, text)
+    return "".join(_redact_command(line) for line in text.splitlines(True))
+
+
+def _redact_fields(value):
+    """value with the string values of credential-named fields replaced"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED
+            if isinstance(v, (str, bytes)) and CREDENTIAL_PATTERN.search(str(k))
+            else _redact_fields(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_fields(v) for v in value]
+    return value
+
+
+def read_tape(filename):
+    """
+    Parameters
+    ----------
+    filename : str
+        tape file written by TapeRecorder
+
+    Returns
+    -------
+    records : list[list]
+        [offset, elapsed, method, opts, response] for every call, in order
+
+    Raises
+    ------
+    ValueError
+        If the file isn't a tape in this format
+    """
+    with open(filename, "rb") as infi:
+        unpacker = msgpack.Unpacker(infi, raw=False, strict_map_key=False)
+        header = next(unpacker, None)
+        if not isinstance(header, dict) or header.get("format") != TAPE_FORMAT:
+            raise ValueError(f"{filename} is not a tape")
+        return [record for record in unpacker]
+
+
+class TapeRpcClient(msfrpc.MsfRpcClient):
+    """MsfRpcClient that answers every call from a tape
+
+    Calls are matched to recorded calls with the same method and arguments, in the
+    order they were recorded; a call that was never recorded gets the last answer
+    recorded for its method.  Each answer takes the recorded time divided by speed
+    (no time at all when speed is 0).
+
+    Attributes
+    ----------
+    records : list[list]
+        the tape (see read_tape)
+    speed : float
+        how much faster than recorded calls are answered; 0 for no delay
+    misses : int
+        calls that weren't on the tape with the same arguments
+    """
+
+    def __init__(self, filename, speed=1.0, **kwargs):
+        """
+        Parameters
+        ----------
+        filename : str
+            tape file written by TapeRecorder
+        speed : float, optional
+            how much faster than recorded calls are answered; 0 for no delay
+        """
+        self.records = read_tape(filename)
+        self.speed = float(speed)
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._answers = defaultdict(deque)
+        self._last = {}
+        for offset, elapsed, method, opts, response in self.records:
+            self._answers[(method, _freeze(opts))].append((elapsed, response))
+        # a token means MsfRpcClient doesn't try to log in
+        super().__init__("", token="replay", **kwargs)
+
+    def call(self, method, opts=None, is_raw=False):
+        key = (method, _freeze(list(opts or [])))
+        with self._lock:
+            answers = self._answers.get(key)
+            if answers:
+                elapsed, response = answers.popleft()
+            elif method in self._last:
+                self.misses += 1
+                elapsed, response = self._last[method]
+            else:
+                self.misses += 1
+                elapsed, response = 0.0, {"result": "success"}
+            self._last[method] = (elapsed, response)
+        if self.speed:
+            sleep(elapsed / self.speed)
+        return response
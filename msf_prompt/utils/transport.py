@@ -0,0 +1,219 @@
+"""
+transport
+=========
+
+Provides PooledMsfRpcClient, a drop-in replacement for the pymetasploit3 MsfRpcClient
+that sends every RPC call over a persistent, pooled keep-alive HTTP session instead of
+opening a new connection (and TLS handshake) per call.
+
+Every call through the client is timed and the timings are kept per RPC method, and
+identical read-only calls are coalesced into a single round trip (see coalesce).  Every
+call can also be recorded to a tape for replay (see tape).
+"""
+from __future__ import unicode_literals
+
+import logging
+import ssl
+import threading
+from collections import namedtuple
+from time import monotonic, perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from retry import retry
+
+import pymetasploit3.msfrpc as msfrpc
+
+from .coalesce import RpcCoalescer, DEFAULT_WINDOW
+from .histogram import PerfStats
+from .tape import TapeRecorder
+
+# Number of keep-alive connections kept open to msfrpcd
+DEFAULT_POOL_SIZE = 4
+# Seconds to wait for msfrpcd to connect/answer before giving up on a call
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+# RPC methods that return console or session output (counted as 'output_bytes')
+OUTPUT_METHODS = frozenset(
+    ["console.read", "session.shell_read", "session.meterpreter_read"]
+)
+
+
+CallTiming = namedtuple("CallTiming", ["count", "total", "max", "last"])
+
+
+class TLSReuseAdapter(HTTPAdapter):
+    """HTTPAdapter that shares one SSLContext between every pooled connection
+
+    msfrpcd uses a self-signed certificate so verification is disabled, matching
+    MsfRpcClient.  The saving comes from the pooled keep-alive connections: the
+    handshake is paid once per connection rather than once per call.  (Nothing here
+    makes msfrpcd resume TLS sessions, so a new connection does a full handshake.)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.check_hostname = False
+        self._ssl_context.verify_mode = ssl.CERT_NONE
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self._ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs["ssl_context"] = self._ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+class PooledMsfRpcClient(msfrpc.MsfRpcClient):
+    """MsfRpcClient that uses a persistent requests.Session for every RPC call
+
+    Accepts the same keyword arguments as MsfRpcClient plus the transport options
+    below; unknown keywords (e.g. the rest of the prompt_config) are ignored just like
+    MsfRpcClient ignores them.
+
+    Attributes
+    ----------
+    http : requests.Session
+        keep-alive session shared by every call made through this client
+    timings : dict[str, CallTiming]
+        per RPC method call count, total/max/last seconds
+    perf : utils.histogram.PerfStats
+        latency histogram per RPC method; counts the bytes of output read
+    coalescer : RpcCoalescer
+        merges identical read-only calls; None if coalescing is turned off
+    recorder : TapeRecorder
+        writes every call to a tape; None unless record_tape was given
+
+    Methods
+    -------
+    call(self, method, opts=None, is_raw=False)
+        Make an RPC call; coalesced, timed and sent over the pooled session
+    post_request(self, url, payload)
+        Send a single msgpack payload to msfrpcd
+    close(self)
+        Close every pooled connection
+    """
+
+    def __init__(self, password, **kwargs):
+        """
+        Parameters
+        ----------
+        password : str
+            password for msfrpcd
+        pool_size : int, optional
+            number of keep-alive connections kept open to msfrpcd
+        connect_timeout : float, optional
+            seconds to wait for a connection to msfrpcd
+        read_timeout : float, optional
+            seconds to wait for msfrpcd to answer a call
+        coalesce : bool, optional
+            merge identical read-only calls into one round trip (default True)
+        coalesce_window : float, optional
+            seconds a finished read-only answer is reused for an identical call
+        record_tape : str, optional
+            record every call (and its answer and timing) to this tape file
+        **kwargs
+            passed through to MsfRpcClient (username, server, port, ssl, ...)
+        """
+        pool_size = int(kwargs.get("pool_size", DEFAULT_POOL_SIZE))
+        self.timeout = (
+            float(kwargs.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+            float(kwargs.get("read_timeout", DEFAULT_READ_TIMEOUT)),
+        )
+        self.timings = {}
+        self.perf = PerfStats()
+        self._timings_lock = threading.Lock()
+        if kwargs.get("coalesce", True):
+            self.coalescer = RpcCoalescer(
+                window=float(kwargs.get("coalesce_window", DEFAULT_WINDOW))
+            )
+        else:
+            self.coalescer = None
+        # created before logging in so the tape starts with auth.login
+        if kwargs.get("record_tape"):
+            self.recorder = TapeRecorder(kwargs["record_tape"])
+        else:
+            self.recorder = None
+
+        self.http = requests.Session()
+        adapter = TLSReuseAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=False
+        )
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.verify = False
+
+        # MsfRpcClient logs in from __init__ so the session must exist before this
+        super().__init__(password, **kwargs)
+        self.headers["Connection"] = "keep-alive"
+
+    def call(self, method, opts=None, is_raw=False):
+        """Make an RPC call to msfrpcd, coalesced with identical read-only calls
+
+        Parameters
+        ----------
+        method : str
+            RPC method name (e.g. 'console.tabs')
+        opts : list, optional
+            arguments to the RPC method
+        is_raw : bool, optional
+            return the undecoded response body
+
+        Returns
+        -------
+        _ : object
+            decoded msfrpcd response
+        """
+        if self.coalescer is None or is_raw:
+            return self._timed_call(method, opts, is_raw)
+        return self.coalescer.call(self._timed_call, method, opts)
+
+    def _timed_call(self, method, opts=None, is_raw=False):
+        if self.recorder is not None and not is_raw:
+            # MsfRpcClient.call empties opts once it has sent them
+            args = list(opts) if isinstance(opts, list) else []
+            started = monotonic()
+        start = perf_counter()
+        try:
+            response = super().call(method, opts, is_raw)
+        finally:
+            elapsed = perf_counter() - start
+            self._record(method, elapsed)
+        if self.recorder is not None and not is_raw:
+            self.recorder.record(method, args, started, elapsed, response)
+        if method in OUTPUT_METHODS and isinstance(response, dict):
+            data = response.get("data") or b""
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            if data:
+                self.perf.incr("output_bytes", len(data))
+        return response
+
+    # connection errors are retried (a stale keep-alive connection, msfrpcd starting);
+    # a read timeout isn't, since msfrpcd may already have run the call
+    # (console.write, module.execute, ...)
+    @retry(exceptions=requests.exceptions.ConnectionError, tries=3, delay=1, backoff=2)
+    def post_request(self, url, payload):
+        return self.http.post(
+            url, data=payload, headers=self.headers, timeout=self.timeout
+        )
+
+    def _record(self, method, elapsed):
+        with self._timings_lock:
+            old = self.timings.get(method)
+            if old is None:
+                self.timings[method] = CallTiming(1, elapsed, elapsed, elapsed)
+            else:
+                self.timings[method] = CallTiming(
+                    old.count + 1, old.total + elapsed, max(old.max, elapsed), elapsed
+                )
+        self.perf.observe(method, elapsed)
+        logging.debug(f"[RPC] {method} took {elapsed * 1000:.1f}ms")
+
+    def close(self):
+        """Close every pooled connection to msfrpcd and the tape, if recording"""
+        self.http.close()
+        if self.recorder is not None:
+            self.recorder.close()
@@ -0,0 +1,105 @@
+"""
+trigram
+=======
+
+Provides TrigramIndex, a precomputed trigram index for fuzzy matching of short
+strings (module paths).
+
+Each string is broken into its overlapping three character pieces and every piece
+points at the strings that contain it.  A query word is matched by counting, for each
+string, how many of the word's trigrams it contains, so 'eternalblue' finds
+'exploit/windows/smb/ms17_010_eternalblue' and 'smb ms17' finds every path containing
+something like both words, without scanning every string for every keystroke.
+"""
+from __future__ import unicode_literals
+
+from collections import Counter, defaultdict
+
+# Fraction of a word's trigrams a string must contain to match it
+DEFAULT_MIN_SIMILARITY = 0.6
+# Number of matches returned
+DEFAULT_LIMIT = 20
+
+
+def trigrams(word):
+    """Overlapping three character pieces of word (the word itself if shorter)"""
+    if len(word) < 3:
+        return {word} if word else set()
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+class TrigramIndex(object):
+    """Fuzzy lookup of strings by the trigrams they share with a query
+
+    Methods
+    -------
+    search(self, query, limit=DEFAULT_LIMIT)
+        Strings matching every word of query, best first
+    """
+
+    def __init__(self, strings, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Parameters
+        ----------
+        strings : iterable[str]
+            strings to index (e.g. module paths)
+        min_similarity : float, optional
+            fraction of a word's trigrams a string must contain to match it
+        """
+        self.strings = list(strings)
+        self.min_similarity = min_similarity
+        self._lowered = [s.lower() for s in self.strings]
+        self._postings = defaultdict(list)
+        for n, string in enumerate(self._lowered):
+            for trigram in trigrams(string):
+                self._postings[trigram].append(n)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def _match_word(self, word):
+        """Similarity of each string that matches word, by string number"""
+        grams = trigrams(word)
+        if len(word) < 3:
+            # too short for trigrams; plain substring test
+            return {n: 1.0 for n, s in enumerate(self._lowered) if word in s}
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._postings.get(gram, ()))
+        matches = {}
+        for n, count in counts.items():
+            similarity = count / len(grams)
+            if word in self._lowered[n]:
+                # an exact substring beats a scattered match of the same trigrams
+                similarity += 1.0
+            if similarity >= self.min_similarity:
+                matches[n] = similarity
+        return matches
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Parameters
+        ----------
+        query : str
+            one or more words
+        limit : int, optional
+            number of matches returned
+
+        Returns
+        -------
+        matches : list[str]
+            strings matching every word, best match (then shortest) first
+        """
+        scores = None
+        for word in query.lower().split():
+            matches = self._match_word(word)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {n: s + matches[n] for n, s in scores.items() if n in matches}
+            if not scores:
+                return []
+        if not scores:
+            return []
+        best = sorted(scores, key=lambda n: (-scores[n], len(self.strings[n])))
+        return [self.strings[n] for n in best[:limit]]
@@ -1,5 +1,12 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from optparse import OptionParser
 
+# Format of every record in the log file
+LOG_FORMAT = "===================\n%(asctime)s\n%(message)s"
+
 
 def parseargs():
     """Parses arguments from the command line.
@@ -10,11 +17,75 @@ def parseargs():
     p.add_option("-U", dest="username", help="Username for msfrpcd")
     p.add_option("-a", dest="server", help="IP address of the msfrpcd server")
     p.add_option("-p", dest="port", help="Listening port for msfrpcd")
+    p.add_option(
+        "-m", dest="consoles", help="Comma separated names of consoles to multiplex"
+    )
+    p.add_option(
+        "--async",
+        dest="async_mode",
+        action="store_true",
+        help="Keep the prompt live while commands run (asyncio main loop)",
+    )
+    p.add_option(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        help="Queue commands typed while earlier ones are still running",
+    )
+    p.add_option(
+        "-r",
+        dest="resource_file",
+        help="Validate and run a resource script without prompting, then exit",
+    )
+    p.add_option(
+        "-o", dest="results_file", help="Where to write the resource script results"
+    )
+    p.add_option(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Take overrides without asking when running a resource script",
+    )
+    p.add_option(
+        "--trace-startup",
+        dest="trace_startup",
+        action="store_true",
+        help="Print how long each phase and import took before the first prompt",
+    )
+    p.add_option(
+        "--record-tape",
+        dest="record_tape",
+        help="Record every msfrpcd call to this tape file (see benchmarks/replay.py)",
+    )
     o, a = p.parse_args()
 
     return o
 
 
+def setup_logging(filename, queued=False):
+    """Send log records to filename
+
+    Parameters
+    ----------
+    filename : str
+        log file
+    queued : bool, optional
+        hand records to a queue and write them from a background thread, so slow
+        disks don't hold up the prompt; records still queued when the process exits
+        are written at exit
+    """
+    if not queued:
+        logging.basicConfig(filename=filename, format=LOG_FORMAT, level=logging.INFO)
+        return
+    handler = logging.FileHandler(filename)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.Queue()
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logging.basicConfig(handlers=[QueueHandler(records)], level=logging.INFO)
+
+
 def parseconfig(filename):
     """Opens a configuration file and returns a dictionary of parameters
 
@@ -17,8 +17,8 @@ setup(
     license="GPL",
     packages=find_packages(),
     scripts=["msf_prompt/usr_tgt_mod.py"],
-    install_requires=["pymetasploit3>=1.0", "prompt_toolkit>=2.0", "setuptools"],
-    python_requires=">=3.6.0",
+    install_requires=["pymetasploit3>=1.0", "prompt_toolkit>=3.0", "setuptools"],
+    python_requires=">=3.7.0",
     # package_data = [""], # consider for the pickle files
     # data_files = [""], # consider for the pickle files
     url="https://github.com/starksimilarity/msf_prompt",